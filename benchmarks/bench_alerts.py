@@ -0,0 +1,71 @@
+"""
+Cost of watching many trackers with AlertEngine against polling every rule once a second,
+when only a few of the trackers are busy. Time is simulated.
+
+Run from the repository root with:
+    python -m benchmarks.bench_alerts
+"""
+import random
+import time
+
+from .context import counttracker
+
+
+class _Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _setup(trackers, seconds, active, events_per_second, seed=1):
+    """Trackers and, for each simulated second, the indices of the trackers logging an event"""
+    rng = random.Random(seed)
+    clock = _Clock(1000000)
+    created = [counttracker.CountTracker(clock=clock) for _ in range(trackers)]
+    busy = rng.sample(range(trackers), active)
+    schedule = [[rng.choice(busy) for _ in range(events_per_second)] for _ in range(seconds)]
+    return clock, created, schedule
+
+
+def bench_watch(trackers=10000, seconds=60, active=10, events_per_second=1000, limit=50000):
+    """
+    An 'above' rule on every tracker, over 60 seconds. Polling checks every rule every second;
+    the engine is only called on by the busy trackers, and its timers.
+
+    :return: dictionary of results
+    """
+    clock, created, schedule = _setup(trackers, seconds, active, events_per_second)
+    start = time.perf_counter()
+    alerts = 0
+    for second, events in enumerate(schedule):
+        clock.now = 1000000 + second
+        for index in events:
+            created[index].log_event()
+        alerts += sum(tracker.get_event_counts(60) > limit for tracker in created)
+    polling = time.perf_counter() - start
+
+    clock, created, schedule = _setup(trackers, seconds, active, events_per_second)
+    engine = counttracker.AlertEngine(callback=lambda alert: None, clock=clock)
+    for tracker in created:
+        engine.above(tracker, 60, limit)
+    start = time.perf_counter()
+    for second, events in enumerate(schedule):
+        clock.now = 1000000 + second
+        engine.poll()
+        for index in events:
+            created[index].log_event()
+    incremental = time.perf_counter() - start
+
+    return {'rules': trackers, 'seconds': seconds, 'events': seconds * events_per_second,
+            'polling_seconds': polling, 'engine_seconds': incremental, 'speedup': polling / incremental}
+
+
+def main():
+    for name, value in bench_watch().items():
+        print('{:<24} {}'.format(name, value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Read throughput of one CountTracker queried by several reader threads while a writer thread keeps logging,
+with the lock-free (seqlock) queries against guarding the tracker with a lock.
+On a build of Python with the GIL, the threads share one core, which caps total reads; even so, readers no
+longer queue on a lock or starve the writer as more are added. On a free threaded build, reads scale with
+the number of readers.
+
+Run from the repository root with:
+    python -m benchmarks.bench_concurrency
+"""
+import sys
+import threading
+import time
+
+from .bench_core import SimulatedClock
+from .context import counttracker
+
+
+class _LockedTracker:
+    """A CountTracker with every call made under one lock"""
+    def __init__(self, tracker):
+        self._tracker = tracker
+        self._lock = threading.Lock()
+
+    def log_event(self):
+        with self._lock:
+            self._tracker.log_event()
+
+    def get_event_counts(self, duration, now=None):
+        with self._lock:
+            return self._tracker.get_event_counts(duration, now)
+
+
+def _run(tracker, clock, readers, seconds):
+    """
+    Log from one thread and query from 'readers' threads for 'seconds', returning (reads, writes) per second.
+    Only the writer reads the tracker's SimulatedClock 'clock', so simulated time passes at the same rate
+    however many readers there are. Readers count back from the writer's time, worked out from its writes.
+    """
+    done = threading.Event()
+    reads = [0] * readers
+    writes = [0]
+
+    def write():
+        log_event = tracker.log_event
+        while not done.is_set():
+            for _ in range(1000):
+                log_event()
+            writes[0] += 1000
+
+    def read(reader):
+        get_event_counts = tracker.get_event_counts
+        while not done.is_set():
+            # No earlier than the writer's current time, which is at most 1000 events past the last count
+            now = clock.start + (writes[0] + 1000) // clock.events_per_second
+            for duration in (1, 10, 60, 300) * 250:
+                get_event_counts(duration, now)
+            reads[reader] += 1000
+
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read, args=(reader,))
+                                                  for reader in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    done.set()
+    for thread in threads:
+        thread.join()
+    return sum(reads) / seconds, writes[0] / seconds
+
+
+def bench_readers(readers=(1, 2, 4, 8), seconds=1, events_per_second=10000):
+    """
+    Reads and writes per second for each number of readers, lock-free and locked.
+
+    :return: dictionary of results
+    """
+    results = {'gil': getattr(sys, '_is_gil_enabled', lambda: True)()}
+    for count in readers:
+        for name, wrap in (('lock_free', lambda tracker: tracker), ('locked', _LockedTracker)):
+            clock = SimulatedClock(events_per_second)
+            tracker = wrap(counttracker.CountTracker(clock=clock))
+            reads, writes = _run(tracker, clock, count, seconds)
+            results['{}_{}_readers_reads_per_second'.format(name, count)] = reads
+            results['{}_{}_readers_writes_per_second'.format(name, count)] = writes
+    return results
+
+
+def main():
+    for name, value in bench_readers().items():
+        print('{:<40} {}'.format(name, value))
+
+
+if __name__ == '__main__':
+    main()
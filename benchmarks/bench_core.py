@@ -0,0 +1,166 @@
+"""
+Hot paths of the trackers: log_event throughput, get_event_counts latency at each duration and memory per
+tracker, for a single thread, several threads and many keys.
+Time is simulated: the clock moves one second forward every 'events_per_second' reads, so a run covers many
+windows of history in a fraction of the time and gives the same buckets every time.
+
+Run from the repository root with:
+    python -m benchmarks.bench_core
+"""
+import itertools
+import threading
+import time
+import tracemalloc
+
+from .context import counttracker
+
+_DURATIONS = (1, 10, 60, 300)
+
+
+class SimulatedClock:
+    """
+    Clock that moves one second forward every 'events_per_second' reads.
+    Reads are counted with itertools.count, which is atomic, so threads can share it.
+    """
+    def __init__(self, events_per_second, start=1000000):
+        self.events_per_second = events_per_second
+        self.start = start
+        self._reads = itertools.count()
+
+    def __call__(self):
+        return self.start + next(self._reads) // self.events_per_second
+
+
+def _seconds(function, *args):
+    """Run function(*args), returning the seconds it took"""
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def _memory(factory):
+    """Bytes allocated by factory() and still held by what it returned"""
+    tracemalloc.start()
+    result = factory()
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return memory
+
+
+def bench_log_event(events=1000000, events_per_second=10000, keys=1000):
+    """
+    Single thread log_event throughput of CountTracker, ConcurrentCountTracker and KeyedCountTracker,
+    over events / events_per_second simulated seconds.
+
+    :return: dictionary of results
+    """
+    def log_all(tracker):
+        log_event = tracker.log_event
+        for _ in range(events):
+            log_event()
+
+    def log_all_keyed(tracker):
+        log_event = tracker.log_event
+        for key in itertools.islice(itertools.cycle(range(keys)), events):
+            log_event(key)
+
+    results = {'events': events}
+    for name, tracker_class, log in (('counttracker', counttracker.CountTracker, log_all),
+                                     ('concurrent', counttracker.ConcurrentCountTracker, log_all),
+                                     ('keyed', counttracker.KeyedCountTracker, log_all_keyed)):
+        tracker = tracker_class(clock=SimulatedClock(events_per_second))
+        results[name + '_per_second'] = events / _seconds(log, tracker)
+    return results
+
+
+def bench_get_event_counts(queries=20000, events_per_second=1000, keys=1000):
+    """
+    get_event_counts latency at each duration, on trackers holding a full window of events.
+
+    :return: dictionary of results
+    """
+    clock = SimulatedClock(events_per_second)
+    trackers = {'counttracker': counttracker.CountTracker(clock=clock),
+                'concurrent': counttracker.ConcurrentCountTracker(clock=clock),
+                'keyed': counttracker.KeyedCountTracker(clock=clock)}
+    for i in range(300 * events_per_second):
+        trackers['counttracker'].log_event()
+        trackers['concurrent'].log_event()
+        trackers['keyed'].log_event(i % keys)
+    now = clock()
+
+    results = {'queries': queries}
+    for name, tracker in trackers.items():
+        for duration in _DURATIONS:
+            if name == 'keyed':
+                query = lambda: tracker.get_event_counts(0, duration, now)
+            else:
+                query = lambda: tracker.get_event_counts(duration, now)
+            seconds = _seconds(lambda: [query() for _ in range(queries)])
+            results['{}_{}s_ns'.format(name, duration)] = seconds / queries * 1e9
+    return results
+
+
+def bench_threads(threads=4, events=250000, events_per_second=10000):
+    """
+    log_event throughput of a ConcurrentCountTracker shared by 'threads' threads, each logging 'events'.
+
+    :return: dictionary of results
+    """
+    tracker = counttracker.ConcurrentCountTracker(clock=SimulatedClock(events_per_second * threads))
+    barrier = threading.Barrier(threads + 1)
+
+    def log_all():
+        barrier.wait()
+        for _ in range(events):
+            tracker.log_event()
+
+    workers = [threading.Thread(target=log_all) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    start = time.perf_counter()
+    barrier.wait()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - start
+
+    logged = tracker.get_event_counts(300)
+    return {'threads': threads, 'events': events * threads, 'logged_in_window': logged,
+            'concurrent_per_second': events * threads / seconds}
+
+
+def bench_memory(trackers=20, keys=10000, events_per_second=10):
+    """
+    Bytes per tracker holding a full window of events, and bytes per key of a KeyedCountTracker.
+
+    :return: dictionary of results
+    """
+    def fill(tracker_class):
+        tracker = tracker_class(clock=SimulatedClock(events_per_second))
+        for _ in range(300 * events_per_second):
+            tracker.log_event()
+        return tracker
+
+    def fill_keyed():
+        tracker = counttracker.KeyedCountTracker(clock=SimulatedClock(keys))
+        for key in range(keys):
+            tracker.log_event(key)
+        return tracker
+
+    return {'counttracker_bytes': _memory(lambda: [fill(counttracker.CountTracker)
+                                                   for _ in range(trackers)]) / trackers,
+            'concurrent_bytes': _memory(lambda: [fill(counttracker.ConcurrentCountTracker)
+                                                 for _ in range(trackers)]) / trackers,
+            'keyed_bytes_per_key': _memory(fill_keyed) / keys}
+
+
+def main():
+    for bench in (bench_log_event, bench_get_event_counts, bench_threads, bench_memory):
+        for name, value in bench().items():
+            print('{:<24} {}'.format(name, value))
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Sustained increments per second and query latency of the counttracker daemon on localhost.
+The daemon runs in its own process; the load generator uses plain blocking sockets.
+
+Run from the repository root with:
+    python -m benchmarks.bench_daemon
+"""
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+
+def _free_port(kind):
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _start_daemon(port, udp_port):
+    """Start the daemon in a new process and wait until it accepts connections"""
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    process = subprocess.Popen([sys.executable, '-m', 'counttracker', '--port', str(port),
+                                '--udp-port', str(udp_port)], cwd=root, stdout=subprocess.PIPE)
+    if not process.stdout.readline():
+        raise RuntimeError('daemon exited with status {}'.format(process.wait()))
+    return process
+
+
+def _request(sock, batch, replies):
+    """Send a batch of lines and read back 'replies' reply lines"""
+    sock.sendall(batch)
+    received = b''
+    while received.count(b'\n') < replies:
+        chunk = sock.recv(1 << 16)
+        if not chunk:
+            raise ConnectionError('daemon closed the connection')
+        received += chunk
+    return received
+
+
+def bench_increments(port, clients=4, seconds=3, batch_size=1000, names=100):
+    """
+    Pipelined 'incr' batches from several connections at once.
+
+    :return: dictionary of results
+    """
+    counts = [0] * clients
+
+    def client(number):
+        with socket.create_connection(('127.0.0.1', port)) as sock:
+            batch = ''.join('incr key{}\n'.format((number * batch_size + i) % names)
+                            for i in range(batch_size)).encode()
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                _request(sock, batch, batch_size)
+                counts[number] += batch_size
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {'clients': clients, 'batch_size': batch_size, 'increments': sum(counts),
+            'increments_per_second': sum(counts) / elapsed}
+
+
+def bench_statsd(port, udp_port, datagrams=20000, lines_per_datagram=20):
+    """
+    StatsD datagrams sent as fast as possible; UDP can drop them, so the share received is reported too.
+
+    :return: dictionary of results
+    """
+    payload = '\n'.join('udp:1|c' for _ in range(lines_per_datagram)).encode()
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        before = int(_request(sock, b'query udp 300\n', 1))
+        start = time.perf_counter()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+            for _ in range(datagrams):
+                udp.sendto(payload, ('127.0.0.1', udp_port))
+        elapsed = time.perf_counter() - start
+        # Give the daemon time to catch up with the datagrams waiting in its buffer
+        time.sleep(0.5)
+        received = int(_request(sock, b'query udp 300\n', 1)) - before
+
+    sent = datagrams * lines_per_datagram
+    return {'increments_sent': sent, 'sent_per_second': sent / elapsed, 'received_fraction': received / sent}
+
+
+def bench_query_latency(port, queries=20000):
+    """
+    One query at a time, waiting for each reply, while the daemon holds a few hundred names.
+
+    :return: dictionary of results
+    """
+    latencies = []
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        _request(sock, ''.join('incr name{} {}\n'.format(i, i) for i in range(500)).encode(), 500)
+        requests = ['query name{} 60\n'.format(i % 500).encode() for i in range(queries)]
+        for request in requests:
+            start = time.perf_counter()
+            _request(sock, request, 1)
+            latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+    return {'queries': queries,
+            'p50_microseconds': latencies[len(latencies) // 2] * 1e6,
+            'p99_microseconds': latencies[int(len(latencies) * 0.99)] * 1e6,
+            'max_microseconds': latencies[-1] * 1e6}
+
+
+def main():
+    port, udp_port = _free_port(socket.SOCK_STREAM), _free_port(socket.SOCK_DGRAM)
+    process = _start_daemon(port, udp_port)
+    try:
+        for bench in (lambda: bench_increments(port), lambda: bench_statsd(port, udp_port),
+                      lambda: bench_query_latency(port)):
+            for name, value in bench().items():
+                print('{:<24} {}'.format(name, value))
+            print()
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Memory per tracker and log_event throughput of DecayingCountTracker against CountTracker,
+with time simulated as in bench_core.
+
+Run from the repository root with:
+    python -m benchmarks.bench_decaying
+"""
+import time
+import tracemalloc
+
+from .bench_core import SimulatedClock
+from .context import counttracker
+
+
+def _memory_per_tracker(factory, trackers):
+    """Bytes per tracker, each holding a few events"""
+    clock = SimulatedClock(1)
+    tracemalloc.start()
+    created = [factory(clock) for _ in range(trackers)]
+    for tracker in created:
+        tracker.log_event()
+        tracker.log_event()
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return memory / trackers
+
+
+def _rate(tracker, events):
+    """Log 'events' single events, returning events per second"""
+    log_event = tracker.log_event
+    start = time.perf_counter()
+    for _ in range(events):
+        log_event()
+    return events / (time.perf_counter() - start)
+
+
+def bench_memory(trackers=100000):
+    """
+    Bytes per tracker, with the default 1, 5 and 15 minute horizons and the default 5 minute window.
+
+    :return: dictionary of results
+    """
+    return {'trackers': trackers,
+            'decaying_bytes': _memory_per_tracker(lambda clock: counttracker.DecayingCountTracker(clock=clock),
+                                                  trackers),
+            'counttracker_bytes': _memory_per_tracker(lambda clock: counttracker.CountTracker(clock=clock),
+                                                      trackers // 10)}
+
+
+def bench_log_event(events=1000000, events_per_second=1000):
+    """
+    Single thread log_event throughput, with the clock moving one second every 'events_per_second' events.
+
+    :return: dictionary of results
+    """
+    return {'events': events,
+            'decaying_per_second': _rate(counttracker.DecayingCountTracker(clock=SimulatedClock(events_per_second)),
+                                         events),
+            'counttracker_per_second': _rate(counttracker.CountTracker(clock=SimulatedClock(events_per_second)),
+                                             events)}
+
+
+def main():
+    for bench in (bench_memory, bench_log_event):
+        for name, value in bench().items():
+            print('{:<24} {}'.format(name, value))
+        print()
+
+
+if __name__ == '__main__':
+    main()
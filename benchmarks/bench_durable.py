@@ -0,0 +1,78 @@
+"""
+Logging throughput of DurableCountTracker against the in memory CountTracker.
+
+Run from the repository root with:
+    python -m benchmarks.bench_durable
+"""
+import os
+import tempfile
+import time
+
+from .context import counttracker
+
+
+class _SteppingClock:
+    """Clock that moves one second forward every 'events_per_second' reads"""
+    def __init__(self, events_per_second, start=1000000):
+        self.events_per_second = events_per_second
+        self.reads = 0
+        self.start = start
+
+    def __call__(self):
+        self.reads += 1
+        return self.start + self.reads // self.events_per_second
+
+
+def _log_all(tracker, events):
+    """Log 'events' single events, returning the seconds it took"""
+    start = time.perf_counter()
+    for _ in range(events):
+        tracker.log_event()
+    return time.perf_counter() - start
+
+
+def bench_overhead(events=3000000, events_per_second=100000, sync_interval=1):
+    """
+    Log the same events into both trackers, with the clock moving one second every 'events_per_second' events.
+
+    :return: dictionary of results
+    """
+    memory_seconds = _log_all(counttracker.CountTracker(clock=_SteppingClock(events_per_second)), events)
+
+    with tempfile.TemporaryDirectory() as directory:
+        log_path = os.path.join(directory, 'bench.log')
+        tracker = counttracker.DurableCountTracker.open(log_path, clock=_SteppingClock(events_per_second),
+                                                        sync_interval=sync_interval)
+        durable_seconds = _log_all(tracker, events)
+        start = time.perf_counter()
+        tracker.close()
+        close_seconds = time.perf_counter() - start
+        log_bytes = os.path.getsize(log_path)
+
+        start = time.perf_counter()
+        recovered = counttracker.DurableCountTracker.open(log_path, clock=_SteppingClock(events_per_second))
+        recover_seconds = time.perf_counter() - start
+        recovered.close()
+
+    return {
+        'events': events,
+        'sync_interval': sync_interval,
+        'memory_events_per_second': events / memory_seconds,
+        'durable_events_per_second': events / durable_seconds,
+        'overhead': durable_seconds / memory_seconds - 1,
+        'close_milliseconds': close_seconds * 1000,
+        'log_bytes': log_bytes,
+        'recover_milliseconds': recover_seconds * 1000,
+    }
+
+
+def main():
+    # Group commit every second, and the worst case of a commit for every bucket
+    for sync_interval in (1, 0):
+        for name, value in bench_overhead(sync_interval=sync_interval).items():
+            print('{:<26} {}'.format(name, value))
+        print()
+
+
+if __name__ == '__main__':
+    main()
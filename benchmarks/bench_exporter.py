@@ -0,0 +1,49 @@
+"""
+Time to render a scrape of MetricsExporter, the first time and then incrementally, when a few of the
+trackers log events between scrapes.
+
+Run from the repository root with:
+    python -m benchmarks.bench_exporter
+"""
+import time
+
+from .context import counttracker
+
+
+def bench_scrape(trackers=12500, durations=(1, 10, 60, 300), active=100, scrapes=10):
+    """
+    Render 'trackers' trackers of 'durations' (trackers * len(durations) series), with 'active' of them
+    logging events between scrapes.
+
+    :return: dictionary of results
+    """
+    exporter = counttracker.MetricsExporter(durations)
+    registered = []
+    for i in range(trackers):
+        tracker = counttracker.CountTracker()
+        tracker.log_events(i % 7)
+        exporter.register('events', tracker, labels={'tracker': i})
+        registered.append(tracker)
+
+    start = time.perf_counter()
+    size = len(exporter.render())
+    first = time.perf_counter() - start
+
+    elapsed = 0
+    for scrape in range(scrapes):
+        for tracker in registered[scrape * active:(scrape + 1) * active]:
+            tracker.log_event()
+        start = time.perf_counter()
+        exporter.render()
+        elapsed += time.perf_counter() - start
+    return {'series': trackers * len(durations), 'bytes': size, 'first_scrape_ms': first * 1000,
+            'incremental_scrape_ms': elapsed / scrapes * 1000}
+
+
+def main():
+    for name, value in bench_scrape().items():
+        print('{:<24} {}'.format(name, value))
+
+
+if __name__ == '__main__':
+    main()
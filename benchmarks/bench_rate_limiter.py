@@ -0,0 +1,76 @@
+"""
+Decisions per second of RateLimiter.try_acquire against checking get_event_counts and then logging by hand.
+
+Run from the repository root with:
+    python -m benchmarks.bench_rate_limiter
+"""
+import random
+import time
+
+from .context import counttracker
+
+
+def _rate(decide, requests):
+    """Run 'decide' on every request, returning decisions per second and the number admitted"""
+    start = time.perf_counter()
+    admitted = 0
+    for request in requests:
+        admitted += decide(request)
+    return len(requests) / (time.perf_counter() - start), admitted
+
+
+def bench_single_key(requests=1000000, limit=100000, duration=60):
+    """
+    One shared limit, as a single CountTracker checked then logged, and as a RateLimiter.
+
+    :return: dictionary of results
+    """
+    tracker = counttracker.CountTracker()
+
+    def naive(_):
+        if tracker.get_event_counts(duration) < limit:
+            tracker.log_event()
+            return True
+        return False
+
+    limiter = counttracker.RateLimiter(limit, duration)
+    naive_rate, naive_admitted = _rate(naive, range(requests))
+    limiter_rate, limiter_admitted = _rate(lambda _: limiter.try_acquire(), range(requests))
+    return {'requests': requests, 'naive_per_second': naive_rate, 'try_acquire_per_second': limiter_rate,
+            'speedup': limiter_rate / naive_rate, 'naive_admitted': naive_admitted,
+            'try_acquire_admitted': limiter_admitted}
+
+
+def bench_keyed(requests=300000, keys=1000, limit=100, duration=60):
+    """
+    A limit per key, as a KeyedCountTracker checked then logged, and as a RateLimiter.
+
+    :return: dictionary of results
+    """
+    rng = random.Random(1)
+    stream = ['10.0.{}.{}'.format(key // 256, key % 256) for key in (rng.randrange(keys) for _ in range(requests))]
+    tracker = counttracker.KeyedCountTracker()
+
+    def naive(key):
+        if tracker.get_event_counts(key, duration) < limit:
+            tracker.log_event(key)
+            return True
+        return False
+
+    limiter = counttracker.RateLimiter(limit, duration)
+    naive_rate, naive_admitted = _rate(naive, stream)
+    limiter_rate, limiter_admitted = _rate(limiter.try_acquire, stream)
+    return {'requests': requests, 'keys': keys, 'naive_per_second': naive_rate,
+            'try_acquire_per_second': limiter_rate, 'speedup': limiter_rate / naive_rate,
+            'naive_admitted': naive_admitted, 'try_acquire_admitted': limiter_admitted}
+
+
+def main():
+    for bench in (bench_single_key, bench_keyed):
+        for name, value in bench().items():
+            print('{:<24} {}'.format(name, value))
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Accuracy and memory of SketchCountTracker against the exact KeyedCountTracker.
+
+Run from the repository root with:
+    python -m benchmarks.bench_sketch
+"""
+import random
+import time
+import tracemalloc
+
+from .context import counttracker
+
+
+def _stream(keys, events, seed=1):
+    """
+    Stream of 'events' keys drawn from 'keys' distinct keys: half of the events are spread evenly
+    over all the keys, the other half are heavily skewed towards a few of them
+    """
+    rng = random.Random(seed)
+    names = ['10.0.{}.{}'.format(key // 256, key % 256) for key in range(keys)]
+    return [names[rng.randrange(keys)] if rng.random() < 0.5 else names[min(int(rng.paretovariate(1.2)) - 1, keys - 1)]
+            for _ in range(events)]
+
+
+def _log_all(tracker_factory, stream):
+    """Log the stream into a new tracker, returning the tracker and the seconds it took"""
+    start = time.perf_counter()
+    tracker = tracker_factory()
+    for key in stream:
+        tracker.log_event(key)
+    return tracker, time.perf_counter() - start
+
+
+def _memory(tracker_factory, stream):
+    """Bytes held by a new tracker after logging the stream (timed separately, as tracing slows it down)"""
+    tracemalloc.start()
+    tracker, _ = _log_all(tracker_factory, stream)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return memory
+
+
+def bench_accuracy(keys=50000, events=200000, epsilon=0.0005, delta=0.01, group_size=60):
+    """
+    Compare estimates and heavy hitters of the sketch with exact per key counts.
+
+    :return: dictionary of results
+    """
+    stream = _stream(keys, events)
+    sketch_factory = lambda: counttracker.SketchCountTracker(epsilon=epsilon, delta=delta, group_size=group_size)
+
+    exact, exact_seconds = _log_all(counttracker.KeyedCountTracker, stream)
+    sketch, sketch_seconds = _log_all(sketch_factory, stream)
+    exact_memory = _memory(counttracker.KeyedCountTracker, stream)
+    sketch_memory = _memory(sketch_factory, stream)
+
+    errors = [sketch.estimate(key, 300) - exact.get_event_counts(key, 300) for key in set(stream)]
+    bound = sketch.error_bound(300)
+
+    threshold = events // 1000
+    true_hitters = {key for key, count in exact.top_k(300, keys) if count >= threshold}
+    found_hitters = {key for key, _ in sketch.heavy_hitters(300, threshold)}
+
+    return {
+        'key_space': keys,
+        'live_keys': len(exact),
+        'events': events,
+        'exact_memory_bytes': exact_memory,
+        'sketch_memory_bytes': sketch_memory,
+        'exact_events_per_second': events / exact_seconds,
+        'sketch_events_per_second': events / sketch_seconds,
+        'mean_error': sum(errors) / len(errors),
+        'max_error': max(errors),
+        'error_bound': bound,
+        'within_bound': sum(error <= bound for error in errors) / len(errors),
+        'heavy_hitter_threshold': threshold,
+        'heavy_hitter_recall': len(true_hitters & found_hitters) / max(len(true_hitters), 1),
+        'heavy_hitter_precision': len(true_hitters & found_hitters) / max(len(found_hitters), 1),
+    }
+
+
+def main():
+    # The sketch uses the same memory for any number of keys, the exact tracker grows with them
+    for keys in (10000, 100000, 1000000):
+        for name, value in bench_accuracy(keys=keys).items():
+            print('{:<26} {}'.format(name, value))
+        print()
+
+
+if __name__ == '__main__':
+    main()
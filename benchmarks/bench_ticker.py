@@ -0,0 +1,47 @@
+"""
+log_event throughput with the coarse clock (the current bucket published by the shared Ticker)
+against calling the clock on every event, on the real clock.
+
+Run from the repository root with:
+    python -m benchmarks.bench_ticker
+"""
+import time
+
+from .context import counttracker
+
+
+def _rate(tracker, events):
+    """Log 'events' single events, returning events per second"""
+    log_event = tracker.log_event
+    start = time.perf_counter()
+    for _ in range(events):
+        log_event()
+    return events / (time.perf_counter() - start)
+
+
+def bench_log_event(events=2000000, resolution=1):
+    """
+    Single thread log_event throughput of a CountTracker and a ConcurrentCountTracker, with both clocks.
+
+    :return: dictionary of results
+    """
+    results = {'events': events, 'resolution': resolution}
+    for name, tracker_class in (('counttracker', counttracker.CountTracker),
+                                ('concurrent', counttracker.ConcurrentCountTracker)):
+        clock_rate = _rate(tracker_class(resolution=resolution), events)
+        coarse_rate = _rate(tracker_class(resolution=resolution, coarse_clock=True), events)
+        results[name + '_clock_per_second'] = clock_rate
+        results[name + '_coarse_per_second'] = coarse_rate
+        results[name + '_speedup'] = coarse_rate / clock_rate
+    return results
+
+
+def main():
+    for resolution in (1, 0.01):
+        for name, value in bench_log_event(resolution=resolution).items():
+            print('{:<32} {}'.format(name, value))
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Runs benchmarks, saves their results as JSON and compares them with the results of an earlier run,
+so performance regressions show up between commits:
+
+    python -m benchmarks.run --output before.json
+    git checkout my-branch
+    python -m benchmarks.run --output after.json --compare before.json
+
+Every bench_* function of the given modules that takes no required arguments is run with its defaults.
+Defaults to the bench_core module, the hot paths of the trackers.
+Results are compared by name: those ending in '_per_second' are better higher, and those ending in
+'_ns', '_ms', '_seconds' or '_bytes' better lower. Exits with status 1 if any got worse by more than the threshold.
+"""
+import argparse
+import datetime
+import importlib
+import inspect
+import json
+import platform
+import subprocess
+import sys
+
+_HIGHER_IS_BETTER = ('_per_second',)
+_LOWER_IS_BETTER = ('_ns', '_ms', '_seconds', '_bytes')
+
+
+def _commit():
+    """Commit hash of the working tree, or None outside a git repository"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, check=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(module_names, select=None):
+    """
+    Run the benchmarks of the given modules.
+
+    :param module_names: iterable of module names in the benchmarks package, for example 'bench_core'
+    :param select: Only run benchmarks whose 'module.function' name contains this string. Defaults to all
+    :return: dictionary of 'module.function' -> dictionary of results
+    """
+    results = {}
+    for module_name in module_names:
+        module = importlib.import_module('.' + module_name, __package__)
+        for name, function in inspect.getmembers(module, inspect.isfunction):
+            full_name = '{}.{}'.format(module_name, name)
+            if not name.startswith('bench_') or function.__module__ != module.__name__:
+                continue
+            if select is not None and select not in full_name:
+                continue
+            if any(parameter.default is parameter.empty
+                   for parameter in inspect.signature(function).parameters.values()):
+                print('skipping {}, it needs arguments'.format(full_name), file=sys.stderr)
+                continue
+            print('running {}'.format(full_name), file=sys.stderr)
+            results[full_name] = function()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with a baseline.
+
+    :param results: dictionary of 'module.function' -> dictionary of results
+    :param baseline: the same, from an earlier run
+    :param threshold: Relative change beyond which a result is a regression, for example 0.1 for 10%
+    :return: list of (benchmark, result name, baseline value, value, relative change, regressed) tuples
+    """
+    changes = []
+    for benchmark, values in results.items():
+        for name, value in values.items():
+            old = baseline.get(benchmark, {}).get(name)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            if name.endswith(_HIGHER_IS_BETTER):
+                sign = -1
+            elif name.endswith(_LOWER_IS_BETTER):
+                sign = 1
+            else:
+                continue
+            change = (value - old) / old
+            changes.append((benchmark, name, old, value, change, sign * change > threshold))
+    return changes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description=__doc__.split('\n\n')[0])
+    parser.add_argument('modules', nargs='*', default=['bench_core'],
+                        help='modules of the benchmarks package to run. Defaults to bench_core')
+    parser.add_argument('-k', dest='select', help='only run benchmarks whose module.function name contains this')
+    parser.add_argument('--output', help='file to save the results to, as JSON')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare the results with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change counted as a regression. Defaults to 0.1 (10%%)')
+    args = parser.parse_args(argv)
+
+    report = {'commit': _commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+              'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+              'results': run(args.modules, args.select)}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    for benchmark, values in report['results'].items():
+        print(benchmark)
+        for name, value in values.items():
+            print('    {:<28} {}'.format(name, value))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print('\ncompared with {}'.format(baseline.get('commit') or args.compare))
+        regressions = 0
+        for benchmark, name, old, value, change, regressed in compare(report['results'], baseline['results'],
+                                                                     args.threshold):
+            regressions += regressed
+            print('    {:<48} {:>14.6g} -> {:<14.6g} {:+7.1%}{}'.format(
+                '{}.{}'.format(benchmark, name), old, value, change, '  REGRESSION' if regressed else ''))
+        if regressions:
+            print('{} regressions'.format(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,30 @@
 # Main class
 from .counttracker import CountTracker
 
+# Variants
+from .concurrent_tracker import ConcurrentCountTracker
+from .shared_tracker import SharedCountTracker
+from .keyed_tracker import KeyedCountTracker
+from .sketch_tracker import SketchCountTracker
+from .tiered_tracker import TieredCountTracker
+from .async_tracker import AsyncCountTracker
+from .durable_tracker import DurableCountTracker
+from .decaying_tracker import DecayingCountTracker
+
+# Rate limiting
+from .rate_limiter import RateLimiter
+
+# Alerting
+from .alerts import AlertEngine, Alert
+
+# Daemon
+from .daemon import CounterDaemon
+
+# Metrics
+from .exporter import MetricsExporter
+
 # Helper classes
+from .snapshot import PeriodicSnapshot
+from .ticker import Ticker
+from .event_bucket import EventBucket
 from .event_second import EventSecond
@@ -0,0 +1,371 @@
+"""
+Threshold alerts over many trackers, evaluated incrementally:
+
+    engine = AlertEngine(callback=print)
+    engine.above(login_failures, 60, 500)     # More than 500 events in 60 seconds
+    engine.drop(requests, 300, 0.8)           # The last 300 seconds have at most 20% of the 300 before
+    engine.start()
+
+Rules are not polled. Logging into a watched tracker only compares its running total with a precomputed
+boundary, the total at which one of its rules could change state, and rules are evaluated again when that
+boundary is reached, when a bucket rolls over, events are logged in a batch or late, or counts are merged
+into the tracker (merge, apply_delta). Without events, a
+rule can only change state as buckets leave its window, so each rule works out the bucket at which that
+could happen, and a single timer thread evaluates it again then. The cost follows the activity of the
+trackers and the rules that change state, not the number of rules times a polling rate.
+"""
+from collections import namedtuple
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+from .counttracker import _duration_buckets
+
+Alert = namedtuple('Alert', ['rule', 'firing', 'count', 'time'])
+Alert.__doc__ = """
+A rule changing state: firing is True when its condition starts holding, and False when it stops.
+count is the number of events in the rule's duration then, and time when it changed, in the tracker's clock units.
+"""
+
+_ABOVE, _BELOW, _DROP = 'above', 'below', 'drop'
+
+
+def _count(tracker, current_bucket, buckets, total):
+    """
+    Number of events in the 'buckets' buckets up to current_bucket, the way get_event_counts counts them,
+    given the running total of the tracker, read once as the head may be incremented meanwhile.
+    """
+    head = tracker._last_time_logged
+    if head is None or current_bucket - buckets >= head:
+        return 0
+    if current_bucket < head:
+        return tracker._count_behind(current_bucket - buckets, current_bucket)
+    return total - tracker._total_at(current_bucket - buckets)
+
+
+def _first_bucket_below(tracker, current_bucket, buckets, count, limit):
+    """
+    First bucket at which the count of the window, 'count' at current_bucket, is at most 'limit'
+    if no more events are logged, as the oldest buckets leave it.
+
+    :return: bucket number
+    """
+    for bucket in range(current_bucket - buckets + 1, current_bucket + 1):
+        count -= tracker._bucket_count_at(bucket)
+        if count <= limit:
+            return bucket + buckets
+    return current_bucket + buckets
+
+
+class Rule:
+    """
+    A condition on the count of a tracker over a duration, registered with an AlertEngine.
+    'firing' tells whether the condition holds, as of its last evaluation.
+    """
+    def __init__(self, tracker, kind, duration, threshold, name):
+        self.tracker = tracker
+        self.kind = kind
+        self.duration = duration
+        self.threshold = threshold
+        self.name = name
+        self.firing = False
+        self._buckets = _duration_buckets(duration, tracker._MEMORY_TIME_LIMIT, tracker._resolution)
+        assert self._buckets > 0, "Duration must be at least {} seconds".format(tracker._resolution)
+
+    def __repr__(self):
+        return 'Rule({!r}, {}, {}, {})'.format(self.name, self.kind, self.duration, self.threshold)
+
+    def _evaluate(self, current_bucket):
+        """
+        Evaluate the rule at current_bucket. Reads the tracker without checking its version; the caller does.
+
+        :param current_bucket: integer, bucket number, no earlier than the head of the tracker
+        :return: (whether it holds, count, running total of the tracker at which logging could change that
+            or infinity, bucket at which buckets leaving the window could change that or None)
+        """
+        tracker, buckets, threshold = self.tracker, self._buckets, self.threshold
+        total = tracker._total
+        count = _count(tracker, current_bucket, buckets, total)
+
+        if self.kind == _ABOVE:
+            if count > threshold:
+                return True, count, float('inf'), _first_bucket_below(tracker, current_bucket, buckets, count,
+                                                                      threshold)
+            return False, count, total + threshold - count + 1, None
+
+        if self.kind == _BELOW:
+            if count < threshold:
+                return True, count, total + threshold - count, None
+            return False, count, float('inf'), _first_bucket_below(tracker, current_bucket, buckets, count,
+                                                                   threshold - 1)
+
+        # Drop: the count of the current window against the window before it. Events only raise the current
+        #   count; the counts move as buckets pass from the current window into the one before, and out of it
+        previous = _count(tracker, current_bucket, 2 * buckets, total) - count
+        # Rather than (1 - ratio) * previous, which is not exact for ratios like 0.8
+        limit = previous - threshold * previous
+        firing = previous > 0 and count <= limit
+        # The oldest bucket with events in each window is the first to move out of it
+        next_bucket = None
+        for first_bucket, leaves_after in ((current_bucket - 2 * buckets + 1, 2 * buckets),
+                                           (current_bucket - buckets + 1, buckets)):
+            for bucket in range(first_bucket, first_bucket + buckets):
+                if tracker._bucket_count_at(bucket):
+                    if next_bucket is None or bucket + leaves_after < next_bucket:
+                        next_bucket = bucket + leaves_after
+                    break
+        if firing:
+            return True, count, total + int(limit) + 1 - count, next_bucket
+        return False, count, float('inf'), next_bucket
+
+
+class _Watch:
+    """The rules of one tracker, the running total at which to evaluate them again, and its timer"""
+    __slots__ = ('tracker', 'rules', 'boundary', 'timer', 'log_event', 'log_count', 'add_counts')
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self.rules = []
+        self.boundary = float('inf')
+        self.timer = None  # Bucket number
+        # The tracker's own methods, if it had replaced them for itself (as with a coarse clock)
+        self.log_event = tracker.__dict__.get('log_event')
+        self.log_count = tracker.__dict__.get('_log_count')
+        self.add_counts = tracker.__dict__.get('_add_counts')
+
+
+class AlertEngine:
+    """
+    Evaluates threshold rules on CountTrackers incrementally, and reports every rule that starts or stops
+    holding as an Alert, to a callback or the 'alerts' queue.
+    Rules are evaluated in the thread that logs the events that change them, or in the timer thread
+    (or the caller of poll) when time does, so callbacks can run on any of these threads.
+    The trackers must use the same clock units as the engine.
+    """
+    def __init__(self, callback=None, clock=None, max_wait=1):
+        """
+        :param callback: Function called with each Alert. Defaults to putting them on the 'alerts' queue
+        :param clock: Function returning the current time, for the timers. Defaults to time.time
+        :param max_wait: Longest the timer thread sleeps between two checks of the clock, in seconds
+        """
+        self.alerts = queue.SimpleQueue()
+        self._callback = callback if callback is not None else self.alerts.put
+        self._clock = clock if clock is not None else time.time
+        self._max_wait = max_wait
+        self._watches = {}  # id of the tracker -> _Watch
+        self._timers = []  # Heap of (time, sequence number, _Watch, bucket number)
+        self._sequence = itertools.count()
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def _add(self, tracker, kind, duration, threshold, name):
+        rule = Rule(tracker, kind, duration, threshold, name)
+        with self._lock:
+            watch = self._watches.get(id(tracker))
+            if watch is None:
+                watch = self._watches[id(tracker)] = self._watch(tracker)
+            watch.rules.append(rule)
+        self._evaluate(watch)
+        return rule
+
+    def above(self, tracker, duration, limit, name=None):
+        """
+        Alert while the tracker counts more than 'limit' events in 'duration' seconds.
+        As for every rule, an alert is reported right away if the condition already holds.
+
+        :param tracker: CountTracker
+        :param duration: Number of seconds into the past, as for get_event_counts
+        :param limit: integer: Number of events
+        :param name: Name of the rule, for the alerts
+        :return: Rule
+        """
+        return self._add(tracker, _ABOVE, duration, limit, name)
+
+    def below(self, tracker, duration, limit, name=None):
+        """
+        Alert while the tracker counts fewer than 'limit' events in 'duration' seconds,
+        for example when a heartbeat stops.
+
+        :param tracker: CountTracker
+        :param duration: Number of seconds into the past, as for get_event_counts
+        :param limit: positive integer: Number of events
+        :param name: Name of the rule, for the alerts
+        :return: Rule
+        """
+        assert limit > 0, "Limit must be positive"
+        return self._add(tracker, _BELOW, duration, limit, name)
+
+    def drop(self, tracker, duration, ratio, name=None):
+        """
+        Alert while the count of the last 'duration' seconds has dropped by at least 'ratio' against the
+        'duration' seconds before, for example 0.8 for a drop of 80%.
+
+        :param tracker: CountTracker, whose window is at least twice the duration
+        :param duration: Number of seconds into the past, as for get_event_counts
+        :param ratio: Number between 0 and 1
+        :param name: Name of the rule, for the alerts
+        :return: Rule
+        """
+        assert 0 < ratio <= 1, "Ratio must be between 0 and 1"
+        assert 2 * duration <= tracker._MEMORY_TIME_LIMIT, \
+            "Duration must be at most half of the window, {} seconds".format(tracker._MEMORY_TIME_LIMIT)
+        return self._add(tracker, _DROP, duration, ratio, name)
+
+    def remove(self, rule):
+        """
+        Stop evaluating a rule. A tracker without rules left is no longer watched.
+
+        :param rule: Rule
+        :return: None
+        """
+        with self._lock:
+            watch = self._watches[id(rule.tracker)]
+            watch.rules.remove(rule)
+            if watch.rules:
+                self._evaluate(watch)
+                return
+            del self._watches[id(rule.tracker)]
+            watch.timer = None
+            tracker = watch.tracker
+            for attribute, method in (('log_event', watch.log_event), ('_log_count', watch.log_count),
+                                      ('_add_counts', watch.add_counts)):
+                if method is None:
+                    delattr(tracker, attribute)
+                else:
+                    setattr(tracker, attribute, method)
+
+    def _watch(self, tracker):
+        """
+        Replace the logging methods of a tracker for itself, so logging reports the events that may change
+        its rules: a single event only when the running total reaches the boundary, and batches, late events,
+        new buckets and merged counts every time.
+
+        :return: _Watch
+        """
+        watch = _Watch(tracker)
+        log_event, log_count, add_counts = tracker.log_event, tracker._log_count, tracker._add_counts
+
+        def watched_log_event(at=None):
+            log_event(at)
+            if tracker._total >= watch.boundary:
+                self._evaluate(watch)
+
+        def watched_log_count(bucket, count):
+            log_count(bucket, count)
+            self._evaluate(watch)
+
+        def watched_add_counts(increments):
+            add_counts(increments)
+            self._evaluate(watch)
+
+        tracker.log_event = watched_log_event
+        tracker._log_count = watched_log_count
+        tracker._add_counts = watched_add_counts
+        return watch
+
+    def _evaluate(self, watch, current_bucket=None):
+        """
+        Evaluate the rules of a tracker, report those that changed state, and work out the next boundary and timer.
+
+        :param watch: _Watch
+        :param current_bucket: Bucket to evaluate at, if later than the tracker's current bucket
+        :return: None
+        """
+        tracker = watch.tracker
+        alerts = []
+        with self._lock:
+            if self._watches.get(id(tracker)) is not watch:
+                return
+            now = tracker._clock()
+            clock_bucket = int(now * tracker._scale)
+            # Another thread may be moving the head or adding late events: evaluate again if it did meanwhile,
+            #   as get_event_counts does
+            while True:
+                version = tracker._version
+                if not version & 1:
+                    # A timer's bucket may be a moment ahead of the clock, and events may have been logged ahead of it
+                    buckets = [clock_bucket, current_bucket, tracker._last_time_logged]
+                    evaluate_bucket = max(bucket for bucket in buckets if bucket is not None)
+                    results = [rule._evaluate(evaluate_bucket) for rule in watch.rules]
+                    if tracker._version == version:
+                        break
+                tracker._wait_for_writer()
+
+            boundary = float('inf')
+            timer = None
+            for rule, (firing, count, rule_boundary, rule_timer) in zip(watch.rules, results):
+                if firing != rule.firing:
+                    rule.firing = firing
+                    alerts.append(Alert(rule, firing, count, now))
+                boundary = min(boundary, rule_boundary)
+                if rule_timer is not None and (timer is None or rule_timer < timer):
+                    timer = rule_timer
+            watch.boundary = boundary
+
+            if timer != watch.timer:
+                watch.timer = timer
+                if timer is not None:
+                    at = timer * tracker._resolution * tracker._clock_rate
+                    if not self._timers or at < self._timers[0][0]:
+                        self._wake.set()
+                    heapq.heappush(self._timers, (at, next(self._sequence), watch, timer))
+
+        for alert in alerts:
+            self._callback(alert)
+
+    def poll(self, now=None):
+        """
+        Evaluate the rules whose timers are due.
+
+        :param now: Current time, in the clock's units. Defaults to the current time
+        :return: Time the next timer is due, or None
+        """
+        if now is None:
+            now = self._clock()
+        while True:
+            with self._lock:
+                if not self._timers:
+                    return None
+                at, _, watch, timer = self._timers[0]
+                if at > now:
+                    return at
+                heapq.heappop(self._timers)
+                if watch.timer != timer:
+                    continue  # Replaced by a later evaluation
+                watch.timer = None
+            self._evaluate(watch, timer)
+
+    def _run(self):
+        while not self._stopped:
+            next_time = self.poll()
+            wait = self._max_wait if next_time is None else min(next_time - self._clock(), self._max_wait)
+            self._wake.wait(max(wait, 0))
+            self._wake.clear()
+
+    def start(self):
+        """
+        Evaluate the rules whose timers are due from a background thread, as they become due.
+
+        :return: None
+        """
+        assert self._thread is None, "The engine is already running"
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='counttracker-alerts', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread.
+
+        :return: None
+        """
+        if self._thread is None:
+            return
+        self._stopped = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
@@ -0,0 +1,184 @@
+import asyncio
+
+from .counttracker import CountTracker, _duration_buckets
+
+
+class AsyncCountTracker:
+    """
+    Keeps track of the counts of events that have happened over the past 5 minutes (or any window and
+    resolution, as for CountTracker), for use from asyncio code.
+    Logging is a plain method that never awaits or blocks the event loop. A background task moves the
+    tracker forward at every bucket boundary, so expired buckets are cleared there instead of by the
+    first event or query of a new bucket, and queries only read the running totals.
+    Rolling counts can also be streamed with watch(); every subscriber watching with the same interval
+    and durations shares a single publisher, so the counts are computed once per interval.
+
+    Use it as an async context manager, or call start() and close() from a coroutine:
+        async with AsyncCountTracker() as tracker:
+            tracker.log_event()
+            count = await tracker.get_event_counts(60)
+    """
+    def __init__(self, window=300, resolution=1, clock=None, clock_rate=1, max_lateness=None):
+        """
+        :param window: Number of seconds to keep track of. Defaults to 5 minutes
+        :param resolution: Width of a bucket in seconds. Defaults to 1 second
+        :param clock: Function returning the current time. Defaults to time.time
+        :param clock_rate: Number of clock units in a second, for example 1e9 for time.monotonic_ns
+        :param max_lateness: Number of seconds an event can be behind the latest event logged and still be
+            counted. Defaults to the window
+        """
+        self._tracker = CountTracker(window, resolution, clock, clock_rate, max_lateness)
+        self._clock = self._tracker._clock
+        self._expiry_task = None
+
+        # Publisher tasks and their subscribers' queues, keyed by (interval, durations)
+        self._publishers = {}
+        self._subscribers = {}
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def start(self):
+        """
+        Start the background expiry task on the running event loop.
+
+        :return: None
+        """
+        if self._expiry_task is None:
+            self._expiry_task = asyncio.get_running_loop().create_task(self._expire())
+
+    async def close(self):
+        """
+        Stop the background expiry task and every publisher. Subscribers' watch() loops end.
+
+        :return: None
+        """
+        tasks = list(self._publishers.values())
+        if self._expiry_task is not None:
+            tasks.append(self._expiry_task)
+            self._expiry_task = None
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for queues in self._subscribers.values():
+            for queue in queues:
+                _replace(queue, None)
+        self._publishers.clear()
+        self._subscribers.clear()
+
+    async def _expire(self):
+        """
+        Move the tracker forward to the current bucket once per resolution, until cancelled.
+
+        :return: None
+        """
+        tracker = self._tracker
+        while True:
+            current_bucket = int(self._clock() * tracker._scale)
+            if tracker._last_time_logged is None or current_bucket > tracker._last_time_logged:
+                tracker._log_count(current_bucket, 0)
+            await asyncio.sleep(tracker._resolution)
+
+    def log_event(self, at=None):
+        """
+        Log event at the current time (bucket). Does not block; call it without await.
+
+        :param at: Time of the event, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        self._tracker.log_event(at)
+
+    def log_events(self, n, at=None):
+        """
+        Log n events at once, all in the same bucket. Does not block; call it without await.
+
+        :param n: integer: Number of events to log
+        :param at: Time of the events, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        self._tracker.log_events(n, at)
+
+    async def get_event_counts(self, duration, now=None):
+        """
+        Get the number of events that have happened in the past X seconds, specified by 'duration',
+        counted the same way as CountTracker.get_event_counts.
+
+        :param duration: integer: Number of seconds into the past to count events of
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
+        :return: Total number of events that occurred in the past 'duration' seconds
+        """
+        return self._tracker.get_event_counts(duration, now)
+
+    async def _publish(self, key):
+        """
+        Compute a snapshot of the rolling counts every interval and hand it to every subscriber of 'key'.
+        A subscriber that has not taken the previous snapshot yet only sees the newest one.
+
+        :param key: tuple (interval, durations)
+        :return: None
+        """
+        interval, durations = key
+        tracker = self._tracker
+        while True:
+            now = self._clock()
+            snapshot = dict(zip(durations, tracker.get_event_counts_many(durations, now)))
+            for queue in self._subscribers[key]:
+                _replace(queue, snapshot)
+            await asyncio.sleep(interval)
+
+    async def watch(self, interval, durations=(1, 60, 300)):
+        """
+        Stream the rolling counts over 'durations' every 'interval' seconds, starting immediately:
+            async for snapshot in tracker.watch(1, durations=[1, 60, 300]):
+                print(snapshot[60])
+        Snapshots are dicts from duration to count. A slow subscriber skips snapshots rather than queueing
+        them. The stream ends when the tracker is closed. To stop watching early and release the
+        subscription straight away, close the stream, for example with contextlib.aclosing.
+
+        :param interval: Number of seconds between snapshots
+        :param durations: iterable of durations to count, each valid for get_event_counts
+        :return: Asynchronous iterator of snapshots
+        """
+        assert isinstance(interval, (int, float)) and interval > 0, "Interval must be a positive number"
+        durations = tuple(durations)
+        for duration in durations:
+            _duration_buckets(duration, self._tracker._MEMORY_TIME_LIMIT, self._tracker._resolution)
+
+        key = (interval, durations)
+        queue = asyncio.Queue(maxsize=1)
+        self._subscribers.setdefault(key, []).append(queue)
+        if key not in self._publishers:
+            self._publishers[key] = asyncio.get_running_loop().create_task(self._publish(key))
+
+        try:
+            while True:
+                snapshot = await queue.get()
+                if snapshot is None:
+                    return
+                yield snapshot
+        finally:
+            queues = self._subscribers.get(key)
+            if queues is not None:
+                queues.remove(queue)
+                if not queues:
+                    del self._subscribers[key]
+                    self._publishers.pop(key).cancel()
+
+
+def _replace(queue, item):
+    """
+    Put 'item' in a queue of size 1, replacing the item waiting there, if any.
+
+    :param queue: asyncio.Queue with maxsize 1
+    :param item: Item to put
+    :return: None
+    """
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(item)
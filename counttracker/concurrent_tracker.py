@@ -0,0 +1,136 @@
+import threading
+import time
+
+from .counttracker import CountTracker, _check_config, _duration_buckets
+from .ticker import Ticker
+
+
+class ConcurrentCountTracker:
+    """
+    Keeps track of the counts of events that have happened over the past 5 minutes (or any window and
+    resolution, as for CountTracker), and can be shared by many threads.
+    Every thread logs into its own CountTracker shard, so logging never takes a lock and
+    threads never race on the same counters. Queries add up the counts of all the shards.
+    """
+    def __init__(self, window=300, resolution=1, clock=None, clock_rate=1, max_lateness=None, coarse_clock=False):
+        """
+        :param window: Number of seconds to keep track of. Defaults to 5 minutes
+        :param resolution: Width of a bucket in seconds. Defaults to 1 second
+        :param clock: Function returning the current time. Defaults to time.time
+        :param clock_rate: Number of clock units in a second, for example 1e9 for time.monotonic_ns
+        :param max_lateness: Number of seconds an event can be behind the latest event logged by the same
+            thread and still be counted. Defaults to the window
+        :param coarse_clock: If True (or a Ticker), log_event reads the current bucket published by a
+            background thread instead of calling the clock, as for CountTracker
+        """
+        _check_config(window, resolution)
+        self._MEMORY_TIME_LIMIT = window
+        self._resolution = resolution
+        if isinstance(coarse_clock, Ticker):
+            clock = coarse_clock._clock
+        self._clock = clock if clock is not None else time.time
+        self._clock_rate = clock_rate
+        self._max_lateness = max_lateness
+        self._coarse_clock = coarse_clock
+
+        # Each thread finds its shard through thread local storage.
+        # The list of all shards (with the thread that owns each one) is only modified
+        #   when a thread logs for the first time, which is the only time the lock is taken
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+
+    def _new_shard(self):
+        """
+        Create the shard for the current thread and register it.
+        Shards of threads that have exited are dropped once they hold no events in the window,
+        so a thread pool that replaces its threads does not grow the list forever.
+
+        :return: CountTracker shard for the current thread
+        """
+        shard = CountTracker(self._MEMORY_TIME_LIMIT, self._resolution, self._clock, self._clock_rate,
+                             self._max_lateness, self._coarse_clock)
+        with self._shards_lock:
+            self._shards = [(thread, old_shard) for thread, old_shard in self._shards
+                            if thread.is_alive() or old_shard.get_event_counts(self._MEMORY_TIME_LIMIT)]
+            self._shards.append((threading.current_thread(), shard))
+        self._local.shard = shard
+        return shard
+
+    def log_event(self, at=None):
+        """
+        Log event at the current time (second).
+
+        :param at: Time of the event, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard.log_event(at)
+
+    def log_events(self, n, at=None):
+        """
+        Log n events at once, all at the same second.
+
+        :param n: integer: Number of events to log
+        :param at: Time of the events, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard.log_events(n, at)
+
+    def log_events_at(self, timestamps):
+        """
+        Log one event per timestamp in 'timestamps', which does not need to be sorted.
+
+        :param timestamps: iterable of times in the clock's units, e.g. a list, array.array or numpy.ndarray
+        :return: None
+        """
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard.log_events_at(timestamps)
+
+    def get_event_counts(self, duration, now=None):
+        """
+        Get the number of events that all threads have logged in the past X seconds, specified by 'duration'.
+        Same semantics as CountTracker.get_event_counts. Does not take any lock; events logged by other
+        threads while the query runs may or may not be included.
+
+        :param duration: integer: Number of seconds into the past to count events of
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
+        :return: Total number of events that occurred in the past 'duration' seconds
+        """
+        _duration_buckets(duration, self._MEMORY_TIME_LIMIT, self._resolution)
+
+        if now is None:
+            now = self._clock()
+        # The list is replaced rather than modified in place, so iterating it needs no lock
+        return sum(shard.get_event_counts(duration, now) for _, shard in self._shards)
+
+    def get_event_counts_many(self, durations, now=None):
+        """
+        Get the number of events all threads have logged in each of several durations, with a single clock read.
+        Same semantics as CountTracker.get_event_counts_many.
+
+        :param durations: iterable of numbers of seconds into the past to count events of
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
+        :return: List of the total number of events in each duration, in the same order
+        """
+        durations = list(durations)
+        for duration in durations:
+            _duration_buckets(duration, self._MEMORY_TIME_LIMIT, self._resolution)
+
+        if now is None:
+            now = self._clock()
+        counts = [0] * len(durations)
+        for _, shard in self._shards:
+            counts = [count + shard_count
+                      for count, shard_count in zip(counts, shard.get_event_counts_many(durations, now))]
+        return counts
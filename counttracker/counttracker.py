@@ -1,84 +1,389 @@
-from collections import deque
+from array import array
+from collections import Counter
+import math
+import mmap
+import os
+import struct
 import time
+import weakref
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional; batches are grouped in pure Python without it
+    numpy = None
+
+from .stats import Stats, _SlidingStats
+from .ticker import Ticker, shared_ticker
+
+
+# Snapshot files start with a header holding the configuration and the head of the ring buffer,
+#   followed by the counts, timestamps and cumulative arrays, all in the machine's byte order.
+#   The header is a multiple of 8 bytes, so the arrays can be used in place from a memory map
+_SNAPSHOT_MAGIC = b'CTRK'
+_SNAPSHOT_VERSION = 1
+# magic, version, window, resolution, clock rate, bucket count, lateness, dropped events,
+#   last time logged, last index logged (-1 if nothing has been logged)
+_SNAPSHOT_HEADER = struct.Struct('=4sIdddqqqqq')
+
+# Deltas start with a header holding the configuration and the number of records,
+#   followed by (bucket number, count) records, all in the machine's byte order
+_DELTA_MAGIC = b'CTDL'
+_DELTA_VERSION = 1
+# magic, version, window, resolution, clock rate, number of records
+_DELTA_HEADER = struct.Struct('=4sIdddq')
+
+# Largest running total the 64 bit arrays can hold
+_MAX_TOTAL = 2 ** 63 - 1
+
+
+def _check_config(window, resolution):
+    """
+    Check a window and resolution, and work out how many buckets the window holds.
+
+    :param window: Number of seconds to keep track of
+    :param resolution: Width of a bucket in seconds
+    :return: integer, number of buckets in the window
+    """
+    assert isinstance(resolution, (int, float)) and resolution > 0, "Resolution must be a positive number"
+    assert isinstance(window, (int, float)) and window > 0, "Window must be a positive number"
+    bucket_count = round(window / resolution)
+    assert bucket_count >= 1 and abs(bucket_count * resolution - window) < 1e-9 * window, \
+        "Window must be a whole number of buckets"
+    return bucket_count
+
+
+def _sync_directory(path):
+    """
+    Sync a directory to disk, so the files just created or renamed in it survive a power loss.
+    Does nothing where directories cannot be opened (Windows).
+
+    :param path: Path of the directory
+    :return: None
+    """
+    if os.name != 'posix':
+        return
+    directory = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def _duration_buckets(duration, window, resolution):
+    """
+    Check a query duration and convert it to a number of buckets.
+
+    :param duration: Number of seconds into the past
+    :param window: Number of seconds kept track of
+    :param resolution: Width of a bucket in seconds
+    :return: integer, number of buckets in the duration
+    """
+    assert isinstance(duration, (int, float)) and duration >= 0, "Duration must be a nonnegative integer"
+    assert duration <= window, "Duration must be less than or equal to {} seconds".format(window)
+    buckets = round(duration / resolution)
+    assert abs(buckets * resolution - duration) < 1e-9 * window, \
+        "Duration must be a multiple of {} seconds".format(resolution)
+    return buckets
 
-from .event_second import EventSecond
 
 class CountTracker:
     """
     Keeps track of the counts of events that have happened over the past 5 minutes.
     Precision is to the current second. So for example, if an event happens at 5:50 and 12.34 seconds,
     it will be considered to have happened at 5:50 and 12 seconds, truncating the milliseconds associated.
+
+    Both can be configured: the window can be any whole number of buckets, and a bucket can be
+    any width, for example 100 milliseconds or a minute.
+
+    The clock can be replaced, and events can be logged and counted at explicit times, to replay or backfill
+    historical events faster than real time. Events may arrive out of order, up to max_lateness seconds
+    behind the latest event logged.
     """
-    def __init__(self):
-        # History is a double ended queue to allow for fast pops on the left and fast appends on the right.
-        # It will remain sorted by timestamp, with earlier times occurring further to the left,
-        #   and later times occurring further to the right
-        # Events that occur earlier than the MEMORY_TIME_LIMIT will be removed in history
-        self._MEMORY_TIME_LIMIT = 300  # 5 minutes * 60 seconds per minute
+    def __init__(self, window=300, resolution=1, clock=None, clock_rate=1, max_lateness=None, coarse_clock=False,
+                 _arrays=None):
+        """
+        :param window: Number of seconds to keep track of. Defaults to 5 minutes
+        :param resolution: Width of a bucket in seconds; event times are truncated to it. Defaults to 1 second
+        :param clock: Function returning the current time. Defaults to time.time
+        :param clock_rate: Number of clock units in a second, for example 1e9 for time.monotonic_ns.
+            Times passed as 'at' or 'now' are in the same units as the clock
+        :param max_lateness: Number of seconds an event can be behind the latest event logged and still be
+            counted; later events are dropped. Logging a late event costs time proportional to how late it is.
+            Defaults to the window
+        :param coarse_clock: If True, log_event reads the current bucket published by a background thread
+            shared by all such trackers in the process (see Ticker) instead of calling the clock, which makes
+            it about twice as fast, at the cost of events right after a bucket boundary sometimes counting in the
+            bucket before. Needs the default clock. A Ticker can be passed instead, to use its clock
+        """
+        # History is a fixed size ring buffer with one slot per bucket, indexed by bucket number % buffer size.
+        #   A bucket number is the Unix time divided by the resolution, truncated
+        # _timestamps is a parallel array holding the bucket number each slot currently belongs to,
+        #   so slots left over from an earlier pass around the ring can be recognized as stale
+        # _cumulative holds the running total of all events logged up to the end of each bucket
+        #   (a circular prefix sum), so the count for any duration is one subtraction.
+        #   For the bucket at the head, it holds the running total up to the start of the bucket instead,
+        #   so logging into the head only has to increment its count
+        # The buffer holds one bucket more than the window, so the running total just
+        #   before the oldest bucket in the window is still available
+        # Memory use is fixed no matter how many events are logged: three 8 byte integers per bucket
+        self._MEMORY_TIME_LIMIT = window
+        self._resolution = resolution
+        self._bucket_count = _check_config(window, resolution)
+        if isinstance(coarse_clock, Ticker):
+            assert clock is None or clock is coarse_clock._clock, "A ticker can only be used with its own clock"
+            clock = coarse_clock._clock
+        elif coarse_clock:
+            assert clock in (None, time.time), "A coarse clock can only be used with the default clock"
+        self._clock = clock if clock is not None else time.time
+        assert clock_rate > 0, "Clock rate must be positive"
+        self._clock_rate = clock_rate
+        self._scale = 1 / (resolution * clock_rate)
+        if coarse_clock:
+            ticker = coarse_clock if isinstance(coarse_clock, Ticker) else shared_ticker()
+            self._tick = ticker.subscribe(self._scale)
+            weakref.finalize(self, ticker.unsubscribe, self._scale)
+            # Replaces the method for this tracker only, so log_event of other trackers does not pay for a check
+            self.log_event = self._log_event_coarse
 
-        self._history = deque(maxlen=self._MEMORY_TIME_LIMIT)  # Prevents the queue from getting too
-                                                               # long and causing a memory leakage
-        self._last_time_cleared = time.time()
-        self._last_time_logged = None
-        self._last_time_logged_count = 0
+        if max_lateness is None:
+            max_lateness = window
+        assert max_lateness >= 0, "Maximum lateness must be nonnegative"
+        # Number of buckets an event can be behind the head; the oldest bucket in the window is the limit
+        self._lateness = min(math.ceil(max_lateness / resolution - 1e-9), self._bucket_count - 1)
+        self._dropped_count = 0
 
+        buffer_size = self._bucket_count + 1
+        # load passes in the arrays restored from a snapshot instead
+        if _arrays is None:
+            _arrays = array('q', [0]) * buffer_size, array('q', [-1]) * buffer_size, array('q', [0]) * buffer_size
+        self._counts, self._timestamps, self._cumulative = _arrays
+        self._last_time_logged = None  # Bucket number
+        self._last_index_logged = 0
+        # Sequence number for readers in other threads (a seqlock): odd while the head is moving or a late
+        #   event is being added, which write to several slots one after the other. Readers retry if it
+        #   changed while they read. Logging into the head is a single increment, which needs no change
+        self._version = 0
+        self._exported = None  # Copies of the timestamps and counts at the last export_delta
+        self._stats = {}  # Number of buckets -> _SlidingStats of the closed buckets, for stats
 
-    def _remove_old_events(self, current_time):
+    def _advance(self, current_bucket):
         """
-        Remove old events from history
-        An old event is one that occurred more than MEMORY_TIME_LIMIT seconds before the current time
-        :param current_time: time in seconds
+        Move the head of the ring buffer forward to current_bucket.
+        The bucket being left is closed off with the running total, and every bucket skipped over
+        (at most one full pass around the ring) is claimed with a count of zero.
+
+        :param current_bucket: integer, bucket number
         :return: None
         """
-        oldest_event_second_allowed = EventSecond(current_time - self._MEMORY_TIME_LIMIT)
+        buffer_size = len(self._counts)
+        last_bucket = self._last_time_logged
+        self._check_room(0)
+        self._version += 1
+        total = self._total
 
-        while True:
-            try:
-                oldest_event_second = self._history[0]
-            except IndexError:
-                # history is empty
-                break
-            if oldest_event_second < oldest_event_second_allowed:
-                # The oldest event second is outside the accepted amount of time to keep track of
-                # Remove it from history and check the next oldest
-                self._history.popleft()
-            else:
-                # The oldest event second is still recent enough to keep track of
-                break
+        if last_bucket is None:
+            first_bucket = current_bucket
+        else:
+            # A copy, as stats in another thread may add statistics meanwhile. Statistics that a query added
+            #   for an earlier head are left alone; they no longer match any query and are built again
+            for window_stats in tuple(self._stats.values()):
+                if window_stats.last_bucket == last_bucket - 1:
+                    window_stats.close(last_bucket, self._counts[self._last_index_logged], current_bucket)
+            self._cumulative[self._last_index_logged] = total
+            first_bucket = max(last_bucket + 1, current_bucket - buffer_size + 1)
+
+        for bucket in range(first_bucket, current_bucket + 1):
+            index = bucket % buffer_size
+            self._timestamps[index] = bucket
+            self._counts[index] = 0
+            self._cumulative[index] = total
+
+        self._last_index_logged = current_bucket % buffer_size
+        self._last_time_logged = current_bucket
+        self._version += 1
 
-    def _log_latest_second(self):
+    def _log_count(self, bucket, count):
         """
-        Store the latest second into history if there is anything 'cached'
+        Add 'count' events to 'bucket', which may be before, at or after the latest bucket logged.
+        Buckets after the latest one move the head forward. Earlier buckets are added in place,
+        which also has to update the running totals of every later bucket, so the cost grows with
+        how late the events are. Events later than max_lateness are dropped.
 
+        :param bucket: integer, bucket number
+        :param count: integer, number of events
         :return: None
         """
-        if self._last_time_logged is not None:
-            ts = EventSecond(float(self._last_time_logged))
-            ts.count = self._last_time_logged_count
-            self._history.append(ts)
+        last_bucket = self._last_time_logged
+
+        if last_bucket is None or bucket > last_bucket:
+            self._advance(bucket)
+        elif bucket < last_bucket:
+            if bucket < last_bucket - self._lateness:
+                self._dropped_count += count
+                return
+
+            # Every running total from the end of the late bucket up to the start of the head includes it
+            buffer_size = len(self._counts)
+            self._check_room(count)
+            self._version += 1
+            for later_bucket in range(bucket, last_bucket + 1):
+                index = later_bucket % buffer_size
+                if self._timestamps[index] != later_bucket:
+                    # The bucket is older than the first event logged; claim it
+                    self._timestamps[index] = later_bucket
+                    self._counts[index] = 0
+                    self._cumulative[index] = 0
+                self._cumulative[index] += count
+
+            self._counts[bucket % buffer_size] += count
+            self._version += 1
+            # The statistics no longer match the closed buckets, and are rebuilt when next asked for
+            self._stats.clear()
+            return
+
+        self._counts[self._last_index_logged] += count
+
+    def _check_room(self, count):
+        """
+        Check that the running total still fits in 64 bits with 'count' more events, before a write that makes
+        the version odd: a store failing halfway through would leave it odd, and queries waiting forever.
+
+        :param count: integer, number of events about to be added
+        :return: None
+        """
+        if self._total + count > _MAX_TOTAL:
+            raise OverflowError("Running total of events would overflow 64 bits")
 
-    def log_event(self):
+    def _wait_for_writer(self):
         """
-        Log event at the current time (second).
+        Let a write under way in another thread finish, for a query that found the version odd or changed.
 
         :return: None
         """
+        time.sleep(0)
 
-        # Log current event
-        current_time = time.time()
+    @property
+    def _total(self):
+        """Running total of all events logged"""
+        if self._last_time_logged is None:
+            return 0
+        index = self._last_index_logged
+        return self._cumulative[index] + self._counts[index]
 
-        # Check if the current second is the same as last.
-        # If so, then increase that second's counter by 1.
-        if self._last_time_logged == int(current_time):
-            # Increase counter of last timestamp by 1
-            self._last_time_logged_count += 1
+    def _total_at(self, bucket):
+        """
+        Running total of events logged up to and including 'bucket'.
+        'bucket' must be no older than the window before the current bucket.
+
+        :param bucket: integer, bucket number
+        :return: Number of events logged up to the end of that bucket
+        """
+        if self._last_time_logged is None or bucket >= self._last_time_logged:
+            # Nothing has been logged after this bucket
+            return self._total
+
+        index = bucket % len(self._cumulative)
+        if self._timestamps[index] == bucket:
+            return self._cumulative[index]
+
+        # The bucket was never claimed, so it is older than the first event logged
+        return 0
+
+    def _count_behind(self, oldest_bucket, current_bucket):
+        """
+        Number of events after oldest_bucket up to and including current_bucket, for a current_bucket
+        before the head: the events logged after it are left out, and so are the buckets that have left
+        the ring buffer.
+
+        :param oldest_bucket: integer, bucket number
+        :param current_bucket: integer, bucket number, before the head
+        :return: Number of events logged in those buckets
+        """
+        first_bucket = self._last_time_logged - self._bucket_count
+        if oldest_bucket >= current_bucket or current_bucket < first_bucket:
+            return 0
+        if oldest_bucket < first_bucket:
+            # The oldest bucket in the ring buffer has no running total before it
+            return self._total_at(current_bucket) - self._total_at(first_bucket) + self._bucket_count_at(first_bucket)
+        return self._total_at(current_bucket) - self._total_at(oldest_bucket)
+
+    @property
+    def dropped_events(self):
+        """Number of events dropped for arriving later than max_lateness"""
+        return self._dropped_count
+
+    def log_event(self, at=None):
+        """
+        Log event at the current time (bucket).
+
+        :param at: Time of the event, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        current_bucket = int((self._clock() if at is None else at) * self._scale)
+
+        # Only look past the head when the bucket changes.
+        # Otherwise logging is a single increment of the current bucket's counter
+        if self._last_time_logged != current_bucket:
+            self._log_count(current_bucket, 1)
+            return
+
+        self._counts[self._last_index_logged] += 1
+
+    def _log_event_coarse(self, at=None):
+        """
+        log_event of trackers with a coarse clock: the current bucket is the one the ticker last published.
+
+        :param at: Time of the event, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        current_bucket = self._tick.bucket if at is None else int(at * self._scale)
+
+        if self._last_time_logged != current_bucket:
+            self._log_count(current_bucket, 1)
+            return
+
+        self._counts[self._last_index_logged] += 1
+
+    def log_events(self, n, at=None):
+        """
+        Log n events at once, all in the same bucket.
+        Gives the same result as calling log_event n times, with a single clock read.
+
+        :param n: integer: Number of events to log
+        :param at: Time of the events, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        assert isinstance(n, int) and n >= 0, "Number of events must be a nonnegative integer"
+
+        if at is None:
+            at = self._clock()
+
+        if n:
+            self._log_count(int(at * self._scale), n)
+
+    def log_events_at(self, timestamps):
+        """
+        Log one event per timestamp in 'timestamps', which does not need to be sorted.
+        Events are grouped by bucket in a single pass (vectorized for NumPy arrays) and each bucket
+        is then logged once, oldest first.
+        Gives the same result as logging each event at its timestamp with log_event.
+
+        :param timestamps: iterable of times in the clock's units, e.g. a list, array.array or numpy.ndarray
+        :return: None
+        """
+        scale = self._scale
+        if numpy is not None and isinstance(timestamps, numpy.ndarray):
+            buckets, counts = numpy.unique(numpy.trunc(timestamps * scale).astype(numpy.int64), return_counts=True)
+            grouped = zip(buckets.tolist(), counts.tolist())
+        elif scale == 1:
+            grouped = sorted(Counter(map(int, timestamps)).items())
         else:
-            # Must add new Event Second to history because this is a new second
-            self._log_latest_second()
-            self._last_time_logged = int(current_time)
-            self._last_time_logged_count = 1
+            grouped = sorted(Counter(int(timestamp * scale) for timestamp in timestamps).items())
 
-    def get_event_counts(self, duration):
+        for bucket, count in grouped:
+            self._log_count(bucket, count)
+
+    def get_event_counts(self, duration, now=None):
         """
         Get the number of events that have happened in the past X seconds, specified by 'duration'.
         This includes events that have been logged at the current second, but does not include
@@ -86,30 +391,454 @@ class CountTracker:
           As an example, if we are calling get_event_counts(4) at time 20, it will return
           the events that happened at time 17, 18, 19, and 20.
         Will raise an error if duration is larger than 300 seconds, or 5 minutes.
+        With a different resolution, 'duration' must be a multiple of it, and is counted in whole buckets
+        the same way. With a different window, it can be at most the window.
+        Runs in constant time, and does not modify the tracker, so any number of threads can query
+        while one thread logs.
 
         :param duration: integer: Number of seconds into the past to count events of
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
         :return: Total number of events that occurred in the past 'duration' seconds
         """
-        current_time = time.time()
+        current_bucket = int((self._clock() if now is None else now) * self._scale)
+        oldest_bucket = current_bucket - _duration_buckets(duration, self._MEMORY_TIME_LIMIT, self._resolution)
 
-        assert duration >= 0, "Duration must be a nonnegative integer"
-        assert isinstance(duration, int), "Duration must be a nonnegative integer"
-        assert duration <= self._MEMORY_TIME_LIMIT, \
-            "Duration must be less than or equal to {} seconds".format(self._MEMORY_TIME_LIMIT)
+        while True:
+            version = self._version
+            if not version & 1:
+                head = self._last_time_logged
+                if head is None or oldest_bucket >= head:
+                    count = 0
+                elif current_bucket >= head:
+                    # The count of the head is read once, as it may be incremented while the query runs
+                    count = self._total - self._total_at(oldest_bucket)
+                else:
+                    count = self._count_behind(oldest_bucket, current_bucket)
+                if self._version == version:
+                    return count
+            # A write is under way in another thread; let it finish
+            self._wait_for_writer()
 
-        self._log_latest_second()
+    def get_event_counts_many(self, durations, now=None):
+        """
+        Get the number of events that have happened in each of several durations, counted the same way as
+        get_event_counts, with a single clock read so all the counts end at the same time.
 
-        # Remove old events as they're unnecessary
-        self._remove_old_events(current_time)
+        :param durations: iterable of numbers of seconds into the past to count events of
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
+        :return: List of the total number of events in each duration, in the same order
+        """
+        current_bucket = int((self._clock() if now is None else now) * self._scale)
+        oldest_buckets = [current_bucket - _duration_buckets(duration, self._MEMORY_TIME_LIMIT, self._resolution)
+                          for duration in durations]
 
-        total_count = 0
-        earliest_time_to_count = EventSecond(current_time - duration)
-        index = len(self._history) - 1
+        while True:
+            version = self._version
+            if not version & 1:
+                head = self._last_time_logged
+                if head is not None and current_bucket < head:
+                    counts = [self._count_behind(oldest_bucket, current_bucket) for oldest_bucket in oldest_buckets]
+                else:
+                    total = self._total
+                    counts = [0 if head is None or oldest_bucket >= head else total - self._total_at(oldest_bucket)
+                              for oldest_bucket in oldest_buckets]
+                if self._version == version:
+                    return counts
+            self._wait_for_writer()
 
-        # Continue going backward starting from the end of history
-        #   until we either exhaust all the history or find a timestamp that's too early
-        while index >= 0 and self._history[index] > earliest_time_to_count:
-            total_count += self._history[index].count
-            index -= 1
+    def dump(self, path):
+        """
+        Save the tracker to a snapshot file at 'path', which CountTracker.load can restore it from.
+        The snapshot is written to a temporary file that then replaces 'path', so 'path' always holds a
+        complete snapshot, and both are synced to disk before dump returns, so the snapshot survives a power
+        loss from then on. Can be called while other threads log; events they log while the snapshot is
+        being copied may be left out of it.
+
+        :param path: Path of the snapshot file
+        :return: None
+        """
+        # Copy the arrays, and start over if the head moved (or a late event was added) while they were copied
+        while True:
+            version = self._version
+            if not version & 1:
+                last_time_logged, last_index_logged = self._last_time_logged, self._last_index_logged
+                arrays = [bytes(self._counts), bytes(self._timestamps), bytes(self._cumulative)]
+                if self._version == version:
+                    break
+            self._wait_for_writer()
+
+        header = _SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, self._MEMORY_TIME_LIMIT,
+                                       self._resolution, self._clock_rate, self._bucket_count, self._lateness,
+                                       self._dropped_count, last_time_logged or 0,
+                                       -1 if last_time_logged is None else last_index_logged)
+        temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary_path, 'wb') as snapshot:
+            snapshot.write(header)
+            for data in arrays:
+                snapshot.write(data)
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temporary_path, path)
+        _sync_directory(os.path.dirname(os.path.abspath(path)))
+
+    @classmethod
+    def load(cls, path, clock=None, use_mmap=False):
+        """
+        Restore a tracker from a snapshot file written by dump, with the same window, resolution,
+        clock rate and lateness. Buckets that have left the window since the snapshot was taken are dropped.
+
+        :param path: Path of the snapshot file
+        :param clock: Function returning the current time, in the same units as the clock the snapshot was
+            taken with. Defaults to time.time
+        :param use_mmap: If True, the tracker works directly on a private (copy on write) memory map of the file
+            instead of reading it, so loading takes the same time however big the window is, and only the
+            parts of the file that are used are read. Changes are not written back to the file
+        :return: CountTracker
+        """
+        with open(path, 'rb') as snapshot:
+            header = snapshot.read(_SNAPSHOT_HEADER.size)
+            assert len(header) == _SNAPSHOT_HEADER.size, "Not a CountTracker snapshot"
+            (magic, version, window, resolution, clock_rate, bucket_count, lateness, dropped_count,
+             last_time_logged, last_index_logged) = _SNAPSHOT_HEADER.unpack(header)
+            assert magic == _SNAPSHOT_MAGIC, "Not a CountTracker snapshot"
+            assert version == _SNAPSHOT_VERSION, "Unsupported snapshot version {}".format(version)
+
+            window = int(window) if window.is_integer() else window
+            resolution = int(resolution) if resolution.is_integer() else resolution
+            clock_rate = int(clock_rate) if clock_rate.is_integer() else clock_rate
+            assert _check_config(window, resolution) == bucket_count, "Snapshot is corrupt"
+
+            array_size = (bucket_count + 1) * array('q').itemsize
+            assert os.fstat(snapshot.fileno()).st_size == _SNAPSHOT_HEADER.size + 3 * array_size, \
+                "Snapshot is truncated"
+            if use_mmap:
+                data = memoryview(mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_COPY))
+                arrays = [data[offset:offset + array_size].cast('q')
+                          for offset in range(_SNAPSHOT_HEADER.size, len(data), array_size)]
+            else:
+                arrays = []
+                for _ in range(3):
+                    loaded = array('q')
+                    loaded.frombytes(snapshot.read(array_size))
+                    arrays.append(loaded)
+
+        tracker = cls(window, resolution, clock, clock_rate, _arrays=arrays)
+        tracker._lateness = lateness
+        tracker._dropped_count = dropped_count
+        if last_index_logged >= 0:
+            tracker._last_time_logged = last_time_logged
+            tracker._last_index_logged = last_index_logged
+
+            # Move the head to the current bucket, which clears every bucket that has left the window
+            current_bucket = int(tracker._clock() * tracker._scale)
+            if current_bucket > last_time_logged:
+                tracker._advance(current_bucket)
+
+        return tracker
+
+    def _bucket_counts(self):
+        """
+        Counts of the buckets in the window that have events.
+
+        :return: dictionary of bucket number -> count
+        """
+        if self._last_time_logged is None:
+            return {}
+        oldest_bucket = self._last_time_logged - self._bucket_count
+        return {bucket: count for bucket, count in zip(self._timestamps, self._counts)
+                if count and bucket > oldest_bucket}
+
+    def _add_counts(self, increments):
+        """
+        Add counts to many buckets at once, in a single pass over the ring buffer.
+        Buckets after the latest one move the head forward. Buckets that are outside the window
+        once the head has moved are left out.
+
+        :param increments: dictionary of bucket number -> positive number of events to add
+        :return: None
+        """
+        if not increments:
+            return
+        self._check_room(sum(increments.values()))
+        newest_bucket = max(increments)
+        if self._last_time_logged is None or newest_bucket > self._last_time_logged:
+            self._advance(newest_bucket)
+
+        head = self._last_time_logged
+        buffer_size = len(self._counts)
+        added = 0
+        self._version += 1
+        for bucket in range(max(min(increments), head - self._bucket_count + 1), head + 1):
+            index = bucket % buffer_size
+            if self._timestamps[index] != bucket:
+                # The bucket is older than the first event logged; claim it
+                self._timestamps[index] = bucket
+                self._counts[index] = 0
+                self._cumulative[index] = 0
+
+            # The running total of the head is the one up to its start
+            if bucket == head:
+                self._cumulative[index] += added
+            count = increments.get(bucket, 0)
+            self._counts[index] += count
+            added += count
+            if bucket != head:
+                self._cumulative[index] += added
+        self._version += 1
+        self._stats.clear()
+
+    def _check_compatible(self, window, resolution, clock_rate):
+        """Check that counts with this window, resolution and clock rate line up with the tracker's buckets"""
+        assert (window, resolution, clock_rate) == (self._MEMORY_TIME_LIMIT, self._resolution, self._clock_rate), \
+            "Trackers must have the same window, resolution and clock rate"
+
+    def export_delta(self):
+        """
+        Export the buckets in the window that changed since the last export (or all of them, the first time),
+        with their whole counts, as compact bytes for apply_delta.
+        Exporting compares the buckets with a copy kept from the last export, so logging is not slowed down.
+
+        :return: bytes
+        """
+        buffer_size = len(self._counts)
+        if self._exported is None:
+            self._exported = array('q', [-1]) * buffer_size, array('q', [0]) * buffer_size
+        exported_timestamps, exported_counts = self._exported
+
+        records = array('q')
+        if self._last_time_logged is not None:
+            oldest_bucket = self._last_time_logged - self._bucket_count
+            for index in range(buffer_size):
+                bucket, count = self._timestamps[index], self._counts[index]
+                if count and bucket > oldest_bucket and \
+                        (bucket != exported_timestamps[index] or count != exported_counts[index]):
+                    records.append(bucket)
+                    records.append(count)
+        # Through memoryviews, as the arrays of a tracker loaded with use_mmap are memoryviews themselves
+        memoryview(exported_timestamps)[:] = self._timestamps
+        memoryview(exported_counts)[:] = self._counts
+
+        return _DELTA_HEADER.pack(_DELTA_MAGIC, _DELTA_VERSION, self._MEMORY_TIME_LIMIT, self._resolution,
+                                  self._clock_rate, len(records) // 2) + records.tobytes()
+
+    def apply_delta(self, delta):
+        """
+        Bring the tracker up to date with a delta exported by another tracker with the same window,
+        resolution and clock rate, making it a replica of that tracker.
+        A delta holds whole bucket counts, and a bucket only ever gains events, so each bucket keeps the
+        larger of its count and the delta's. Applying a delta again, or an older delta after a newer one,
+        changes nothing, so deltas can be resent or arrive out of order.
+
+        :param delta: bytes returned by export_delta
+        :return: None
+        """
+        magic, version, window, resolution, clock_rate, record_count = _DELTA_HEADER.unpack_from(delta)
+        assert magic == _DELTA_MAGIC, "Not a CountTracker delta"
+        assert version == _DELTA_VERSION, "Unsupported delta version {}".format(version)
+        assert len(delta) == _DELTA_HEADER.size + record_count * 16, "Delta is truncated"
+        self._check_compatible(window, resolution, clock_rate)
+
+        records = array('q')
+        records.frombytes(delta[_DELTA_HEADER.size:])
+        current = self._bucket_counts()
+        increments = {}
+        for bucket, count in zip(records[::2], records[1::2]):
+            if count > current.get(bucket, 0):
+                increments[bucket] = count - current.get(bucket, 0)
+        self._add_counts(increments)
+
+    def merge(self, other):
+        """
+        Add the counts of another tracker with the same window, resolution and clock rate, bucket by bucket.
+        Merging is a sum, so merging trackers in any order or grouping gives the same counts.
+        Merging a tracker twice counts its events twice; to combine changing trackers repeatedly,
+        keep a replica of each with apply_delta and merge the replicas with CountTracker.merged.
+
+        :param other: CountTracker
+        :return: None
+        """
+        other._check_compatible(self._MEMORY_TIME_LIMIT, self._resolution, self._clock_rate)
+        self._add_counts(other._bucket_counts())
+
+    @classmethod
+    def merged(cls, trackers, clock=None):
+        """
+        Create a tracker holding the sum of the counts of 'trackers', which must all have the same window,
+        resolution and clock rate. The counts are added up bucket by bucket and logged in a single pass.
+
+        :param trackers: iterable of CountTracker
+        :param clock: Function returning the current time, for the new tracker. Defaults to time.time
+        :return: CountTracker
+        """
+        trackers = list(trackers)
+        assert trackers, "At least one tracker is needed"
+        first = trackers[0]
+        tracker = cls(first._MEMORY_TIME_LIMIT, first._resolution, clock, first._clock_rate)
+
+        increments = Counter()
+        for other in trackers:
+            other._check_compatible(first._MEMORY_TIME_LIMIT, first._resolution, first._clock_rate)
+            increments.update(other._bucket_counts())
+        tracker._add_counts(increments)
+        return tracker
+
+    def _bucket_count_at(self, bucket):
+        """
+        Count of a bucket no older than the window before the current bucket.
+
+        :param bucket: integer, bucket number
+        :return: Number of events logged in that bucket
+        """
+        index = bucket % len(self._counts)
+        return self._counts[index] if self._timestamps[index] == bucket else 0
+
+    def stats(self, duration, quantiles=(0.5, 0.95, 0.99), now=None):
+        """
+        Get statistics of the per bucket counts over the past X seconds, specified by 'duration', for example
+        the peak and 99th percentile of the events per second over the last minute.
+        Only closed buckets are counted: the window is the 'duration' seconds before the current bucket,
+        so a bucket still filling up does not drag the figures down.
+        The statistics for each duration are built the first time they are asked for in the current bucket
+        once an event has been logged in it, and from then on kept up to date as buckets close, so asking
+        again takes constant time (per quantile). Asking in a bucket with no events logged yet builds them
+        from the counts, treating the buckets from the head on as empty. Logging late events into closed
+        buckets, or merging, makes them be built again.
+        Does not modify the counts, so any number of threads can ask while one thread logs.
+
+        :param duration: Number of seconds into the past, at least one bucket
+        :param quantiles: iterable of quantiles between 0 and 1. Defaults to the median, 95th and 99th percentiles
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
+        :return: Stats
+        """
+        current_bucket = int((self._clock() if now is None else now) * self._scale)
+        buckets = _duration_buckets(duration, self._MEMORY_TIME_LIMIT, self._resolution)
+        assert buckets > 0, "Duration must be at least {} seconds".format(self._resolution)
+        quantiles = tuple(quantiles)
+        assert all(0 <= q <= 1 for q in quantiles), "Quantiles must be between 0 and 1"
+
+        per_second = 1 / self._resolution
+        while True:
+            version = self._version
+            if not version & 1:
+                window_stats = self._stats.get(buckets)
+                built = window_stats is None or window_stats.last_bucket != current_bucket - 1
+                if built:
+                    window_stats = _SlidingStats(buckets, current_bucket - 1,
+                                                 [self._bucket_count_at(bucket)
+                                                  for bucket in range(current_bucket - buckets, current_bucket)])
+                try:
+                    stats = Stats(window_stats.total, window_stats.total / duration,
+                                  window_stats.peak * per_second,
+                                  {q: window_stats.quantile(q) * per_second for q in quantiles})
+                except IndexError:
+                    stats = None  # Kept statistics read in the middle of an update, which the check below catches
+                if self._version == version:
+                    # Only statistics ending at the head can be kept up to date as it moves
+                    if built and current_bucket == self._last_time_logged:
+                        self._stats[buckets] = window_stats
+                        # Late events clear the statistics after changing the version, so ones built
+                        #   before them are taken out again
+                        if self._version != version:
+                            self._stats.pop(buckets, None)
+                    return stats
+            self._wait_for_writer()
+
+    def _copy_counts(self, counts, first_bucket):
+        """
+        Copy the counts of the buckets from first_bucket on into 'counts', whose items must be zero,
+        leaving buckets without any events logged at zero. Starts over if another thread moves the head meanwhile.
+
+        :param counts: writable contiguous memoryview of 'q' items, one per bucket
+        :param first_bucket: integer, number of the bucket of the first item
+        :return: None
+        """
+        while True:
+            version = self._version
+            if not version & 1:
+                self._copy_claimed_counts(counts, first_bucket)
+                if self._version == version:
+                    return
+                counts.cast('B')[:] = bytes(counts.nbytes)
+            self._wait_for_writer()
+
+    def _copy_claimed_counts(self, counts, first_bucket):
+        """Copy the counts for _copy_counts, which makes sure the ring buffer does not change meanwhile"""
+        head = self._last_time_logged
+        if head is None:
+            return
+        buffer_size = len(self._counts)
+        last_bucket = min(first_bucket + len(counts) - 1, head)
+
+        # The buckets claimed in the ring buffer are always a run ending at the head (every bucket is claimed
+        #   as the head moves past it, and late events claim every bucket up to the head), so the first one
+        #   from first_bucket on can be found by bisection
+        low, high = max(first_bucket, head - buffer_size + 1), last_bucket + 1
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamps[middle % buffer_size] == middle:
+                high = middle
+            else:
+                low = middle + 1
+        if low > last_bucket:
+            return
+
+        # At most two slices, as the run may wrap around the end of the ring buffer
+        start, end = low % buffer_size, last_bucket % buffer_size
+        offset = low - first_bucket
+        if start <= end:
+            counts[offset:offset + end - start + 1] = memoryview(self._counts)[start:end + 1]
+        else:
+            counts[offset:offset + buffer_size - start] = memoryview(self._counts)[start:]
+            offset += buffer_size - start
+            counts[offset:offset + end + 1] = memoryview(self._counts)[:end + 1]
+
+    def timeline(self, duration, now=None):
+        """
+        Get the count of every bucket in the past X seconds, specified by 'duration', oldest first,
+        with zeros for the buckets without events. The same buckets as get_event_counts adds up.
+        The counts are copied into a new contiguous buffer of 64 bit integers, which numpy.asarray (or
+        anything taking the buffer protocol) can use without copying it again.
+
+        :param duration: integer: Number of seconds into the past
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
+        :return: (start time of the first bucket in the clock's units, memoryview of the counts)
+        """
+        current_bucket = int((self._clock() if now is None else now) * self._scale)
+        buckets = _duration_buckets(duration, self._MEMORY_TIME_LIMIT, self._resolution)
+        first_bucket = current_bucket - buckets + 1
+
+        counts = memoryview(array('q', bytes(buckets * 8)))
+        self._copy_counts(counts, first_bucket)
+        return first_bucket * self._resolution * self._clock_rate, counts
+
+    @classmethod
+    def timelines(cls, trackers, duration, now=None):
+        """
+        Get the timelines of many trackers over the same buckets, stacked into one buffer with a row per tracker.
+        The trackers must all have the same window, resolution and clock rate.
+
+        :param trackers: iterable of CountTracker
+        :param duration: integer: Number of seconds into the past
+        :param now: Time to count back from, in the clock's units. Defaults to the current time of the first tracker
+        :return: (start time of the first bucket in the clock's units,
+            2-dimensional memoryview of the counts, of shape (number of trackers, number of buckets)).
+            For a duration of 0 the counts are an empty 1-dimensional memoryview instead
+        """
+        trackers = list(trackers)
+        assert trackers, "At least one tracker is needed"
+        first = trackers[0]
+        if now is None:
+            now = first._clock()
+        current_bucket = int(now * first._scale)
+        buckets = _duration_buckets(duration, first._MEMORY_TIME_LIMIT, first._resolution)
+        first_bucket = current_bucket - buckets + 1
 
-        return total_count
+        start = first_bucket * first._resolution * first._clock_rate
+        data = memoryview(array('q', bytes(len(trackers) * buckets * 8)))
+        for row, tracker in enumerate(trackers):
+            tracker._check_compatible(first._MEMORY_TIME_LIMIT, first._resolution, first._clock_rate)
+            tracker._copy_counts(data[row * buckets:(row + 1) * buckets], first_bucket)
+        if not buckets:
+            # A memoryview cannot be cast to a shape with a zero in it
+            return start, data
+        return start, data.cast('B').cast('q', [len(trackers), buckets])
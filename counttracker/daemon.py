@@ -0,0 +1,344 @@
+"""
+Standalone daemon hosting named count trackers, so services can share counts without embedding the library.
+
+Run it with the 'counttracker' command (or python -m counttracker). It accepts:
+  * StatsD counters over UDP, one or more "name:n|c" lines per datagram, with an optional "|@rate"
+    sample rate. Other StatsD metric types are ignored
+  * A line based batch protocol over TCP. Every non empty line gets exactly one reply line, in order,
+    so clients can pipeline any number of commands and read the replies back in bulk:
+        incr <name> [n]          ->  OK
+        query <name> <duration>  ->  number of events in the past 'duration' seconds
+    Errors are answered with "ERR <message>", including counts of 2**62 or more, and counts that would
+    overflow the name's 64 bit running total. A line longer than 64 KiB is answered with an error and the
+    connection is closed
+  * The same batch as the body of an HTTP "POST /batch" request on the TCP port, answered with the
+    reply lines as the body of the response. Bodies are limited to 16 MiB
+"""
+import argparse
+import asyncio
+import socket
+import time
+
+from .counttracker import CountTracker, _check_config, _duration_buckets
+
+
+class CounterDaemon:
+    """
+    Hosts count trackers created on first use, one per name, all with the same window and resolution.
+    Memory is fixed per name, so the number of names is capped. When a new name would go over the cap,
+    names without any events in the window are forgotten first; if there are none, the new name is refused.
+    Names only leave the window as buckets close, so the names are looked through at most once per bucket.
+    """
+    _UDP_BUFFER_SIZE = 4 * 1024 * 1024
+    # Largest count taken in one incr or StatsD line, so a few of them cannot overflow the 64 bit running totals
+    _MAX_COUNT = 2 ** 62 - 1
+
+    def __init__(self, window=300, resolution=1, max_names=10000, clock=None):
+        """
+        :param window: Number of seconds to keep track of. Defaults to 5 minutes
+        :param resolution: Width of a bucket in seconds. Defaults to 1 second
+        :param max_names: integer: Maximum number of trackers. Defaults to 10000
+        :param clock: Function returning the current time in seconds. Defaults to time.time
+        """
+        _check_config(window, resolution)
+        assert isinstance(max_names, int) and max_names > 0, "Maximum number of names must be a positive integer"
+        self._MEMORY_TIME_LIMIT = window
+        self._resolution = resolution
+        self._max_names = max_names
+        self._clock = clock if clock is not None else time.time
+        self._trackers = {}
+        self._swept_bucket = None  # Bucket of the last look through the names for ones without events
+        self._servers = []
+
+    def _tracker(self, name):
+        """
+        Find the tracker for 'name', creating it if needed.
+
+        :param name: string
+        :return: CountTracker, or None if there is no room for a new name
+        """
+        tracker = self._trackers.get(name)
+        if tracker is not None:
+            return tracker
+
+        if len(self._trackers) >= self._max_names:
+            # Every name had events in the window at the last look; none can have left it in the same bucket
+            bucket = int(self._clock() / self._resolution)
+            if bucket == self._swept_bucket:
+                return None
+            self._swept_bucket = bucket
+            window = self._MEMORY_TIME_LIMIT
+            self._trackers = {old_name: old_tracker for old_name, old_tracker in self._trackers.items()
+                              if old_tracker.get_event_counts(window)}
+            if len(self._trackers) >= self._max_names:
+                return None
+
+        tracker = self._trackers[name] = CountTracker(self._MEMORY_TIME_LIMIT, self._resolution, self._clock)
+        return tracker
+
+    def incr(self, name, n=1):
+        """
+        Log n events for 'name' at the current time.
+
+        :param name: string
+        :param n: integer: Number of events to log
+        :return: True if the events were logged, False if there was no room for a new name
+        """
+        tracker = self._tracker(name)
+        if tracker is None:
+            return False
+        tracker.log_events(n)
+        return True
+
+    def query(self, name, duration):
+        """
+        Get the number of events logged for 'name' in the past 'duration' seconds.
+
+        :param name: string
+        :param duration: Number of seconds into the past to count events of
+        :return: Total number of events, 0 for names never logged
+        """
+        tracker = self._trackers.get(name)
+        if tracker is None:
+            _duration_buckets(duration, self._MEMORY_TIME_LIMIT, self._resolution)
+            return 0
+        return tracker.get_event_counts(duration)
+
+    def execute(self, batch):
+        """
+        Run a batch of protocol lines.
+
+        :param batch: string of newline separated commands
+        :return: string of newline terminated replies, one per non empty line
+        """
+        replies = []
+        for line in batch.splitlines():
+            parts = line.split()
+            if not parts:
+                continue
+            try:
+                command = parts[0]
+                if command == 'incr' and 2 <= len(parts) <= 3:
+                    n = int(parts[2]) if len(parts) == 3 else 1
+                    assert n >= 0, "Number of events must be a nonnegative integer"
+                    assert n <= self._MAX_COUNT, "Number of events must be at most {}".format(self._MAX_COUNT)
+                    replies.append('OK' if self.incr(parts[1], n) else 'ERR too many names')
+                elif command == 'query' and len(parts) == 3:
+                    duration = float(parts[2])
+                    replies.append(str(self.query(parts[1], int(duration) if duration.is_integer() else duration)))
+                else:
+                    replies.append('ERR unknown command')
+            except (AssertionError, ValueError, OverflowError) as error:
+                replies.append('ERR {}'.format(str(error) or 'invalid argument').replace('\n', ' '))
+        replies.append('')
+        return '\n'.join(replies)
+
+    def statsd(self, datagram):
+        """
+        Log the counters in a StatsD datagram. Malformed lines, other metric types and counts that are not
+        finite, of 2**62 or more, or would overflow the name's running total are ignored.
+
+        :param datagram: string of newline separated "name:n|c" or "name:n|c|@rate" lines
+        :return: None
+        """
+        for line in datagram.splitlines():
+            name, _, rest = line.partition(':')
+            fields = rest.split('|')
+            if not name or len(fields) < 2 or fields[1] != 'c':
+                continue
+            try:
+                n = float(fields[0])
+                if len(fields) > 2 and fields[2].startswith('@'):
+                    n /= float(fields[2][1:])
+            except (ValueError, ZeroDivisionError):
+                continue
+            # Also false for infinity and NaN
+            if 0 <= n <= self._MAX_COUNT:
+                try:
+                    self.incr(name, round(n))
+                except OverflowError:
+                    pass
+
+    async def start(self, host='127.0.0.1', port=8126, udp_port=8125):
+        """
+        Start listening on the running event loop.
+
+        :param host: Address to listen on
+        :param port: TCP port for the batch protocol and HTTP, or None to not listen over TCP
+        :param udp_port: UDP port for StatsD, or None to not listen over UDP
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        if port is not None:
+            self._servers.append(await loop.create_server(lambda: _BatchProtocol(self), host, port))
+        if udp_port is not None:
+            transport, _ = await loop.create_datagram_endpoint(lambda: _StatsdProtocol(self), (host, udp_port))
+            # A bigger receive buffer rides out bursts instead of dropping datagrams (capped by the OS)
+            transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._UDP_BUFFER_SIZE)
+            self._servers.append(transport)
+
+    @property
+    def addresses(self):
+        """(host, port) of each socket listened on, TCP first"""
+        addresses = []
+        for server in self._servers:
+            if isinstance(server, asyncio.BaseTransport):
+                addresses.append(server.get_extra_info('sockname')[:2])
+            else:
+                addresses.extend(sock.getsockname()[:2] for sock in server.sockets)
+        return addresses
+
+    async def close(self):
+        """
+        Stop listening.
+
+        :return: None
+        """
+        for server in self._servers:
+            server.close()
+            if isinstance(server, asyncio.AbstractServer):
+                await server.wait_closed()
+        self._servers = []
+
+
+class _BatchProtocol(asyncio.Protocol):
+    """
+    One TCP connection. Every chunk received is run as a batch of all its complete lines, and the
+    replies are written back with a single write. Connections starting with an HTTP request are
+    handled as HTTP instead
+    """
+    _HTTP_METHODS = (b'POST ', b'GET ', b'PUT ', b'HEAD ', b'DELETE ')
+    # Longest line, or HTTP request head, and longest HTTP body kept in memory for a connection
+    _MAX_LINE_SIZE = 64 * 1024
+    _MAX_BODY_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, daemon):
+        self._daemon = daemon
+        self._buffer = b''
+        self._http = None
+        self._transport = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def data_received(self, data):
+        buffer = self._buffer + data
+        if self._http is None:
+            if len(buffer) < 7 and b'\n' not in buffer:
+                self._buffer = buffer
+                return
+            self._http = buffer.startswith(self._HTTP_METHODS)
+
+        if self._http:
+            self._buffer = self._http_received(buffer)
+            return
+
+        end = buffer.rfind(b'\n') + 1
+        if end:
+            self._transport.write(self._daemon.execute(buffer[:end].decode('utf-8', 'replace')).encode())
+        self._buffer = buffer[end:]
+        if len(self._buffer) > self._MAX_LINE_SIZE:
+            self._transport.write(b'ERR line too long\n')
+            self._transport.close()
+            self._buffer = b''
+
+    def _http_received(self, buffer):
+        """
+        Answer every complete HTTP request in 'buffer'.
+
+        :param buffer: bytes received
+        :return: bytes left over, the start of a request not received in full
+        """
+        while not self._transport.is_closing():
+            head_end = buffer.find(b'\r\n\r\n')
+            if head_end < 0:
+                if len(buffer) > self._MAX_LINE_SIZE:
+                    self._http_reply('431 Request Header Fields Too Large', 'ERR request head too long\n', close=True)
+                    return b''
+                return buffer
+            lines = buffer[:head_end].decode('latin-1').split('\r\n')
+            method, path = (lines[0].split() + ['', ''])[:2]
+            headers = {}
+            for line in lines[1:]:
+                key, _, value = line.partition(':')
+                headers[key.strip().lower()] = value.strip()
+
+            try:
+                body_size = int(headers.get('content-length', 0))
+            except ValueError:
+                body_size = -1
+            if body_size < 0:
+                self._http_reply('400 Bad Request', 'ERR invalid content length\n', close=True)
+                return b''
+            if body_size > self._MAX_BODY_SIZE:
+                self._http_reply('413 Payload Too Large', 'ERR body too large\n', close=True)
+                return b''
+            body_end = head_end + 4 + body_size
+            if len(buffer) < body_end:
+                return buffer
+
+            body = buffer[head_end + 4:body_end]
+            buffer = buffer[body_end:]
+            close = headers.get('connection', '').lower() == 'close'
+            if path.split('?')[0] != '/batch':
+                self._http_reply('404 Not Found', 'ERR not found\n', close)
+            elif method != 'POST':
+                self._http_reply('405 Method Not Allowed', 'ERR method not allowed\n', close)
+            else:
+                self._http_reply('200 OK', self._daemon.execute(body.decode('utf-8', 'replace')), close)
+        return b''
+
+    def _http_reply(self, status, body, close):
+        body = body.encode()
+        self._transport.write('HTTP/1.1 {}\r\nContent-Type: text/plain\r\nContent-Length: {}\r\n{}\r\n'.format(
+            status, len(body), 'Connection: close\r\n' if close else '').encode() + body)
+        if close:
+            self._transport.close()
+
+
+class _StatsdProtocol(asyncio.DatagramProtocol):
+    """StatsD datagrams over UDP"""
+    def __init__(self, daemon):
+        self._daemon = daemon
+
+    def datagram_received(self, data, address):
+        self._daemon.statsd(data.decode('utf-8', 'replace'))
+
+
+def _number(text):
+    """Parse a command line number, keeping whole numbers as integers"""
+    number = float(text)
+    return int(number) if number.is_integer() else number
+
+
+def main(argv=None):
+    """
+    Entry point of the 'counttracker' command.
+
+    :param argv: list of command line arguments. Defaults to sys.argv
+    :return: None
+    """
+    parser = argparse.ArgumentParser(prog='counttracker', description='Count tracker daemon')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=8126,
+                        help='TCP port for the batch protocol and HTTP, 0 to disable (default: %(default)s)')
+    parser.add_argument('--udp-port', type=int, default=8125,
+                        help='UDP port for StatsD counters, 0 to disable (default: %(default)s)')
+    parser.add_argument('--window', type=_number, default=300, help='seconds to keep track of (default: %(default)s)')
+    parser.add_argument('--resolution', type=_number, default=1, help='bucket width in seconds (default: %(default)s)')
+    parser.add_argument('--max-names', type=int, default=10000,
+                        help='maximum number of named trackers (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    daemon = CounterDaemon(args.window, args.resolution, args.max_names)
+
+    async def serve():
+        await daemon.start(args.host, args.port or None, args.udp_port or None)
+        print('counttracker listening on {}'.format(', '.join('{}:{}'.format(*address)
+                                                              for address in daemon.addresses)), flush=True)
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,134 @@
+from functools import lru_cache
+import math
+import time
+
+
+@lru_cache(maxsize=None)
+def _constants(horizons, resolution, clock_rate):
+    """
+    Constants of trackers with this configuration, shared by all of them to keep each tracker small.
+
+    :return: (horizons, weight of an event for each horizon, factor each rate decays by over one bucket,
+        buckets per clock unit)
+    """
+    return (horizons, tuple(1 / horizon for horizon in horizons),
+            tuple(math.exp(-resolution / horizon) for horizon in horizons), 1 / (resolution * clock_rate))
+
+
+class DecayingCountTracker:
+    """
+    Keeps exponentially decaying rates of events, like the 1, 5 and 15 minute Unix load averages, instead of
+    exact counts. Every event adds 1 / horizon to the rate of each horizon, and the rate decays by a factor
+    of e every horizon, so an event stream at a steady rate converges to that rate (within about a horizon),
+    and a burst fades out smoothly rather than leaving the window all at once.
+
+    There is no history: a tracker holds one float per horizon, the current bucket and the number of events
+    logged in it, so millions of trackers fit in a process. Events are truncated to the bucket they are in,
+    as for CountTracker; the rates are only brought forward when an event arrives in a later bucket, and
+    queries work out the decay since then without modifying the tracker.
+    """
+    __slots__ = ('_horizons', '_weights', '_decays', '_clock', '_scale', '_bucket', '_pending', '_rates')
+
+    def __init__(self, horizons=(60, 300, 900), resolution=1, clock=None, clock_rate=1):
+        """
+        :param horizons: iterable of time constants in seconds, each giving a rate. Defaults to 1, 5 and 15 minutes
+        :param resolution: Width of a bucket in seconds; event times are truncated to it. Defaults to 1 second
+        :param clock: Function returning the current time. Defaults to time.time
+        :param clock_rate: Number of clock units in a second, for example 1e9 for time.monotonic_ns.
+            Times passed as 'at' or 'now' are in the same units as the clock
+        """
+        horizons = tuple(horizons)
+        assert horizons and all(horizon > 0 for horizon in horizons), "Horizons must be positive"
+        assert resolution > 0, "Resolution must be positive"
+        assert clock_rate > 0, "Clock rate must be positive"
+        self._horizons, self._weights, self._decays, self._scale = _constants(horizons, resolution, clock_rate)
+        self._clock = clock if clock is not None else time.time
+
+        # Rates at the start of _bucket, not counting the _pending events logged in it
+        self._bucket = None
+        self._pending = 0
+        self._rates = [0.0] * len(horizons)
+
+    def _log_count(self, bucket, count):
+        """
+        Add 'count' events to 'bucket'. Events in the current bucket are only counted; a later bucket first
+        folds them into the rates, decayed up to the new bucket, and an earlier one adds them in already decayed.
+
+        :param bucket: integer, bucket number
+        :param count: integer, number of events
+        :return: None
+        """
+        last_bucket = self._bucket
+        if bucket == last_bucket:
+            self._pending += count
+        elif last_bucket is None:
+            self._bucket = bucket
+            self._pending = count
+        elif bucket > last_bucket:
+            gap = bucket - last_bucket
+            pending = self._pending
+            self._rates = [(rate + pending * weight) * decay ** gap
+                           for rate, weight, decay in zip(self._rates, self._weights, self._decays)]
+            self._bucket = bucket
+            self._pending = count
+        else:
+            gap = last_bucket - bucket
+            self._rates = [rate + count * weight * decay ** gap
+                           for rate, weight, decay in zip(self._rates, self._weights, self._decays)]
+
+    def log_event(self, at=None):
+        """
+        Log event at the current time (bucket).
+
+        :param at: Time of the event, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        current_bucket = int((self._clock() if at is None else at) * self._scale)
+
+        # Logging into the current bucket only counts the event
+        if self._bucket == current_bucket:
+            self._pending += 1
+            return
+
+        self._log_count(current_bucket, 1)
+
+    def log_events(self, n, at=None):
+        """
+        Log n events at once, all in the same bucket.
+
+        :param n: integer: Number of events to log
+        :param at: Time of the events, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        assert isinstance(n, int) and n >= 0, "Number of events must be a nonnegative integer"
+
+        if n:
+            self._log_count(int((self._clock() if at is None else at) * self._scale), n)
+
+    def rates(self, now=None):
+        """
+        Get the decayed rate of every horizon. Does not modify the tracker.
+
+        :param now: Time to get the rates at, in the clock's units. Defaults to the current time
+        :return: dictionary of horizon -> events per second
+        """
+        last_bucket = self._bucket
+        if last_bucket is None:
+            return dict.fromkeys(self._horizons, 0.0)
+
+        current_bucket = int((self._clock() if now is None else now) * self._scale)
+        gap = max(current_bucket - last_bucket, 0)
+        pending = self._pending
+        return {horizon: (rate + pending * weight) * decay ** gap
+                for horizon, rate, weight, decay in zip(self._horizons, self._rates, self._weights, self._decays)}
+
+    def rate(self, horizon, now=None):
+        """
+        Get the decayed rate of events over one horizon. Does not modify the tracker.
+
+        :param horizon: One of the tracker's horizons, in seconds
+        :param now: Time to get the rate at, in the clock's units. Defaults to the current time
+        :return: Events per second
+        """
+        assert horizon in self._horizons, "Horizon must be one of {}".format(self._horizons)
+        return self.rates(now)[horizon]
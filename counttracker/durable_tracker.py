@@ -0,0 +1,293 @@
+from array import array
+import os
+import struct
+import threading
+import time
+import weakref
+import zlib
+
+from .counttracker import CountTracker, _sync_directory
+
+# A log file starts with a header, followed by one batch per commit.
+#   A batch is a header holding the number of records, the running total of events after the batch
+#   and a CRC32 of the records, followed by the (bucket number, count) records.
+#   A batch cut short or corrupted by a crash fails its check, and it and anything after it is ignored
+_LOG_MAGIC = b'CTWL'
+_LOG_VERSION = 1
+_LOG_HEADER = struct.Struct('=4sI')
+_BATCH_HEADER = struct.Struct('=qqq')
+_RECORD_SIZE = 16
+# Shortest wait of the background commits, so a sync interval of 0 does not keep a core busy
+_MIN_FLUSH_INTERVAL = 0.01
+
+
+class DurableCountTracker(CountTracker):
+    """
+    A CountTracker that also appends the events it logs to a write-ahead log, so the counts survive a crash.
+    Events are coalesced per bucket: logging into the current bucket is still a single increment, and the
+    log only gets a (bucket, count) record for each bucket with new events when the tracker commits.
+    Commits are grouped: the pending records are written and synced to disk at most once every
+    'sync_interval' seconds, when the bucket changes (or on commit or close). A background thread also
+    commits once events have waited 'sync_interval' seconds (at least 10 milliseconds) without one, so
+    events are never left uncommitted for much longer than that when logging stops. Events logged since
+    the last commit are lost in a crash.
+    Counts added by merge or apply_delta are logged the same way, as records of their own buckets.
+    Recovery loads the last snapshot, if any, and replays the log on top of it, skipping the events the
+    snapshot already holds. checkpoint() takes a snapshot and empties the log, so it does not grow forever.
+
+    Events are logged from one thread at a time; commit, dump and checkpoint can be called from any thread.
+    Open one with DurableCountTracker.open, and close it to stop the background thread.
+    """
+    def __init__(self, window=300, resolution=1, clock=None, clock_rate=1, max_lateness=None, _arrays=None):
+        super().__init__(window, resolution, clock, clock_rate, max_lateness, _arrays=_arrays)
+        self._file = None
+        self._snapshot_path = None
+        self._sync_interval = None
+        self._last_commit = None
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+        self._flusher = None
+
+        # Events counted in the tracker but not yet written to the log, by bucket.
+        #   Single events logged into the current bucket are only added in when the bucket changes or
+        #   on commit, as the difference between the running total and _logged_total
+        self._pending = {}
+        self._logged_total = 0
+
+    @classmethod
+    def open(cls, log_path, snapshot_path=None, window=300, resolution=1, clock=None, clock_rate=1,
+             max_lateness=None, sync_interval=1):
+        """
+        Open a durable tracker, recovering the counts from the snapshot and log if they exist.
+        When restored from a snapshot, the window, resolution, clock rate and lateness are the snapshot's.
+
+        :param log_path: Path of the write-ahead log, created if it does not exist
+        :param snapshot_path: Path of the snapshot file used by checkpoint, if any
+        :param window: Number of seconds to keep track of. Defaults to 5 minutes
+        :param resolution: Width of a bucket in seconds. Defaults to 1 second
+        :param clock: Function returning the current time. Defaults to time.time
+        :param clock_rate: Number of clock units in a second, for example 1e9 for time.monotonic_ns
+        :param max_lateness: Number of seconds an event can be behind the latest event logged and still be
+            counted. Defaults to the window
+        :param sync_interval: Minimum number of seconds between commits to disk. Defaults to 1 second
+        :return: DurableCountTracker
+        """
+        assert isinstance(sync_interval, (int, float)) and sync_interval >= 0, \
+            "Sync interval must be a nonnegative number"
+        if snapshot_path is not None and os.path.exists(snapshot_path):
+            tracker = cls.load(snapshot_path, clock)
+        else:
+            tracker = cls(window, resolution, clock, clock_rate, max_lateness)
+
+        log_end = tracker._replay(log_path)
+        if log_end is None:
+            log = open(log_path, 'wb')
+            log.write(_LOG_HEADER.pack(_LOG_MAGIC, _LOG_VERSION))
+        else:
+            # Anything after the last complete batch was cut short by a crash
+            log = open(log_path, 'r+b')
+            log.truncate(log_end)
+            log.seek(log_end)
+        log.flush()
+        os.fsync(log.fileno())
+        if log_end is None:
+            _sync_directory(os.path.dirname(os.path.abspath(log_path)))
+
+        tracker._file = log
+        tracker._snapshot_path = snapshot_path
+        tracker._sync_interval = sync_interval
+        tracker._last_commit = time.monotonic()
+        tracker._logged_total = tracker._total
+        # The thread only holds a weak reference, so a tracker that is dropped without being closed goes away
+        tracker._flusher = threading.Thread(target=cls._flush, args=(weakref.ref(tracker), tracker._closing),
+                                            name='counttracker-wal', daemon=True)
+        tracker._flusher.start()
+        return tracker
+
+    def _replay(self, path):
+        """
+        Log the events in the write-ahead log at 'path' that the tracker does not hold yet.
+        The log holds the events in the order they were logged, and the tracker's running total is how many
+        of them it already holds, so the replay starts that many events in.
+
+        :param path: Path of the write-ahead log
+        :return: Offset of the end of the last complete batch, or None if there is no log
+        """
+        try:
+            with open(path, 'rb') as log:
+                data = log.read()
+        except FileNotFoundError:
+            return None
+        assert data[:_LOG_HEADER.size] == _LOG_HEADER.pack(_LOG_MAGIC, _LOG_VERSION), "Not a CountTracker log"
+
+        # Everything logged is replayed as long as it is still in the window, however late it was logged
+        lateness, dropped_count = self._lateness, self._dropped_count
+        self._lateness = self._bucket_count - 1
+        skip = self._total
+
+        offset = _LOG_HEADER.size
+        while offset + _BATCH_HEADER.size <= len(data):
+            record_count, end_total, checksum = _BATCH_HEADER.unpack_from(data, offset)
+            records_end = offset + _BATCH_HEADER.size + record_count * _RECORD_SIZE
+            records = data[offset + _BATCH_HEADER.size:records_end]
+            if record_count < 0 or records_end > len(data) or zlib.crc32(records) != checksum:
+                break
+
+            values = array('q')
+            values.frombytes(records)
+            total = end_total - sum(values[1::2])
+            for bucket, count in zip(values[::2], values[1::2]):
+                if total + count > skip:
+                    CountTracker._log_count(self, bucket, min(count, total + count - skip))
+                total += count
+            offset = records_end
+
+        self._lateness, self._dropped_count = lateness, dropped_count
+        return offset
+
+    def _account(self, bucket):
+        """
+        Add the events counted since the last call to the pending records, as events of 'bucket'.
+        Single events are only ever logged into the current bucket, so calling it with the current bucket
+        before anything else is logged accounts for them.
+
+        :param bucket: integer, bucket number
+        :return: None
+        """
+        total = self._total
+        if total != self._logged_total:
+            self._pending[bucket] = self._pending.get(bucket, 0) + total - self._logged_total
+            self._logged_total = total
+
+    def _log_count(self, bucket, count):
+        if self._file is None:
+            CountTracker._log_count(self, bucket, count)
+            return
+
+        with self._lock:
+            # Commit before logging, so a bucket being closed gets a single record
+            if time.monotonic() - self._last_commit >= self._sync_interval:
+                self._commit()
+            else:
+                self._account(self._last_time_logged)
+            CountTracker._log_count(self, bucket, count)
+            # Dropped events change nothing, so they are not logged
+            self._account(bucket)
+
+    def _add_counts(self, increments):
+        if self._file is None or not increments:
+            CountTracker._add_counts(self, increments)
+            return
+
+        with self._lock:
+            if time.monotonic() - self._last_commit >= self._sync_interval:
+                self._commit()
+            else:
+                self._account(self._last_time_logged)
+            CountTracker._add_counts(self, increments)
+            # Each bucket gets its own record, leaving out the ones outside the window that were not added
+            oldest_bucket = self._last_time_logged - self._bucket_count
+            for bucket, count in increments.items():
+                if bucket > oldest_bucket:
+                    self._pending[bucket] = self._pending.get(bucket, 0) + count
+            self._logged_total = self._total
+
+    def _commit(self):
+        """
+        Write the pending records to the log as one batch, and sync it to disk. The lock must be held.
+
+        :return: None
+        """
+        self._account(self._last_time_logged)
+        self._last_commit = time.monotonic()
+        if not self._pending:
+            return
+
+        values = array('q')
+        for bucket, count in self._pending.items():
+            values.append(bucket)
+            values.append(count)
+        records = values.tobytes()
+        self._file.write(_BATCH_HEADER.pack(len(self._pending), self._logged_total, zlib.crc32(records)) + records)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending.clear()
+
+    @staticmethod
+    def _flush(tracker_ref, closing):
+        """
+        Commit from the background thread whenever sync_interval passes without a commit,
+        until the tracker is closed or dropped.
+
+        :param tracker_ref: weak reference to the DurableCountTracker
+        :param closing: threading.Event set when the tracker is closed
+        :return: None
+        """
+        wait = 0
+        while not closing.wait(wait):
+            tracker = tracker_ref()
+            if tracker is None:
+                return
+            interval = max(tracker._sync_interval, _MIN_FLUSH_INTERVAL)
+            with tracker._lock:
+                if tracker._file is None:
+                    return
+                wait = tracker._last_commit + interval - time.monotonic()
+                if wait <= 0:
+                    # Only writes and syncs if events were logged since the last commit
+                    tracker._commit()
+                    wait = interval
+            del tracker
+
+    def commit(self):
+        """
+        Write every event logged so far to the log and sync it to disk.
+
+        :return: None
+        """
+        with self._lock:
+            self._commit()
+
+    def dump(self, path):
+        """
+        Commit, then save the tracker to a snapshot file at 'path', the same as CountTracker.dump.
+
+        :param path: Path of the snapshot file
+        :return: None
+        """
+        with self._lock:
+            if self._file is not None:
+                self._commit()
+            CountTracker.dump(self, path)
+
+    def checkpoint(self):
+        """
+        Save a snapshot to the snapshot path given to open, and empty the log, which then only has to
+        hold the events logged after the snapshot.
+
+        :return: None
+        """
+        assert self._snapshot_path is not None, "No snapshot path to checkpoint to"
+        with self._lock:
+            self._commit()
+            CountTracker.dump(self, self._snapshot_path)
+            self._file.truncate(_LOG_HEADER.size)
+            self._file.seek(_LOG_HEADER.size)
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """
+        Commit and close the log. The tracker can still be queried, and logging into it is no longer durable.
+
+        :return: None
+        """
+        self._closing.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        with self._lock:
+            if self._file is None:
+                return
+            self._commit()
+            self._file.close()
+            self._file = None
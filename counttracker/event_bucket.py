@@ -0,0 +1,58 @@
+class EventBucket:
+    """
+    Keeps track of the number of events that have occurred in one bucket of time, 'resolution' seconds wide.
+    Buckets are aligned to the Unix epoch, the same way CountTracker aligns them.
+    Initializes the count to zero.
+    """
+    __slots__ = ('index', 'resolution', 'count')
+
+    def __init__(self, unix_timestamp, resolution=1):
+        """
+        Initialize the instance with a count of zero
+
+        :param unix_timestamp: float, time of the event
+        :param resolution: width of the bucket in seconds
+        """
+        assert isinstance(unix_timestamp, float), "Unix timestamp must be float"
+        assert isinstance(resolution, (int, float)) and resolution > 0, "Resolution must be a positive number"
+        self.index = int(unix_timestamp * (1 / resolution))
+        self.resolution = resolution
+        self.count = 0
+
+    @property
+    def timestamp(self):
+        """Unix time at which the bucket starts"""
+        return self.index * self.resolution
+
+    def log_event(self):
+        """
+        Records an additional event. Increases count by 1
+
+        :return: None
+        """
+        self.count += 1
+
+    def __eq__(self, other):
+        if isinstance(other, EventBucket):
+            return self.timestamp == other.timestamp
+        return False
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __lt__(self, other):
+        if isinstance(other, EventBucket):
+            return self.timestamp < other.timestamp
+        return False
+
+    def __le__(self, other):
+        return (self < other) or (self == other)
+
+    def __gt__(self, other):
+        return not (self <= other)
+
+    def __ge__(self, other):
+        return not (self < other)
+
+    def __repr__(self):
+        return "Time: {}, width: {}, count: {}".format(self.timestamp, self.resolution, self.count)
@@ -0,0 +1,221 @@
+"""
+Publishes count trackers as OpenMetrics gauges, for Prometheus to scrape over HTTP:
+
+    exporter = MetricsExporter()
+    exporter.register('http_requests', tracker, labels={'endpoint': '/login'})
+    exporter.start(port=9464)
+
+serves, at http://127.0.0.1:9464/metrics,
+
+    # TYPE http_requests gauge
+    http_requests{endpoint="/login",duration="1"} 3
+    http_requests{endpoint="/login",duration="10"} 41
+    ...
+    # EOF
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import re
+import threading
+
+_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+_METRIC_NAME = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*$')
+_LABEL_NAME = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]*$')
+
+
+def _escape(value):
+    """Escape a label value or help text for the exposition format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Series:
+    """
+    The gauges of one registered tracker, one per duration, with the exposition text last rendered for them.
+    Counting is skipped when the tracker cannot have changed: for a CountTracker, when no events were logged
+    since the last scrape and either the time is in the same bucket or every count was already zero.
+    Otherwise the counts are read, and the text is only formatted again if they changed.
+    """
+    __slots__ = ('tracker', 'durations', 'prefixes', 'counts', 'text', 'fingerprint')
+
+    def __init__(self, name, tracker, durations, labels):
+        self.tracker = tracker
+        self.durations = durations
+        label_text = ''.join('{}="{}",'.format(key, _escape(value)) for key, value in labels.items())
+        self.prefixes = ['{}{{{}duration="{}"}} '.format(name, label_text, duration) for duration in durations]
+        self.counts = None
+        self.text = ''
+        self.fingerprint = None
+
+    def refresh(self):
+        """
+        Bring the text up to date with the tracker.
+
+        :return: True if the text changed
+        """
+        tracker = self.tracker
+        try:
+            # Read before counting, so events logged while counting show as a change on the next scrape
+            total = tracker._total
+            now = tracker._clock()
+            bucket = int(now * tracker._scale)
+        except AttributeError:
+            total = now = None
+        if total is not None and self.counts is not None:
+            if (total, bucket if any(self.counts) else None) == self.fingerprint:
+                return False
+
+        if hasattr(tracker, 'get_event_counts_many'):
+            counts = tracker.get_event_counts_many(self.durations, now)
+        else:
+            counts = [tracker.get_event_counts(duration, now) for duration in self.durations]
+        changed = counts != self.counts
+        if changed:
+            self.counts = counts
+            self.text = ''.join('{}{}\n'.format(prefix, count) for prefix, count in zip(self.prefixes, counts))
+        if total is not None:
+            self.fingerprint = (total, bucket if any(counts) else None)
+        return changed
+
+
+class _Family:
+    """A metric name with its help text, all the series registered under it, and their text joined together"""
+    __slots__ = ('header', 'series', 'text')
+
+    def __init__(self, name, help_text):
+        self.header = '# TYPE {} gauge\n'.format(name)
+        if help_text:
+            self.header += '# HELP {} {}\n'.format(name, _escape(help_text))
+        self.series = {}
+        self.text = None
+
+
+class MetricsExporter:
+    """
+    Publishes registered trackers as OpenMetrics gauges: one gauge per tracker and duration, holding the
+    number of events in that duration, labelled with the duration.
+    Rendering is incremental: the text of each tracker, and of each metric, is kept from one scrape to the
+    next and only formatted again when its counts changed, so idle trackers cost next to nothing.
+    Scrapes only read the trackers and never take a lock that logging takes.
+    """
+    def __init__(self, durations=(1, 10, 60, 300)):
+        """
+        :param durations: iterable of durations to publish for every tracker, unless given when registering.
+            Defaults to 1 second, 10 seconds, 1 minute and 5 minutes
+        """
+        self._durations = tuple(durations)
+        self._families = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def register(self, name, tracker, durations=None, labels=None, help_text=None):
+        """
+        Publish a tracker under a metric name. Several trackers can share a name with different labels.
+
+        :param name: Metric name, for example 'http_requests'
+        :param tracker: A tracker with get_event_counts (and ideally get_event_counts_many), for example
+            a CountTracker or ConcurrentCountTracker
+        :param durations: iterable of durations to publish. Defaults to the exporter's durations
+        :param labels: dictionary of label name -> value, to tell trackers with the same name apart
+        :param help_text: Description of the metric, used for the first tracker registered under the name
+        :return: None
+        """
+        assert _METRIC_NAME.match(name), "Invalid metric name {!r}".format(name)
+        labels = dict(labels or {})
+        assert all(_LABEL_NAME.match(key) and key != 'duration' for key in labels), "Invalid label names"
+        durations = tuple(self._durations if durations is None else durations)
+
+        series = _Series(name, tracker, durations, labels)
+        series.refresh()  # Also checks the durations
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = _Family(name, help_text)
+            assert key not in family.series, "A tracker is already registered as {} {}".format(name, labels)
+            family.series[key] = series
+            family.text = None
+
+    def unregister(self, name, labels=None):
+        """
+        Stop publishing the tracker registered with this name and labels.
+
+        :param name: Metric name
+        :param labels: dictionary of label name -> value, as registered
+        :return: None
+        """
+        key = tuple(sorted(dict(labels or {}).items()))
+        with self._lock:
+            family = self._families[name]
+            del family.series[key]
+            family.text = None
+            if not family.series:
+                del self._families[name]
+
+    def render(self):
+        """
+        Render the exposition text of every registered tracker.
+
+        :return: string in the OpenMetrics text format
+        """
+        with self._lock:
+            parts = []
+            for family in self._families.values():
+                changed = False
+                for series in family.series.values():
+                    changed |= series.refresh()
+                if changed or family.text is None:
+                    family.text = family.header + ''.join(series.text for series in family.series.values())
+                parts.append(family.text)
+            parts.append('# EOF\n')
+            return ''.join(parts)
+
+    def start(self, host='127.0.0.1', port=9464):
+        """
+        Serve the metrics at /metrics over HTTP, from a background thread.
+
+        :param host: Address to listen on
+        :param port: Port to listen on, 0 for any free port. Defaults to 9464
+        :return: None
+        """
+        assert self._server is None, "The exporter is already serving"
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', _CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='counttracker-exporter',
+                                        daemon=True)
+        self._thread.start()
+
+    @property
+    def address(self):
+        """(host, port) the exporter is serving on, or None"""
+        return None if self._server is None else self._server.server_address[:2]
+
+    def stop(self):
+        """
+        Stop serving.
+
+        :return: None
+        """
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
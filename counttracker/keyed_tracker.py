@@ -0,0 +1,292 @@
+from array import array
+from collections import Counter
+from itertools import accumulate
+from operator import itemgetter
+import heapq
+import time
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional; count matrices are lists of lists without it
+    numpy = None
+
+
+class KeyedCountTracker:
+    """
+    Keeps track of the counts of events that have happened over the past 5 minutes, separately for
+    each key (for example an endpoint, a user or a tenant).
+    Precision is to the current second, the same as CountTracker.
+    Memory grows with the number of keys that have events in the window, not with every key ever seen:
+    a key is forgotten as soon as its last event leaves the window, and the number of live keys can be capped.
+    """
+    def __init__(self, max_keys=None, clock=None, clock_rate=1):
+        """
+        :param max_keys: integer: Maximum number of live keys. When a new key would go over the limit,
+            the key that was least recently logged is evicted. Unlimited if not given
+        :param clock: Function returning the current time. Defaults to time.time
+        :param clock_rate: Number of clock units in a second, for example 1e9 for time.monotonic_ns.
+            Times passed as 'at' or 'now' are in the same units as the clock
+        """
+        assert max_keys is None or (isinstance(max_keys, int) and max_keys > 0), \
+            "Maximum number of keys must be a positive integer"
+
+        # History is a ring buffer with one dictionary of key -> count per second, indexed by
+        #   timestamp % MEMORY_TIME_LIMIT, and a parallel array of the second each dictionary belongs to.
+        #   A key only takes space in the seconds it was logged in
+        # _totals maps every live key to its count over all the seconds in the ring.
+        #   It is kept in order from the least to the most recently logged key, for eviction
+        self._MEMORY_TIME_LIMIT = 300  # 5 minutes * 60 seconds per minute
+
+        self._max_keys = max_keys
+        self._clock = clock if clock is not None else time.time
+        assert clock_rate > 0, "Clock rate must be positive"
+        self._scale = 1 / clock_rate
+        self._buckets = [{} for _ in range(self._MEMORY_TIME_LIMIT)]
+        self._timestamps = array('q', [-1]) * self._MEMORY_TIME_LIMIT
+        self._totals = {}
+        self._last_time_logged = None
+        self._last_bucket = self._buckets[0]
+
+    def _advance(self, current_second):
+        """
+        Move the head of the ring buffer forward to current_second, if it is later than the head.
+        Every second that leaves the window has its counts taken off the keys' totals,
+        and keys left without any events are forgotten.
+
+        :param current_second: integer, time in seconds
+        :return: None
+        """
+        last_second = self._last_time_logged
+        if last_second is not None and current_second <= last_second:
+            return
+
+        if last_second is None:
+            first_second = current_second
+        else:
+            first_second = max(last_second + 1, current_second - self._MEMORY_TIME_LIMIT + 1)
+
+        totals = self._totals
+        for timestamp in range(first_second, current_second + 1):
+            index = timestamp % self._MEMORY_TIME_LIMIT
+            bucket = self._buckets[index]
+            for key, count in bucket.items():
+                total = totals[key] - count
+                if total:
+                    totals[key] = total
+                else:
+                    del totals[key]
+            bucket.clear()
+            self._timestamps[index] = timestamp
+
+        self._last_time_logged = current_second
+        self._last_bucket = self._buckets[current_second % self._MEMORY_TIME_LIMIT]
+
+    def _evict(self, key):
+        """
+        Forget every event of 'key'
+
+        :param key: Key to forget
+        :return: None
+        """
+        del self._totals[key]
+        for bucket in self._buckets:
+            bucket.pop(key, None)
+
+    def _add_total(self, key, count):
+        """
+        Add 'count' to the total of 'key' and mark it as the most recently logged key,
+        evicting the least recently logged key if a new key goes over max_keys.
+
+        :param key: Key that was logged
+        :param count: integer, number of events
+        :return: None
+        """
+        totals = self._totals
+        total = totals.pop(key, 0)
+        if not total and self._max_keys is not None and len(totals) >= self._max_keys:
+            self._evict(next(iter(totals)))
+        totals[key] = total + count
+
+    def _log_count(self, key, second, count):
+        """
+        Add 'count' events of 'key' to 'second', which may be before, at or after the latest second logged.
+        Events too old to ever be counted again are dropped.
+
+        :param key: Key the events belong to
+        :param second: integer, time in seconds
+        :param count: integer, number of events
+        :return: None
+        """
+        last_second = self._last_time_logged
+        if last_second is None or second >= last_second:
+            self._advance(second)
+            bucket = self._last_bucket
+        else:
+            if second <= last_second - self._MEMORY_TIME_LIMIT:
+                return
+            index = second % self._MEMORY_TIME_LIMIT
+            # The slot is only unclaimed (and empty) if the second is older than the first event logged
+            self._timestamps[index] = second
+            bucket = self._buckets[index]
+
+        bucket[key] = bucket.get(key, 0) + count
+        self._add_total(key, count)
+
+    def _sum_key(self, key, first_second, last_second):
+        """
+        Count the events of 'key' from first_second to last_second, inclusive.
+        Seconds that are no longer in the ring buffer count as zero.
+
+        :param key: Key to count events of
+        :param first_second: integer, time in seconds
+        :param last_second: integer, time in seconds
+        :return: Number of events
+        """
+        buckets = self._buckets
+        timestamps = self._timestamps
+        limit = self._MEMORY_TIME_LIMIT
+        return sum(buckets[timestamp % limit].get(key, 0)
+                   for timestamp in range(first_second, last_second + 1)
+                   if timestamps[timestamp % limit] == timestamp)
+
+    def log_event(self, key, at=None):
+        """
+        Log event of 'key' at the current time (second).
+
+        :param key: Hashable key the event belongs to
+        :param at: Time of the event, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        current_second = int((self._clock() if at is None else at) * self._scale)
+
+        if self._last_time_logged != current_second:
+            self._log_count(key, current_second, 1)
+            return
+
+        bucket = self._last_bucket
+        bucket[key] = bucket.get(key, 0) + 1
+        self._add_total(key, 1)
+
+    def log_events(self, key, n, at=None):
+        """
+        Log n events of 'key' at once, all at the same second.
+
+        :param key: Hashable key the events belong to
+        :param n: integer: Number of events to log
+        :param at: Time of the events, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        assert isinstance(n, int) and n >= 0, "Number of events must be a nonnegative integer"
+
+        if at is None:
+            at = self._clock()
+
+        if n:
+            self._log_count(key, int(at * self._scale), n)
+
+    def _check_duration(self, duration):
+        assert duration >= 0, "Duration must be a nonnegative integer"
+        assert isinstance(duration, int), "Duration must be a nonnegative integer"
+        assert duration <= self._MEMORY_TIME_LIMIT, \
+            "Duration must be less than or equal to {} seconds".format(self._MEMORY_TIME_LIMIT)
+
+    def get_event_counts(self, key, duration, now=None):
+        """
+        Get the number of events of 'key' that have happened in the past X seconds, specified by 'duration'.
+        Same semantics as CountTracker.get_event_counts.
+
+        :param key: Key to count events of
+        :param duration: integer: Number of seconds into the past to count events of
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
+        :return: Total number of events of 'key' that occurred in the past 'duration' seconds
+        """
+        current_second = int((self._clock() if now is None else now) * self._scale)
+        self._check_duration(duration)
+
+        self._advance(current_second)
+        if current_second != self._last_time_logged:
+            # The clock went backwards, so the totals are for a later window
+            return self._sum_key(key, current_second - duration + 1, current_second)
+
+        # Walk whichever part of the window is shorter
+        if duration > self._MEMORY_TIME_LIMIT // 2:
+            return self._totals.get(key, 0) - \
+                self._sum_key(key, current_second - self._MEMORY_TIME_LIMIT + 1, current_second - duration)
+        return self._sum_key(key, current_second - duration + 1, current_second)
+
+    def get_event_counts_many(self, keys, durations, now=None):
+        """
+        Get the number of events of each key in each duration, as a keys x durations matrix, the same
+        counts as calling get_event_counts for every pair with a single clock read.
+        The counts of every key are gathered into one matrix of keys x seconds, newest second first,
+        in a single pass over the seconds, and a cumulative sum along the seconds then holds the count
+        of every duration at once. The sum is vectorized when NumPy is installed.
+
+        :param keys: iterable of keys
+        :param durations: iterable of integer numbers of seconds into the past to count events of
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
+        :return: numpy.ndarray of shape (keys, durations) if NumPy is installed, otherwise a list of lists
+        """
+        current_second = int((self._clock() if now is None else now) * self._scale)
+        keys = list(keys)
+        durations = list(durations)
+        for duration in durations:
+            self._check_duration(duration)
+
+        self._advance(current_second)
+        rows = {key: row for row, key in enumerate(dict.fromkeys(keys))}
+        longest = max(durations, default=0)
+        limit = self._MEMORY_TIME_LIMIT
+
+        # Column 0 stays zero, as the base of the cumulative sum, so column d sums to the count of duration d.
+        #   Column 1 is the current second, column 2 the second before, and so on
+        if numpy is not None:
+            matrix = numpy.zeros((len(rows), longest + 1), dtype=numpy.int64)
+        else:
+            matrix = [[0] * (longest + 1) for _ in rows]
+        for column in range(1, longest + 1):
+            timestamp = current_second - column + 1
+            index = timestamp % limit
+            if self._timestamps[index] != timestamp:
+                continue
+            bucket = self._buckets[index]
+            if len(bucket) < len(rows):
+                found = [(rows[key], count) for key, count in bucket.items() if key in rows]
+            else:
+                found = [(row, bucket[key]) for key, row in rows.items() if key in bucket]
+            for row, count in found:
+                matrix[row][column] = count
+
+        if numpy is not None:
+            return numpy.cumsum(matrix, axis=1)[[rows[key] for key in keys]][:, durations]
+        cumulative = [list(accumulate(row)) for row in matrix]
+        return [[cumulative[rows[key]][duration] for duration in durations] for key in keys]
+
+    def top_k(self, duration, k, now=None):
+        """
+        Get the k keys with the most events in the past X seconds, specified by 'duration'.
+
+        :param duration: integer: Number of seconds into the past to count events of
+        :param k: integer: Number of keys to return
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
+        :return: List of up to k (key, count) pairs, from the highest count to the lowest
+        """
+        current_second = int((self._clock() if now is None else now) * self._scale)
+        self._check_duration(duration)
+        assert isinstance(k, int) and k > 0, "k must be a positive integer"
+
+        self._advance(current_second)
+        if duration == self._MEMORY_TIME_LIMIT and current_second == self._last_time_logged:
+            counts = self._totals
+        else:
+            counts = Counter()
+            for timestamp in range(current_second - duration + 1, current_second + 1):
+                index = timestamp % self._MEMORY_TIME_LIMIT
+                if self._timestamps[index] == timestamp:
+                    counts.update(self._buckets[index])
+
+        return heapq.nlargest(k, counts.items(), key=itemgetter(1))
+
+    def __len__(self):
+        """Number of live keys: keys with at least one event in the window"""
+        return len(self._totals)
@@ -0,0 +1,132 @@
+import threading
+import time
+
+from .counttracker import CountTracker, _check_config
+
+
+class RateLimiter:
+    """
+    Allows at most 'limit' events in any 'duration' seconds, separately for each key.
+    Each key has a small CountTracker over 'duration', split into 'buckets' buckets, and try_acquire
+    checks the count and logs the events in a single constant time step under a lock, so concurrent
+    callers can never both take the last event.
+
+    With interpolation (the sliding window counter algorithm), the bucket the window is sliding out of is
+    counted in proportion to how much of it is still inside the window, assuming its events were spread
+    evenly over it. This is close to an exact sliding window even with a few buckets, where counting whole
+    buckets would let up to a bucket's worth of extra events through as the window slides.
+    """
+    def __init__(self, limit, duration, buckets=10, interpolate=True, clock=None, clock_rate=1):
+        """
+        :param limit: integer: Maximum number of events in the window
+        :param duration: Length of the window in seconds
+        :param buckets: integer: Number of buckets the window is split into. Defaults to 10
+        :param interpolate: Whether to count the bucket sliding out of the window in proportion to how much
+            of it is still inside the window. Defaults to True
+        :param clock: Function returning the current time. Defaults to time.time
+        :param clock_rate: Number of clock units in a second, for example 1e9 for time.monotonic_ns
+        """
+        assert isinstance(limit, int) and limit >= 0, "Limit must be a nonnegative integer"
+        assert isinstance(buckets, int) and buckets > 0, "Number of buckets must be a positive integer"
+        self._limit = limit
+        self._interpolate = interpolate
+
+        # Trackers are created on first use. Keys with no events left in the window (or in the bucket
+        #   sliding out of it) are swept out whenever the number of keys doubles
+        resolution = duration / buckets
+        _check_config(duration, resolution)
+        assert clock_rate > 0, "Clock rate must be positive"
+        self._clock = clock if clock is not None else time.time
+        self._scale = 1 / (resolution * clock_rate)
+        self._tracker_args = (duration, resolution, self._clock, clock_rate)
+        self._bucket_count = buckets
+        self._trackers = {}
+        self._sweep_at = 1024
+        self._lock = threading.Lock()
+
+    def _count(self, tracker, position, bucket):
+        """
+        Count the events in the window ending at 'position', including the interpolated share of the
+        bucket sliding out of it.
+
+        :param tracker: CountTracker of the key
+        :param position: Current time in buckets, with the fraction of the current bucket that has passed
+        :param bucket: Current bucket number
+        :return: Number of events, a float if interpolated
+        """
+        oldest_bucket = bucket - self._bucket_count
+        head = tracker._last_time_logged
+        if head < oldest_bucket:
+            return 0
+
+        index = oldest_bucket % len(tracker._counts)
+        if tracker._timestamps[index] != oldest_bucket:
+            # Nothing was logged before the window
+            return tracker._total
+        count = tracker._total - tracker._cumulative[index] if head > oldest_bucket else 0
+        if self._interpolate:
+            count += tracker._counts[index] * (1 - (position - bucket))
+        return count
+
+    def _sweep(self, bucket):
+        """
+        Forget the keys without any events that still count.
+
+        :param bucket: Current bucket number
+        :return: None
+        """
+        oldest_bucket = bucket - self._bucket_count
+        self._trackers = {key: tracker for key, tracker in self._trackers.items()
+                          if tracker._last_time_logged >= oldest_bucket}
+        self._sweep_at = max(2 * len(self._trackers), 1024)
+
+    def try_acquire(self, key=None, n=1, now=None):
+        """
+        Log n events of 'key' if that keeps it within the limit, or log nothing if it would not.
+
+        :param key: Hashable key to limit, for example a client address. Defaults to a single shared key
+        :param n: integer: Number of events to acquire
+        :param now: Time of the events, in the clock's units. Defaults to the current time
+        :return: True if the events were logged, False if they went over the limit
+        """
+        assert isinstance(n, int) and n >= 0, "Number of events must be a nonnegative integer"
+        position = (self._clock() if now is None else now) * self._scale
+        bucket = int(position)
+
+        with self._lock:
+            tracker = self._trackers.get(key)
+            if tracker is None:
+                if n > self._limit:
+                    return False
+                if n:
+                    if len(self._trackers) >= self._sweep_at:
+                        self._sweep(bucket)
+                    tracker = self._trackers[key] = CountTracker(*self._tracker_args)
+                    tracker._log_count(bucket, n)
+                return True
+
+            if self._count(tracker, position, bucket) + n > self._limit:
+                return False
+            # Logging into the current bucket is a single increment, as in CountTracker.log_event
+            if tracker._last_time_logged == bucket:
+                tracker._counts[tracker._last_index_logged] += n
+            elif n:
+                tracker._log_count(bucket, n)
+            return True
+
+    def get_count(self, key=None, now=None):
+        """
+        Get the number of events of 'key' in the window, the way try_acquire counts them.
+
+        :param key: Hashable key. Defaults to the single shared key
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
+        :return: Number of events, a float if interpolated
+        """
+        position = (self._clock() if now is None else now) * self._scale
+        with self._lock:
+            tracker = self._trackers.get(key)
+            return 0 if tracker is None else self._count(tracker, position, int(position))
+
+    def __len__(self):
+        """Number of keys being tracked"""
+        return len(self._trackers)
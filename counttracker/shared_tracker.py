@@ -0,0 +1,367 @@
+from multiprocessing import resource_tracker, shared_memory
+import multiprocessing
+import os
+import sys
+import time
+import weakref
+
+from .counttracker import CountTracker, _check_config, _duration_buckets
+
+
+# Every value in the shared block is a signed 64 bit integer
+_ITEM_SIZE = 8
+# Block header: format marker, number of rows, buckets in the window, resolution in nanoseconds
+_MAGIC = 0x436f756e74547232
+_HEADER_SIZE = 4
+_NANOSECONDS = 1000000000
+# Row header: owner pid (0 when free), last bucket logged (-1 when none), its slot,
+#   and the sequence number readers in other processes check (see CountTracker._version)
+_ROW_HEADER_SIZE = 4
+_OWNER, _LAST_TIME_LOGGED, _LAST_INDEX_LOGGED, _VERSION = range(_ROW_HEADER_SIZE)
+
+# Rows claimed before a fork belong to the parent; children must claim their own
+_trackers = weakref.WeakSet()
+
+
+def _forget_rows_after_fork():
+    for tracker in _trackers:
+        tracker._row = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_rows_after_fork)
+
+
+def _process_is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists, but belongs to another user
+    return True
+
+
+def _attach_block(name):
+    """
+    Open an existing shared memory block without handing it to this process's resource tracker, which
+    would otherwise destroy it when the process exits, under every other process using it.
+
+    :param name: Name of the shared memory block
+    :return: SharedMemory
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class _SharedRow(CountTracker):
+    """
+    A CountTracker whose ring buffer and head live in one row of a shared memory block.
+    Only the process that owns the row logs into it, but any process can query it.
+    """
+    def __init__(self, header, counts, timestamps, cumulative, window, resolution, clock, clock_rate, lock):
+        self._MEMORY_TIME_LIMIT = window
+        self._resolution = resolution
+        self._bucket_count = len(counts) - 1
+        self._clock = clock
+        self._clock_rate = clock_rate
+        self._scale = 1 / (resolution * clock_rate)
+        self._lateness = self._bucket_count - 1
+        self._dropped_count = 0
+        self._stats = {}
+        self._header = header
+        self._counts = counts
+        self._timestamps = timestamps
+        self._cumulative = cumulative
+        self._lock = lock
+
+    @property
+    def _last_time_logged(self):
+        last_second = self._header[_LAST_TIME_LOGGED]
+        return None if last_second == -1 else last_second
+
+    @_last_time_logged.setter
+    def _last_time_logged(self, value):
+        self._header[_LAST_TIME_LOGGED] = value
+
+    @property
+    def _last_index_logged(self):
+        return self._header[_LAST_INDEX_LOGGED]
+
+    @_last_index_logged.setter
+    def _last_index_logged(self, value):
+        self._header[_LAST_INDEX_LOGGED] = value
+
+    @property
+    def _version(self):
+        return self._header[_VERSION]
+
+    @_version.setter
+    def _version(self, value):
+        self._header[_VERSION] = value
+
+    def _wait_for_writer(self):
+        # A process that died in the middle of a write left the version odd for good
+        owner = self._header[_OWNER]
+        if owner != os.getpid() and not _process_is_alive(owner):
+            with self._lock:
+                # Another process may have recovered or claimed the row meanwhile
+                if self._version & 1 and not _process_is_alive(self._header[_OWNER]):
+                    self._recover()
+        time.sleep(0)
+
+    def _recover(self):
+        """
+        Make the row consistent again after its owner died in the middle of a write, leaving the version odd.
+        The head may have been partly moved, or a late event partly added: the running totals are rebuilt
+        from the counts, and buckets of the window that were claimed for a head that never got there are
+        claimed back as empty. The lock must be held.
+
+        :return: None
+        """
+        head = self._last_time_logged
+        if head is not None:
+            buffer_size = len(self._counts)
+            self._last_index_logged = head % buffer_size
+            total = 0
+            claimed = False
+            for bucket in range(head - buffer_size + 1, head + 1):
+                index = bucket % buffer_size
+                if self._timestamps[index] != bucket:
+                    if not claimed:
+                        continue  # Older than the first event logged
+                    self._timestamps[index] = bucket
+                    self._counts[index] = 0
+                claimed = True
+                # The running total of the head is the one up to its start
+                if bucket == head:
+                    self._cumulative[index] = total
+                total += self._counts[index]
+                if bucket != head:
+                    self._cumulative[index] = total
+        self._version += 1
+
+
+class SharedCountTracker:
+    """
+    Keeps track of the counts of events that have happened over the past 5 minutes (or any window and
+    resolution, as for CountTracker), across every process on the host that uses the same shared memory block.
+    Each process logs into its own row of the block (a CountTracker ring buffer), so every counter
+    has a single writer and no increments are lost. Any process can query the whole block directly,
+    without a round trip to another process.
+
+    Processes share the tracker by inheriting it through fork, by receiving it as an argument of a
+    multiprocessing.Process, or by calling SharedCountTracker.attach with the block's name and the
+    same lock. A single process should not log into it from several threads.
+    All processes must use the same kind of clock, since their buckets are compared directly.
+    """
+    def __init__(self, max_processes=64, window=300, resolution=1, name=None, lock=None,
+                 clock=None, clock_rate=1, _create=True):
+        """
+        Create a new shared memory block.
+
+        :param max_processes: integer: Number of processes that can log at the same time
+        :param window: Number of seconds to keep track of. Defaults to 5 minutes
+        :param resolution: Width of a bucket in seconds. Defaults to 1 second
+        :param name: Name of the shared memory block. Generated if not given
+        :param lock: multiprocessing lock used when a process claims a row. Created if not given
+        :param clock: Function returning the current time. Defaults to time.time
+        :param clock_rate: Number of clock units in a second, for example 1e9 for time.monotonic_ns
+        """
+        if _create:
+            assert isinstance(max_processes, int) and max_processes > 0, \
+                "Maximum number of processes must be a positive integer"
+            bucket_count = _check_config(window, resolution)
+            row_size = _ROW_HEADER_SIZE + 3 * (bucket_count + 1)
+            self._shm = shared_memory.SharedMemory(
+                name=name, create=True, size=_ITEM_SIZE * (_HEADER_SIZE + max_processes * row_size))
+            values = self._shm.buf.cast('q')
+            values[0] = _MAGIC
+            values[1] = max_processes
+            values[2] = bucket_count
+            values[3] = round(resolution * _NANOSECONDS)
+        else:
+            self._shm = _attach_block(name)
+            values = self._shm.buf.cast('q')
+            is_tracker = len(values) > _HEADER_SIZE and values[0] == _MAGIC
+            if not is_tracker:
+                values.release()
+                self._shm.close()
+            assert is_tracker, "{} is not a SharedCountTracker block".format(name)
+            max_processes = values[1]
+            bucket_count = values[2]
+            resolution_ns = values[3]
+            if resolution_ns % _NANOSECONDS:
+                resolution = resolution_ns / _NANOSECONDS
+            else:
+                resolution = resolution_ns // _NANOSECONDS
+            window = bucket_count * resolution
+
+        self._MEMORY_TIME_LIMIT = window
+        self._resolution = resolution
+        self._clock = clock if clock is not None else time.time
+        self._clock_rate = clock_rate
+
+        self._lock = lock if lock is not None else multiprocessing.Lock()
+        self._values = values
+        self._rows = self._create_rows(values, max_processes, bucket_count)
+        self._row = None
+        _trackers.add(self)
+
+    @classmethod
+    def attach(cls, name, lock=None, clock=None, clock_rate=1):
+        """
+        Open a shared memory block created by another process.
+
+        :param name: Name of the shared memory block
+        :param lock: The lock the block was created with, if processes may claim rows concurrently
+        :param clock: Function returning the current time. Defaults to time.time
+        :param clock_rate: Number of clock units in a second
+        :return: SharedCountTracker
+        """
+        return cls(name=name, lock=lock, clock=clock, clock_rate=clock_rate, _create=False)
+
+    def _create_rows(self, values, max_processes, bucket_count):
+        buffer_size = bucket_count + 1
+        rows = []
+        offset = _HEADER_SIZE
+        for _ in range(max_processes):
+            header = values[offset:offset + _ROW_HEADER_SIZE]
+            offset += _ROW_HEADER_SIZE
+            counts = values[offset:offset + buffer_size]
+            offset += buffer_size
+            timestamps = values[offset:offset + buffer_size]
+            offset += buffer_size
+            cumulative = values[offset:offset + buffer_size]
+            offset += buffer_size
+            rows.append(_SharedRow(header, counts, timestamps, cumulative, self._MEMORY_TIME_LIMIT,
+                                   self._resolution, self._clock, self._clock_rate, self._lock))
+        return rows
+
+    def _claim_row(self):
+        """
+        Claim a row for the current process: a row that was never used, or one whose owner has exited.
+        The ring buffer of a reclaimed row is kept, so events logged by the exited process keep counting,
+        and made consistent again if the owner died in the middle of a write.
+
+        :return: _SharedRow owned by the current process
+        """
+        pid = os.getpid()
+        with self._lock:
+            for row in self._rows:
+                owner = row._header[_OWNER]
+                if owner == 0:
+                    # Fresh row
+                    row._header[_LAST_TIME_LOGGED] = -1
+                    break
+                if owner == pid:
+                    break
+                if not _process_is_alive(owner):
+                    if row._version & 1:
+                        row._recover()
+                    break
+            else:
+                raise RuntimeError("All {} rows are owned by running processes".format(len(self._rows)))
+            row._header[_OWNER] = pid
+        self._row = row
+        return row
+
+    def __getstate__(self):
+        # Only the name travels to another process, which opens the block itself.
+        #   The clock is not sent, as it may not be picklable; the other process uses the default clock
+        return {'name': self.name, 'lock': self._lock, 'clock_rate': self._clock_rate}
+
+    def __setstate__(self, state):
+        self.__init__(name=state['name'], lock=state['lock'], clock_rate=state['clock_rate'], _create=False)
+
+    @property
+    def name(self):
+        """Name of the shared memory block"""
+        return self._shm.name
+
+    def log_event(self, at=None):
+        """
+        Log event at the current time (second).
+
+        :param at: Time of the event, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        row = self._row
+        if row is None:
+            row = self._claim_row()
+        row.log_event(at)
+
+    def log_events(self, n, at=None):
+        """
+        Log n events at once, all at the same second.
+
+        :param n: integer: Number of events to log
+        :param at: Time of the events, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        row = self._row
+        if row is None:
+            row = self._claim_row()
+        row.log_events(n, at)
+
+    def get_event_counts(self, duration, now=None):
+        """
+        Get the number of events that all processes have logged in the past X seconds, specified by 'duration'.
+        Same semantics as CountTracker.get_event_counts.
+
+        :param duration: integer: Number of seconds into the past to count events of
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
+        :return: Total number of events that occurred in the past 'duration' seconds
+        """
+        _duration_buckets(duration, self._MEMORY_TIME_LIMIT, self._resolution)
+
+        if now is None:
+            now = self._clock()
+        return sum(row.get_event_counts(duration, now) for row in self._rows if row._header[_OWNER] != 0)
+
+    def get_event_counts_many(self, durations, now=None):
+        """
+        Get the number of events all processes have logged in each of several durations, with a single clock read.
+        Same semantics as CountTracker.get_event_counts_many.
+
+        :param durations: iterable of numbers of seconds into the past to count events of
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
+        :return: List of the total number of events in each duration, in the same order
+        """
+        durations = list(durations)
+        for duration in durations:
+            _duration_buckets(duration, self._MEMORY_TIME_LIMIT, self._resolution)
+
+        if now is None:
+            now = self._clock()
+        counts = [0] * len(durations)
+        for row in self._rows:
+            if row._header[_OWNER] != 0:
+                counts = [count + row_count for count, row_count in zip(counts, row.get_event_counts_many(durations, now))]
+        return counts
+
+    def close(self):
+        """
+        Stop using the shared memory block in this process.
+
+        :return: None
+        """
+        self._row = None
+        self._rows = []
+        self._values.release()
+        self._shm.close()
+
+    def unlink(self):
+        """
+        Destroy the shared memory block. Should be called once, by the process that created it.
+
+        :return: None
+        """
+        if sys.version_info < (3, 13):
+            # A process attaching through the same resource tracker (this process, or a child started by
+            #   multiprocessing) unregistered the block, and unlink unregisters it again
+            resource_tracker.register(self._shm._name, 'shared_memory')
+        self._shm.unlink()
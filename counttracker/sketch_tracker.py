@@ -0,0 +1,288 @@
+from array import array
+from operator import itemgetter
+import math
+import random
+import time
+
+
+# Mersenne prime used for the pairwise independent hash of each sketch row
+_PRIME = (1 << 61) - 1
+
+
+class SketchCountTracker:
+    """
+    Approximately keeps track of the counts of events that have happened over the past 5 minutes, per key,
+    in a fixed amount of memory no matter how many distinct keys there are.
+    Time is split into groups of 'group_size' seconds, and each group holds a Count-Min Sketch of the keys
+    logged in it, in a ring buffer like CountTracker's. A running sketch of the whole window is kept as well.
+
+    Error bounds: an estimate is never lower than the true count. With probability at least 1 - delta,
+    it is at most the true count plus epsilon times the number of events in the groups counted.
+    Queries count whole groups, so events up to group_size - 1 seconds older than 'duration' may be included.
+
+    Keys whose estimate reaches heavy_fraction of the events in the window when they are logged are kept
+    as heavy hitter candidates, up to max_candidates of them (the largest). A key is only checked when it is
+    logged, so a key whose share only grows as other keys' events leave the window is not found until it
+    is logged again.
+    """
+    def __init__(self, epsilon=0.01, delta=0.01, group_size=10, heavy_fraction=0.001, max_candidates=1000,
+                 clock=None, clock_rate=1):
+        """
+        :param epsilon: float: Error as a fraction of the number of events counted
+        :param delta: float: Probability that an estimate is off by more than the error
+        :param group_size: integer: Number of seconds in each group. Must divide 300
+        :param heavy_fraction: float: Share of the window's events that makes a key a heavy hitter candidate
+        :param max_candidates: integer: Number of candidates kept when there are too many to keep them all
+        :param clock: Function returning the current time. Defaults to time.time
+        :param clock_rate: Number of clock units in a second, for example 1e9 for time.monotonic_ns.
+            Times passed as 'at' or 'now' are in the same units as the clock
+        """
+        self._MEMORY_TIME_LIMIT = 300  # 5 minutes * 60 seconds per minute
+
+        assert 0 < epsilon < 1, "Epsilon must be between 0 and 1"
+        assert 0 < delta < 1, "Delta must be between 0 and 1"
+        assert isinstance(group_size, int) and group_size > 0 and self._MEMORY_TIME_LIMIT % group_size == 0, \
+            "Group size must be a positive integer that divides {}".format(self._MEMORY_TIME_LIMIT)
+        assert 0 < heavy_fraction < 1, "Heavy hitter fraction must be between 0 and 1"
+        assert isinstance(max_candidates, int) and max_candidates > 0, \
+            "Maximum number of candidates must be a positive integer"
+
+        self._epsilon = epsilon
+        self._clock = clock if clock is not None else time.time
+        assert clock_rate > 0, "Clock rate must be positive"
+        self._scale = 1 / clock_rate
+        self._width = math.ceil(math.e / epsilon)
+        self._depth = math.ceil(math.log(1 / delta))
+        self._group_size = group_size
+
+        # Each sketch is a flat array of depth rows by width columns.
+        # The ring holds one group more than the window, so a window that starts part way
+        #   through a group is still covered
+        group_count = self._MEMORY_TIME_LIMIT // group_size + 1
+        sketch_size = self._width * self._depth
+        self._sketches = [array('q', [0]) * sketch_size for _ in range(group_count)]
+        self._groups = array('q', [-1]) * group_count
+        self._group_totals = array('q', [0]) * group_count
+        self._window = array('q', [0]) * sketch_size
+        self._window_total = 0
+        self._last_group = None
+
+        # Hash parameters of each row, with the offset of the row in the flat sketch
+        rng = random.Random(0)
+        self._rows = [(row * self._width, rng.randrange(1, _PRIME), rng.randrange(_PRIME))
+                      for row in range(self._depth)]
+
+        # Heavy hitter candidates, as a dictionary used as an ordered set
+        self._heavy_fraction = heavy_fraction
+        self._max_candidates = max_candidates
+        self._candidates = {}
+
+    def _cells(self, key):
+        """
+        Position of 'key' in each row of a flat sketch
+
+        :param key: Hashable key
+        :return: list of one index per row
+        """
+        h = hash(key)
+        width = self._width
+        return [offset + (a * h + b) % _PRIME % width for offset, a, b in self._rows]
+
+    def _advance(self, current_group):
+        """
+        Move the head of the ring buffer forward to current_group, if it is later than the head.
+        Groups that leave the window are taken off the window sketch and cleared.
+
+        :param current_group: integer, group number (time in seconds // group_size)
+        :return: None
+        """
+        last_group = self._last_group
+        if last_group is not None and current_group <= last_group:
+            return
+
+        group_count = len(self._groups)
+        if last_group is None:
+            first_group = current_group
+        else:
+            first_group = max(last_group + 1, current_group - group_count + 1)
+
+        window = self._window
+        for group in range(first_group, current_group + 1):
+            index = group % group_count
+            if self._group_totals[index]:
+                sketch = self._sketches[index]
+                for cell in range(len(window)):
+                    window[cell] -= sketch[cell]
+                self._sketches[index] = array('q', [0]) * len(window)
+                self._window_total -= self._group_totals[index]
+                self._group_totals[index] = 0
+            self._groups[index] = group
+
+        self._last_group = current_group
+
+    def _prune_candidates(self):
+        """
+        Drop candidates that are no longer heavy hitters over the window.
+        If there are still more than max_candidates, only the ones with the largest estimates are kept.
+
+        :return: None
+        """
+        window = self._window
+        minimum = self._heavy_fraction * self._window_total
+        estimates = {}
+        for key in self._candidates:
+            estimate = min(window[cell] for cell in self._cells(key))
+            if estimate >= minimum:
+                estimates[key] = estimate
+        if len(estimates) > self._max_candidates:
+            estimates = dict(sorted(estimates.items(), key=itemgetter(1), reverse=True)[:self._max_candidates])
+        self._candidates = dict.fromkeys(estimates)
+
+    def _log_count(self, key, second, count):
+        """
+        Add 'count' events of 'key' to 'second', which may be before, at or after the latest second logged.
+        Events too old to ever be counted again are dropped.
+
+        :param key: Key the events belong to
+        :param second: integer, time in seconds
+        :param count: integer, number of events
+        :return: None
+        """
+        group = second // self._group_size
+        last_group = self._last_group
+        group_count = len(self._groups)
+
+        if last_group is None or group >= last_group:
+            self._advance(group)
+        elif group <= last_group - group_count:
+            return
+        index = group % group_count
+        # The slot is only unclaimed (and empty) if the group is older than the first event logged
+        self._groups[index] = group
+
+        sketch = self._sketches[index]
+        window = self._window
+        cells = self._cells(key)
+        for cell in cells:
+            sketch[cell] += count
+            window[cell] += count
+        self._group_totals[index] += count
+        self._window_total += count
+
+        if min(window[cell] for cell in cells) >= self._heavy_fraction * self._window_total:
+            self._candidates[key] = None
+            # Prune in batches, so the cost is spread over many events
+            if len(self._candidates) > 2 * self._max_candidates:
+                self._prune_candidates()
+
+    def log_event(self, key, at=None):
+        """
+        Log event of 'key' at the current time (second).
+
+        :param key: Hashable key the event belongs to
+        :param at: Time of the event, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        self._log_count(key, int((self._clock() if at is None else at) * self._scale), 1)
+
+    def log_events(self, key, n, at=None):
+        """
+        Log n events of 'key' at once, all at the same second.
+
+        :param key: Hashable key the events belong to
+        :param n: integer: Number of events to log
+        :param at: Time of the events, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        assert isinstance(n, int) and n >= 0, "Number of events must be a nonnegative integer"
+
+        if at is None:
+            at = self._clock()
+
+        if n:
+            self._log_count(key, int(at * self._scale), n)
+
+    def _group_range(self, duration, now):
+        """
+        Move the head to the current time and find the groups a query over 'duration' counts.
+
+        :param duration: integer: Number of seconds into the past
+        :param now: Time to count back from, in the clock's units, or None for the current time
+        :return: (first group, last group) tuple; the range is empty when duration is 0
+        """
+        current_second = int((self._clock() if now is None else now) * self._scale)
+
+        assert duration >= 0, "Duration must be a nonnegative integer"
+        assert isinstance(duration, int), "Duration must be a nonnegative integer"
+        assert duration <= self._MEMORY_TIME_LIMIT, \
+            "Duration must be less than or equal to {} seconds".format(self._MEMORY_TIME_LIMIT)
+
+        current_group = current_second // self._group_size
+        self._advance(current_group)
+        if not duration:
+            return current_group + 1, current_group
+        return (current_second - duration + 1) // self._group_size, current_group
+
+    def _estimate(self, cells, first_group, last_group):
+        """
+        Estimate the count of the key at 'cells' over groups first_group to last_group, inclusive.
+
+        :return: integer estimate
+        """
+        group_count = len(self._groups)
+        if first_group > last_group:
+            return 0
+        if last_group == self._last_group and first_group <= last_group - group_count + 1:
+            # Whole window
+            window = self._window
+            return min(window[cell] for cell in cells)
+
+        sketches = [self._sketches[group % group_count] for group in range(first_group, last_group + 1)
+                    if self._groups[group % group_count] == group]
+        return min(sum(sketch[cell] for sketch in sketches) for cell in cells)
+
+    def estimate(self, key, duration, now=None):
+        """
+        Estimate the number of events of 'key' that have happened in the past X seconds, specified by 'duration'.
+
+        :param key: Key to count events of
+        :param duration: integer: Number of seconds into the past to count events of
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
+        :return: Estimated number of events, never lower than the true count
+        """
+        first_group, last_group = self._group_range(duration, now)
+        return self._estimate(self._cells(key), first_group, last_group)
+
+    def error_bound(self, duration, now=None):
+        """
+        Bound on how much estimate() can overcount for the given duration, with probability at least 1 - delta
+
+        :param duration: integer: Number of seconds into the past
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
+        :return: float, epsilon times the number of events counted
+        """
+        first_group, last_group = self._group_range(duration, now)
+        group_count = len(self._groups)
+        total = sum(self._group_totals[group % group_count] for group in range(first_group, last_group + 1)
+                    if self._groups[group % group_count] == group)
+        return self._epsilon * total
+
+    def heavy_hitters(self, duration, threshold, now=None):
+        """
+        Get the keys estimated to have at least 'threshold' events in the past X seconds, specified by 'duration'.
+        Only heavy hitter candidates are considered, so keys that had less than heavy_fraction of the window's
+        events when they were last logged, or that were pruned beyond max_candidates, are missed.
+
+        :param duration: integer: Number of seconds into the past to count events of
+        :param threshold: Minimum number of events
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
+        :return: List of (key, estimate) pairs, from the highest estimate to the lowest
+        """
+        first_group, last_group = self._group_range(duration, now)
+        hitters = []
+        for key in self._candidates:
+            estimate = self._estimate(self._cells(key), first_group, last_group)
+            if estimate >= threshold:
+                hitters.append((key, estimate))
+        hitters.sort(key=itemgetter(1), reverse=True)
+        return hitters
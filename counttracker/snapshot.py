@@ -0,0 +1,65 @@
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+
+class PeriodicSnapshot:
+    """
+    Dumps a tracker to a snapshot file every 'interval' seconds from a background thread, so a restarted
+    process can load it and carry on with (almost) the counts it had, instead of starting from zero.
+    A last snapshot is taken when it is stopped. A snapshot that fails (disk full, permissions) is logged
+    with the 'counttracker.snapshot' logger, and the next one is attempted at the next interval as usual.
+
+        with PeriodicSnapshot(tracker, 'counts.snapshot', interval=10):
+            ...
+    """
+    def __init__(self, tracker, path, interval=10):
+        """
+        :param tracker: Tracker with a dump(path) method, for example a CountTracker
+        :param path: Path of the snapshot file
+        :param interval: Number of seconds between snapshots. Defaults to 10 seconds
+        """
+        assert isinstance(interval, (int, float)) and interval > 0, "Interval must be a positive number"
+        self._tracker = tracker
+        self._path = path
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self._tracker.dump(self._path)
+            except Exception:
+                _logger.exception("Snapshot to %s failed", self._path)
+
+    def start(self):
+        """
+        Start taking snapshots in the background.
+
+        :return: None
+        """
+        assert self._thread is None, "Snapshots have already been started"
+        self._thread = threading.Thread(target=self._run, name='counttracker-snapshot', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop taking snapshots, and take a last one.
+
+        :return: None
+        """
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        self._tracker.dump(self._path)
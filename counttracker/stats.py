@@ -0,0 +1,88 @@
+from bisect import bisect_left, insort
+from collections import deque, namedtuple
+import math
+
+Stats = namedtuple('Stats', ['count', 'rate', 'peak', 'quantiles'])
+Stats.__doc__ = """
+Statistics of the per bucket counts over a duration, as returned by CountTracker.stats.
+count is the number of events, rate the mean events per second, peak the busiest bucket in events per second,
+and quantiles a dictionary of quantile -> bucket count at that quantile, in events per second.
+"""
+
+
+class _SlidingStats:
+    """
+    Counts of the last 'size' closed buckets, kept up to date one bucket at a time as buckets close:
+    a monotonic deque for the sliding maximum, a sorted list for quantiles and a running total.
+    Closing a bucket takes logarithmic time (plus moving part of the sorted list, in C),
+    and reading the maximum, total or a quantile takes constant time.
+    """
+    __slots__ = ('size', 'last_bucket', 'counts', 'maxima', 'sorted_counts', 'total')
+
+    def __init__(self, size, last_bucket, counts):
+        """
+        :param size: integer, number of buckets
+        :param last_bucket: integer, number of the newest bucket
+        :param counts: iterable of the counts of the 'size' buckets up to last_bucket, oldest first
+        """
+        self.size = size
+        self.last_bucket = last_bucket - size
+        self.counts = deque()
+        self.maxima = deque()  # (bucket, count), counts decreasing from the oldest to the newest
+        self.sorted_counts = []
+        self.total = 0
+        for count in counts:
+            self.push(count)
+        assert self.last_bucket == last_bucket
+
+    def push(self, count):
+        """
+        Add the count of the bucket after last_bucket, and drop the oldest one if there are more than 'size'.
+
+        :param count: integer, number of events
+        :return: None
+        """
+        self.last_bucket += 1
+        self.counts.append(count)
+        insort(self.sorted_counts, count)
+        self.total += count
+        while self.maxima and self.maxima[-1][1] <= count:
+            self.maxima.pop()
+        self.maxima.append((self.last_bucket, count))
+
+        if len(self.counts) > self.size:
+            oldest = self.counts.popleft()
+            del self.sorted_counts[bisect_left(self.sorted_counts, oldest)]
+            self.total -= oldest
+            if self.maxima[0][0] <= self.last_bucket - self.size:
+                self.maxima.popleft()
+
+    def close(self, bucket, count, current_bucket):
+        """
+        Add a closed bucket, and the empty buckets skipped between it and current_bucket.
+
+        :param bucket: integer, number of the bucket closed, right after last_bucket
+        :param count: integer, number of events in it
+        :param current_bucket: integer, number of the new current bucket
+        :return: None
+        """
+        if current_bucket - bucket > self.size:
+            # Every bucket in the window is empty
+            self.__init__(self.size, current_bucket - 1, [0] * self.size)
+            return
+        self.push(count)
+        for _ in range(bucket + 1, current_bucket):
+            self.push(0)
+
+    @property
+    def peak(self):
+        return self.maxima[0][1]
+
+    def quantile(self, q):
+        """
+        Nearest rank quantile of the counts.
+
+        :param q: number between 0 and 1
+        :return: integer, count
+        """
+        return self.sorted_counts[max(math.ceil(q * self.size) - 1, 0)]
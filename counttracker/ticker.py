@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+
+
+class _Tick:
+    """Current bucket number at one scale (buckets per clock unit), as last published by the ticker"""
+    __slots__ = ('scale', 'bucket', 'subscribers')
+
+    def __init__(self, scale, bucket):
+        self.scale = scale
+        self.bucket = bucket
+        self.subscribers = 0
+
+
+class Ticker:
+    """
+    Publishes the current bucket number for every resolution in use, from a background thread that wakes
+    up once per bucket, so trackers in coarse clock mode read it instead of calling the clock on every event.
+    All the trackers with the same resolution share one published value, however many there are.
+    A resolution stops being published once every tracker using it is gone, so the thread goes back
+    to waking up only as often as the resolutions still in use need.
+
+    Buckets change as soon as the thread runs after the boundary, typically well within a millisecond,
+    but up to the interpreter's thread switch interval (5 milliseconds by default) when other threads
+    keep it busy; events logged in that gap count in the bucket before.
+    """
+    def __init__(self, clock=None, max_wait=1):
+        """
+        :param clock: Function returning the current time. Defaults to time.time
+        :param max_wait: Longest the thread sleeps between two checks of the clock, in seconds,
+            so a clock that jumps is noticed. Defaults to 1 second
+        """
+        self._clock = clock if clock is not None else time.time
+        self._max_wait = max_wait
+        self._ticks = {}  # Scale -> _Tick
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def subscribe(self, scale):
+        """
+        Get the published current bucket for a scale, which is kept up to date until every subscription
+        to the scale is undone with unsubscribe.
+
+        :param scale: Buckets per clock unit, 1 / (resolution * clock rate)
+        :return: object whose 'bucket' attribute is the current bucket number
+        """
+        with self._lock:
+            tick = self._ticks.get(scale)
+            if tick is None:
+                tick = self._ticks[scale] = _Tick(scale, int(self._clock() * scale))
+                # The thread may be sleeping until a later boundary than this resolution's
+                self._wake.set()
+            tick.subscribers += 1
+            return tick
+
+    def unsubscribe(self, scale):
+        """
+        Undo one subscription to a scale. The scale is no longer published once it has no subscriptions left.
+
+        :param scale: Buckets per clock unit, as passed to subscribe
+        :return: None
+        """
+        with self._lock:
+            tick = self._ticks[scale]
+            tick.subscribers -= 1
+            if not tick.subscribers:
+                del self._ticks[scale]
+
+    def tick(self):
+        """
+        Publish the current bucket of every scale.
+
+        :return: Seconds until the next bucket boundary, at most max_wait
+        """
+        now = self._clock()
+        wait = self._max_wait
+        for tick in list(self._ticks.values()):
+            bucket = int(now * tick.scale)
+            tick.bucket = bucket
+            wait = min(wait, (bucket + 1) / tick.scale - now)
+        return wait
+
+    def _run(self):
+        while True:
+            # Cleared before the clock is read, so a subscribe or stop from then on cuts the wait short
+            self._wake.clear()
+            if self._stopped:
+                return
+            wait = self.tick()
+            self._wake.wait(max(wait, 0))
+
+    def start(self):
+        """
+        Start publishing from a background thread.
+
+        :return: None
+        """
+        assert self._thread is None, "The ticker is already running"
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='counttracker-ticker', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread. Buckets are no longer published, so trackers using the ticker stop moving.
+
+        :return: None
+        """
+        if self._thread is None:
+            return
+        self._stopped = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+
+_shared_ticker = None
+_shared_ticker_lock = threading.Lock()
+
+
+def shared_ticker():
+    """
+    The ticker shared by every tracker in the process created with coarse_clock=True,
+    running on time.time. Started the first time it is asked for.
+
+    :return: Ticker
+    """
+    global _shared_ticker
+    with _shared_ticker_lock:
+        if _shared_ticker is None:
+            _shared_ticker = Ticker()
+            _shared_ticker.start()
+        return _shared_ticker
+
+
+def _restart_after_fork():
+    # Threads do not survive a fork, so the child needs its own ticker thread
+    global _shared_ticker_lock
+    _shared_ticker_lock = threading.Lock()
+    if _shared_ticker is not None and _shared_ticker._thread is not None:
+        _shared_ticker._lock = threading.Lock()
+        _shared_ticker._wake = threading.Event()
+        _shared_ticker._thread = None
+        _shared_ticker.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
@@ -0,0 +1,163 @@
+import time
+
+from .counttracker import CountTracker, _duration_buckets
+
+
+# 1 second buckets for 5 minutes, then 1 minute buckets for an hour, then 1 hour buckets for a week
+DEFAULT_TIERS = ((5 * 60, 1), (60 * 60, 60), (7 * 24 * 60 * 60, 60 * 60))
+
+
+class TieredCountTracker:
+    """
+    Keeps track of the counts of events over a long window, with less precision the older the events are.
+    Each tier is a CountTracker with its own window and resolution. Events are logged into the first tier,
+    and as a bucket ages out of a tier it is rolled up into the next, coarser one, the way round robin
+    databases work. The last tier simply forgets its oldest buckets.
+
+    The tiers cover consecutive stretches of time: with the default tiers, the last 5 minutes are kept per
+    second, the hour before that per minute, and the week before that per hour.
+    Counts are exact within the first tier. Further back, a query counts whole buckets, so events up to one
+    bucket older than 'duration' may be included.
+    """
+    def __init__(self, tiers=DEFAULT_TIERS, clock=None, clock_rate=1):
+        """
+        :param tiers: Sequence of (window, resolution) pairs in seconds, from the finest tier to the coarsest.
+            Each resolution must be a whole multiple of the one before it
+        :param clock: Function returning the current time. Defaults to time.time
+        :param clock_rate: Number of clock units in a second, for example 1e9 for time.monotonic_ns
+        """
+        assert len(tiers) >= 1, "There must be at least one tier"
+
+        # Tiers after the first keep one extra bucket, because the boundary between two tiers falls
+        #   part way through a bucket of the coarser one
+        self._tiers = [CountTracker(window if level == 0 else window + resolution, resolution)
+                       for level, (window, resolution) in enumerate(tiers)]
+        self._MEMORY_TIME_LIMIT = sum(window for window, _ in tiers)
+        self._resolution = tiers[0][1]
+        self._clock = clock if clock is not None else time.time
+        assert clock_rate > 0, "Clock rate must be positive"
+        self._scale = 1 / (self._resolution * clock_rate)
+
+        # Buckets of the first tier in one bucket of each tier
+        self._spans = []
+        for _, resolution in tiers:
+            span = round(resolution / self._resolution)
+            assert span * self._resolution == resolution and (not self._spans or span % self._spans[-1] == 0), \
+                "Each resolution must be a whole multiple of the one before it"
+            self._spans.append(span)
+        # Buckets of each tier in one bucket of the next tier
+        self._ratios = [coarse // fine for fine, coarse in zip(self._spans, self._spans[1:])]
+
+        # Latest bucket of each tier that has been rolled up into the next tier (None when nothing has).
+        #   Tier i holds the buckets after _rolled[i], the next tier holds the ones up to it
+        self._rolled = [None] * len(self._tiers)
+
+    def _roll_up(self, level, new_head):
+        """
+        Roll up the buckets of a tier that are about to leave it, before its head moves to new_head.
+
+        :param level: integer, index of the tier
+        :param new_head: integer, bucket number the tier's head is moving to
+        :return: None
+        """
+        if level == len(self._tiers) - 1:
+            return
+
+        tier = self._tiers[level]
+        target = new_head - tier._bucket_count
+        head = tier._last_time_logged
+        rolled = self._rolled[level]
+
+        if head is not None:
+            first_bucket = head - tier._bucket_count + 1 if rolled is None else rolled + 1
+            buffer_size = len(tier._counts)
+            ratio = self._ratios[level]
+            for bucket in range(first_bucket, min(target, head) + 1):
+                index = bucket % buffer_size
+                if tier._timestamps[index] == bucket and tier._counts[index]:
+                    self._log(level + 1, bucket // ratio, tier._counts[index])
+
+        if rolled is None or target > rolled:
+            self._rolled[level] = target
+
+    def _log(self, level, bucket, count):
+        """
+        Add 'count' events to a bucket of a tier. Events older than what the tier holds go to the next tier.
+
+        :param level: integer, index of the tier
+        :param bucket: integer, bucket number in the tier's resolution
+        :param count: integer, number of events
+        :return: None
+        """
+        tier = self._tiers[level]
+        last_bucket = tier._last_time_logged
+        if last_bucket is None or bucket > last_bucket:
+            self._roll_up(level, bucket)
+
+        rolled = self._rolled[level]
+        if rolled is not None and bucket <= rolled:
+            if level + 1 < len(self._tiers):
+                self._log(level + 1, bucket // self._ratios[level], count)
+            return
+
+        tier._log_count(bucket, count)
+
+    def log_event(self, at=None):
+        """
+        Log event at the current time.
+
+        :param at: Time of the event, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        self._log(0, int((self._clock() if at is None else at) * self._scale), 1)
+
+    def log_events(self, n, at=None):
+        """
+        Log n events at once, all at the same time.
+
+        :param n: integer: Number of events to log
+        :param at: Time of the events, in the clock's units. Defaults to the current time
+        :return: None
+        """
+        assert isinstance(n, int) and n >= 0, "Number of events must be a nonnegative integer"
+
+        if at is None:
+            at = self._clock()
+
+        if n:
+            self._log(0, int(at * self._scale), n)
+
+    def get_event_counts(self, duration, now=None):
+        """
+        Get the number of events that have happened in the past X seconds, specified by 'duration'.
+        Same semantics as CountTracker.get_event_counts, up to the sum of the tier windows.
+        Adds up one range of buckets per tier, so it runs in time proportional to the number of tiers.
+
+        :param duration: Number of seconds into the past to count events of. Must be a multiple of
+            the first tier's resolution
+        :param now: Time to count back from, in the clock's units. Defaults to the current time
+        :return: Total number of events that occurred in the past 'duration' seconds
+        """
+        current_bucket = int((self._clock() if now is None else now) * self._scale)
+        start_bucket = current_bucket - _duration_buckets(duration, self._MEMORY_TIME_LIMIT, self._resolution)
+
+        total_count = 0
+        for tier, span, rolled in zip(self._tiers, self._spans, self._rolled):
+            head = tier._last_time_logged
+            if head is None:
+                continue
+
+            # Count the buckets of the tier after 'lower' up to 'upper'. The first bucket of the query is
+            #   included whole, and so are the buckets the tier no longer holds
+            lower = max((start_bucket + 1) // span - 1, head - tier._bucket_count)
+            if rolled is not None:
+                lower = max(lower, rolled)
+            upper = min(head, current_bucket // span)
+            if upper > lower:
+                total_count += tier._total_at(upper) - tier._total_at(lower)
+
+            # Coarser tiers only hold events up to the end of the last bucket rolled out of this one
+            if rolled is None or start_bucket >= (rolled + 1) * span - 1:
+                break
+
+        return total_count
@@ -3,5 +3,9 @@ from setuptools import setup
 setup(name='counttracker',
     version='0.1.0',
     packages=['counttracker'],
+    python_requires='>=3.8',
     install_requires=[ ],
+    entry_points={
+        'console_scripts': ['counttracker=counttracker.daemon:main'],
+    },
     zip_safe=False)
\ No newline at end of file
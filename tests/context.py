@@ -3,4 +3,31 @@ import sys
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-import counttracker
\ No newline at end of file
+import counttracker
+
+
+class FakeClock:
+    """
+    Clock that only moves when told to. Can be passed as a tracker's clock, or stand in for the time module
+    of the modules under test (see patch_time) so trackers using the default clock log at chosen seconds.
+    """
+    def __init__(self, now=1000):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+def patch_time(monkeypatch, modules, now):
+    """
+    Replace the time module of each of 'modules' with a FakeClock for the duration of a test.
+
+    :return: FakeClock
+    """
+    clock = FakeClock(now)
+    for module in modules:
+        monkeypatch.setattr(module, 'time', clock)
+    return clock
@@ -0,0 +1,269 @@
+import random
+import sys
+import threading
+import pytest
+
+from .context import FakeClock, counttracker
+
+
+def _drain(engine):
+    alerts = []
+    while not engine.alerts.empty():
+        alerts.append(engine.alerts.get())
+    return [(alert.rule.name, alert.firing, alert.count, alert.time) for alert in alerts]
+
+
+def _count_evaluations(rule):
+    evaluations = []
+    evaluate = rule._evaluate
+    rule._evaluate = lambda current_bucket: evaluations.append(current_bucket) or evaluate(current_bucket)
+    return evaluations
+
+
+def test_above():
+    clock = FakeClock()
+    tracker = counttracker.CountTracker(clock=clock)
+    engine = counttracker.AlertEngine(clock=clock)
+    rule = engine.above(tracker, 10, 3, name='busy')
+
+    for _ in range(3):
+        tracker.log_event()
+    assert _drain(engine) == []
+    tracker.log_event()
+    assert _drain(engine) == [('busy', True, 4, 1000)]
+    assert rule.firing
+
+    # Without events, the count falls back to 3 once the bucket of 1000 leaves the window
+    clock.now = 1003
+    tracker.log_event()
+    assert engine.poll() == 1010
+    clock.now = 1010
+    assert engine.poll() is None
+    assert _drain(engine) == [('busy', False, 1, 1010)]
+    assert not rule.firing
+
+
+def test_above_from_batches_and_late_events():
+    clock = FakeClock()
+    tracker = counttracker.CountTracker(clock=clock)
+    engine = counttracker.AlertEngine(clock=clock)
+    engine.above(tracker, 10, 5, name='busy')
+
+    tracker.log_events(5)
+    clock.now = 1002
+    tracker.log_events(1, at=1001)
+
+    assert _drain(engine) == [('busy', True, 6, 1002)]
+
+
+def test_merged_counts_are_evaluated():
+    clock = FakeClock()
+    tracker = counttracker.CountTracker(clock=clock)
+    engine = counttracker.AlertEngine(clock=clock)
+    engine.above(tracker, 10, 5, name='busy')
+    other = counttracker.CountTracker(clock=clock)
+    other.log_events(4)
+
+    tracker.merge(other)
+    assert _drain(engine) == []
+    tracker.apply_delta(other.export_delta())
+    tracker.merge(other)
+    assert _drain(engine) == [('busy', True, 8, 1000)]
+
+
+def test_timer_evaluations_are_consistent_while_logging():
+    # One thread logs an event every 50 buckets while another evaluates the rule as the timer thread
+    #   would: no evaluation may count a bucket twice while the head is moving
+    tracker = counttracker.CountTracker(window=100000, clock=lambda: 0)
+    engine = counttracker.AlertEngine(clock=lambda: 0)
+    engine.above(tracker, 100, 2)
+    watch = engine._watches[id(tracker)]
+    done = threading.Event()
+
+    def evaluate():
+        while not done.is_set():
+            engine._evaluate(watch)
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    evaluator = threading.Thread(target=evaluate)
+    try:
+        evaluator.start()
+        for at in range(0, 1000000, 50):
+            tracker.log_event(at)
+    finally:
+        done.set()
+        evaluator.join()
+        sys.setswitchinterval(switch_interval)
+
+    assert _drain(engine) == []
+
+
+def test_alert_when_added():
+    clock = FakeClock()
+    tracker = counttracker.CountTracker(clock=clock)
+    tracker.log_events(5)
+    engine = counttracker.AlertEngine(clock=clock)
+
+    engine.above(tracker, 10, 3, name='busy')
+
+    assert _drain(engine) == [('busy', True, 5, 1000)]
+
+
+def test_below():
+    clock = FakeClock()
+    tracker = counttracker.CountTracker(clock=clock)
+    engine = counttracker.AlertEngine(clock=clock)
+    tracker.log_event()
+    clock.now = 1004
+    tracker.log_event()
+    engine.below(tracker, 60, 2, name='heartbeat')
+
+    assert engine.poll() == 1060
+    clock.now = 1060
+    engine.poll()
+    assert _drain(engine) == [('heartbeat', True, 1, 1060)]
+
+    tracker.log_event()
+    assert _drain(engine) == [('heartbeat', False, 2, 1060)]
+
+
+def test_drop():
+    clock = FakeClock(1005)
+    tracker = counttracker.CountTracker(clock=clock)
+    engine = counttracker.AlertEngine(clock=clock)
+    engine.drop(tracker, 10, 0.8, name='drop')
+    tracker.log_events(100)
+
+    # The bucket of 1005 moves into the previous window at 1015
+    assert engine.poll() == 1015
+    clock.now = 1015
+    engine.poll()
+    assert _drain(engine) == [('drop', True, 0, 1015)]
+
+    clock.now = 1016
+    tracker.log_events(20)
+    assert _drain(engine) == []
+    tracker.log_event()
+    assert _drain(engine) == [('drop', False, 21, 1016)]
+
+
+def test_drop_invalid():
+    tracker = counttracker.CountTracker()
+    engine = counttracker.AlertEngine()
+
+    with pytest.raises(AssertionError):
+        engine.drop(tracker, 200, 0.5)
+    with pytest.raises(AssertionError):
+        engine.drop(tracker, 60, 0)
+    with pytest.raises(AssertionError):
+        engine.below(tracker, 60, 0)
+    with pytest.raises(AssertionError):
+        engine.above(tracker, 301, 1)
+
+
+def test_events_between_boundaries_are_not_evaluated():
+    clock = FakeClock()
+    engine = counttracker.AlertEngine(clock=clock)
+    trackers = [counttracker.CountTracker(clock=clock) for _ in range(1000)]
+    rules = [engine.above(tracker, 60, 100) for tracker in trackers]
+    # The first event opens a bucket, which is evaluated
+    trackers[0].log_event()
+    evaluations = [_count_evaluations(rule) for rule in rules]
+
+    for _ in range(99):
+        trackers[0].log_event()
+    assert sum(map(len, evaluations)) == 0
+
+    trackers[0].log_event()
+    assert evaluations[0] == [1000]
+    assert sum(map(len, evaluations)) == 1
+
+
+def test_callback():
+    clock = FakeClock()
+    tracker = counttracker.CountTracker(clock=clock)
+    alerts = []
+    engine = counttracker.AlertEngine(callback=alerts.append, clock=clock)
+
+    rule = engine.above(tracker, 1, 0)
+    tracker.log_event()
+
+    assert alerts == [counttracker.Alert(rule, True, 1, 1000)]
+    assert engine.alerts.empty()
+
+
+def test_remove():
+    clock = FakeClock()
+    engine = counttracker.AlertEngine(clock=clock)
+    tracker = counttracker.CountTracker(clock=clock)
+    first = engine.above(tracker, 10, 1)
+    second = engine.above(tracker, 10, 2)
+
+    engine.remove(first)
+    tracker.log_events(2)
+    assert engine.alerts.empty()
+    engine.remove(second)
+
+    assert 'log_event' not in tracker.__dict__ and '_log_count' not in tracker.__dict__
+    tracker.log_events(5)
+    assert engine.alerts.empty()
+
+
+def test_remove_keeps_coarse_clock():
+    clock = FakeClock()
+    ticker = counttracker.Ticker(clock)
+    tracker = counttracker.CountTracker(coarse_clock=ticker)
+    engine = counttracker.AlertEngine(clock=clock)
+
+    rule = engine.above(tracker, 10, 1)
+    tracker.log_event()
+    tracker.log_event()
+    assert engine.alerts.get().firing
+    engine.remove(rule)
+
+    assert tracker.log_event.__func__ is counttracker.CountTracker._log_event_coarse
+    tracker.log_event()
+    assert tracker.get_event_counts(10) == 3
+
+
+def test_timer_thread():
+    clock = FakeClock()
+    tracker = counttracker.CountTracker(clock=clock)
+    engine = counttracker.AlertEngine(clock=clock, max_wait=0.01)
+    engine.above(tracker, 10, 0, name='busy')
+    tracker.log_event()
+    assert engine.alerts.get(timeout=1).firing
+
+    engine.start()
+    try:
+        clock.now = 1010
+        alert = engine.alerts.get(timeout=1)
+    finally:
+        engine.stop()
+
+    assert (alert.rule.name, alert.firing) == ('busy', False)
+
+
+def test_matches_evaluating_every_second():
+    rng = random.Random(5)
+    clock = FakeClock()
+    tracker = counttracker.CountTracker(window=60, clock=clock)
+    engine = counttracker.AlertEngine(clock=clock)
+    above = engine.above(tracker, 10, 8)
+    below = engine.below(tracker, 5, 2)
+    drop = engine.drop(tracker, 20, 0.5)
+
+    for now in range(1000, 1400):
+        clock.now = now
+        engine.poll()
+        for _ in range(rng.choice([0, 0, 0, 1, 2, 5])):
+            if rng.random() < 0.2:
+                tracker.log_event(at=now - rng.randrange(3))
+            else:
+                tracker.log_event()
+
+        current, previous = tracker.get_event_counts(20), tracker.get_event_counts(40) - tracker.get_event_counts(20)
+        assert above.firing == (tracker.get_event_counts(10) > 8)
+        assert below.firing == (tracker.get_event_counts(5) < 2)
+        assert drop.firing == (previous > 0 and current <= previous / 2)
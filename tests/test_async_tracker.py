@@ -0,0 +1,137 @@
+import asyncio
+import pytest
+
+try:
+    from contextlib import aclosing
+except ImportError:  # Python < 3.10
+    aclosing = None
+
+from .context import FakeClock, counttracker
+
+
+def test_log_and_count():
+    async def run():
+        clock = FakeClock(1000)
+        async with counttracker.AsyncCountTracker(clock=clock) as tracker:
+            tracker.log_event()
+            tracker.log_events(4)
+            clock.now = 1010
+            tracker.log_event()
+
+            assert await tracker.get_event_counts(1) == 1
+            assert await tracker.get_event_counts(11) == 6
+            assert await tracker.get_event_counts(300, now=1305) == 1
+
+    asyncio.run(run())
+
+
+def test_get_event_counts_invalid():
+    async def run():
+        async with counttracker.AsyncCountTracker() as tracker:
+            with pytest.raises(AssertionError):
+                await tracker.get_event_counts(-1)
+            with pytest.raises(AssertionError):
+                await tracker.get_event_counts(301)
+
+    asyncio.run(run())
+
+
+def test_background_expiry():
+    async def run():
+        clock = FakeClock(1000)
+        async with counttracker.AsyncCountTracker(window=1, resolution=0.01, clock=clock) as tracker:
+            tracker.log_events(5)
+            await asyncio.sleep(0.02)
+
+            # The expiry task moves the head forward without any event or query
+            clock.now = 1000.5
+            await asyncio.sleep(0.05)
+            assert tracker._tracker._last_time_logged == int(1000.5 * 100)
+            assert await tracker.get_event_counts(1) == 5
+
+            clock.now = 1002
+            await asyncio.sleep(0.05)
+            assert await tracker.get_event_counts(1) == 0
+
+    asyncio.run(run())
+
+
+@pytest.mark.skipif(aclosing is None, reason="contextlib.aclosing needs Python 3.10")
+def test_watch():
+    async def run():
+        clock = FakeClock(1000)
+        async with counttracker.AsyncCountTracker(clock=clock) as tracker:
+            tracker.log_events(3)
+            snapshots = []
+            async with aclosing(tracker.watch(0.01, durations=[1, 60])) as stream:
+                async for snapshot in stream:
+                    snapshots.append(snapshot)
+                    clock.now += 30
+                    tracker.log_event()
+                    if len(snapshots) == 3:
+                        break
+
+            assert snapshots == [{1: 3, 60: 3}, {1: 1, 60: 4}, {1: 1, 60: 2}]
+            assert not tracker._publishers
+            assert not tracker._subscribers
+
+    asyncio.run(run())
+
+
+@pytest.mark.skipif(aclosing is None, reason="contextlib.aclosing needs Python 3.10")
+def test_watch_subscribers_share_publisher():
+    async def run():
+        clock = FakeClock(1000)
+        async with counttracker.AsyncCountTracker(clock=clock) as tracker:
+            tracker.log_events(2)
+
+            async def first_snapshots(count):
+                snapshots = []
+                async with aclosing(tracker.watch(0.01, durations=[300])) as stream:
+                    async for snapshot in stream:
+                        snapshots.append(snapshot)
+                        if len(snapshots) == count:
+                            return snapshots
+
+            first = asyncio.ensure_future(first_snapshots(2))
+            second = asyncio.ensure_future(first_snapshots(3))
+            await asyncio.sleep(0)
+            assert len(tracker._publishers) == 1
+            assert len(tracker._subscribers[(0.01, (300,))]) == 2
+
+            assert await first == [{300: 2}] * 2
+            assert await second == [{300: 2}] * 3
+            assert not tracker._publishers
+
+    asyncio.run(run())
+
+
+def test_watch_ends_on_close():
+    async def run():
+        tracker = counttracker.AsyncCountTracker(clock=FakeClock(1000))
+        tracker.start()
+        snapshots = []
+
+        async def watch():
+            async for snapshot in tracker.watch(10):
+                snapshots.append(snapshot)
+
+        watcher = asyncio.ensure_future(watch())
+        await asyncio.sleep(0.01)
+        await tracker.close()
+        await asyncio.wait_for(watcher, 1)
+
+        assert snapshots == [{1: 0, 60: 0, 300: 0}]
+
+    asyncio.run(run())
+
+
+def test_watch_invalid():
+    async def run():
+        async with counttracker.AsyncCountTracker() as tracker:
+            with pytest.raises(AssertionError):
+                await tracker.watch(0).__anext__()
+            with pytest.raises(AssertionError):
+                await tracker.watch(1, durations=[301]).__anext__()
+
+    asyncio.run(run())
@@ -0,0 +1,135 @@
+import sys
+import threading
+import time
+import pytest
+
+from .context import counttracker
+
+
+@pytest.fixture
+def fast_thread_switching():
+    # Switch threads as often as possible to give races every chance to show up
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def _run_threads(target, count):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_init():
+    tracker = counttracker.ConcurrentCountTracker()
+
+    assert tracker is not None
+    assert tracker.get_event_counts(300) == 0
+
+
+def test_get_event_counts_invalid():
+    tracker = counttracker.ConcurrentCountTracker()
+
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts(-1)
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts(1.5)
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts(301)
+
+
+def test_window_and_resolution():
+    tracker = counttracker.ConcurrentCountTracker(window=3600, resolution=60)
+
+    _run_threads(tracker.log_event, 3)
+
+    assert tracker._shards[0][1]._bucket_count == 60
+    assert tracker.get_event_counts(3600) == 3
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts(30)
+
+
+def test_one_shard_per_thread():
+    tracker = counttracker.ConcurrentCountTracker()
+
+    tracker.log_event()
+    tracker.log_event()
+    _run_threads(tracker.log_event, 3)
+
+    assert len(tracker._shards) == 4
+    assert tracker.get_event_counts(10) == 5
+
+
+def test_log_events():
+    tracker = counttracker.ConcurrentCountTracker()
+    current_time = time.time()
+
+    tracker.log_events(3)
+    tracker.log_events(4, at=current_time - 100)
+    tracker.log_events_at([current_time - 200, current_time - 200.5])
+
+    assert tracker.get_event_counts(10) == 3
+    assert tracker.get_event_counts(300) == 9
+
+
+def test_injected_clock():
+    now = [1000.0]
+    tracker = counttracker.ConcurrentCountTracker(clock=lambda: now[0])
+
+    tracker.log_event()
+    _run_threads(lambda: tracker.log_event(at=990), 2)
+    now[0] += 100
+
+    assert tracker.get_event_counts(100) == 0
+    assert tracker.get_event_counts(111) == 3
+    assert tracker.get_event_counts(1, now=1000) == 1
+
+
+def test_get_event_counts_many():
+    now = [1000.0]
+    tracker = counttracker.ConcurrentCountTracker(clock=lambda: now[0])
+
+    tracker.log_event()
+    _run_threads(lambda: tracker.log_events(2, at=990), 2)
+
+    assert tracker.get_event_counts_many([1, 10, 11, 300]) == [1, 1, 5, 5]
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts_many([301])
+
+
+def test_exited_threads_with_expired_counts_are_dropped():
+    tracker = counttracker.ConcurrentCountTracker()
+
+    _run_threads(lambda: tracker.log_events(1, at=time.time() - 1000), 3)
+    _run_threads(tracker.log_event, 1)
+
+    assert len(tracker._shards) == 1
+
+
+def test_stress_exact_totals(fast_thread_switching):
+    tracker = counttracker.ConcurrentCountTracker()
+    threads = 16
+    events_per_thread = 20000
+    done = threading.Event()
+
+    def log():
+        for _ in range(events_per_thread):
+            tracker.log_event()
+        tracker.log_events(10)
+
+    def query():
+        while not done.is_set():
+            assert tracker.get_event_counts(300) <= threads * (events_per_thread + 10)
+
+    readers = [threading.Thread(target=query) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    _run_threads(log, threads)
+    done.set()
+    for reader in readers:
+        reader.join()
+
+    assert tracker.get_event_counts(300) == threads * (events_per_thread + 10)
@@ -1,7 +1,26 @@
+from array import array
+import math
+import random
+import sys
+import threading
 import time
 import pytest
 
-from .context import counttracker
+from .context import counttracker, patch_time
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    return patch_time(monkeypatch, [counttracker.counttracker], time.time())
+
+
+def _log_at(tracker, clock, timestamp, count):
+    """Log 'count' events at 'timestamp', then restore the clock"""
+    now = clock.now
+    clock.now = timestamp
+    for _ in range(count):
+        tracker.log_event()
+    clock.now = now
 
 
 def test_init():
@@ -9,121 +28,193 @@ def test_init():
     assert tracker is not None
 
 
-### Test _remove_old_events ###
-def test_remove_old_events_empty():
+def test_init_fixed_size_buffer():
     tracker = counttracker.CountTracker()
-    current_time = time.time()
 
-    tracker._remove_old_events(current_time)
+    assert len(tracker._counts) == 301
+    assert len(tracker._timestamps) == 301
+    assert len(tracker._cumulative) == 301
+    assert tracker._total == 0
 
-    assert len(tracker._history) == 0
 
+def test_init_window_and_resolution():
+    tracker = counttracker.CountTracker(window=24 * 60 * 60, resolution=60)
 
-def test_remove_old_events_all_recent():
-    tracker = counttracker.CountTracker()
-    current_time = time.time()
+    assert len(tracker._counts) == 24 * 60 + 1
 
-    tracker._history.append(counttracker.EventSecond(current_time-2))
-    tracker._history.append(counttracker.EventSecond(current_time-1))
-    tracker._history.append(counttracker.EventSecond(current_time))
 
-    assert len(tracker._history) == 3
+def test_init_large_window_is_compact():
+    tracker = counttracker.CountTracker(window=24 * 60 * 60, resolution=1)
 
-    tracker._remove_old_events(current_time)
+    # Three flat arrays of 8 byte integers, rather than one object per second
+    assert len(tracker._counts) == 24 * 60 * 60 + 1
+    assert tracker._counts.itemsize == 8
 
-    assert len(tracker._history) == 3 # Nothing is removed
-    assert tracker._history[0].timestamp == int(current_time - 2)
-    assert tracker._history[1].timestamp == int(current_time - 1)
-    assert tracker._history[2].timestamp == int(current_time)
+
+def test_init_invalid_window_and_resolution():
+    with pytest.raises(AssertionError):
+        counttracker.CountTracker(resolution=0)
+    with pytest.raises(AssertionError):
+        counttracker.CountTracker(window=0)
+    with pytest.raises(AssertionError):
+        counttracker.CountTracker(window=10, resolution=3)  # Not a whole number of buckets
 
 
-def test_remove_old_events_all_old():
+### Test stale slots ###
+def test_stale_slots_empty():
     tracker = counttracker.CountTracker()
-    current_time = time.time()
 
-    tracker._history.append(counttracker.EventSecond(current_time-303))
-    tracker._history.append(counttracker.EventSecond(current_time-302))
-    tracker._history.append(counttracker.EventSecond(current_time-301))
+    assert tracker.get_event_counts(300) == 0
 
-    assert len(tracker._history) == 3
 
-    tracker._remove_old_events(current_time)
+def test_stale_slots_all_recent(clock):
+    tracker = counttracker.CountTracker()
+    current_time = clock.now
+
+    _log_at(tracker, clock, current_time - 2, 1)
+    _log_at(tracker, clock, current_time - 1, 1)
+    _log_at(tracker, clock, current_time, 1)
 
-    assert len(tracker._history) == 0
+    assert tracker.get_event_counts(300) == 3  # Nothing is stale
 
 
-def test_remove_old_events_some_recent_some_old():
+def test_stale_slots_all_old(clock):
     tracker = counttracker.CountTracker()
-    current_time = time.time()
+    current_time = clock.now
 
-    tracker._history.append(counttracker.EventSecond(current_time-301))
-    tracker._history.append(counttracker.EventSecond(current_time-300))
-    tracker._history.append(counttracker.EventSecond(current_time-299))
+    _log_at(tracker, clock, current_time - 303, 1)
+    _log_at(tracker, clock, current_time - 302, 1)
+    _log_at(tracker, clock, current_time - 301, 1)
 
-    assert len(tracker._history) == 3
+    assert tracker.get_event_counts(300) == 0
 
-    tracker._remove_old_events(current_time)
 
-    assert len(tracker._history) == 2 # One event is removed (301)
-    assert tracker._history[0].timestamp == int(current_time - 300)
-    assert tracker._history[1].timestamp == int(current_time - 299)
+def test_stale_slots_some_recent_some_old(clock):
+    tracker = counttracker.CountTracker()
+    current_time = clock.now
+
+    _log_at(tracker, clock, current_time - 301, 1)
+    _log_at(tracker, clock, current_time - 300, 1)
+    _log_at(tracker, clock, current_time - 299, 1)
+
+    assert tracker.get_event_counts(300) == 1  # Only 299 is inside the window
 
 
 ### Test log event ###
-def test_log_event_one_event():
+def test_log_event_one_event(clock):
     tracker = counttracker.CountTracker()
-    current_time = time.time()
+    current_time = clock.now
 
     tracker.log_event()
-    history = tracker._history
+    index = int(current_time) % 301
 
-    assert len(history) == 0  # Event not in history yet
-    assert int(tracker._last_time_logged) == int(current_time)
-    assert tracker._last_time_logged_count == 1
+    assert tracker._last_time_logged == int(current_time)
+    assert tracker._timestamps[index] == int(current_time)
+    assert tracker._counts[index] == 1
+    assert tracker._total == 1
 
 
-def test_log_event_previous_event_is_same_time():
+def test_log_event_previous_event_is_same_time(clock):
     tracker = counttracker.CountTracker()
-    current_time = time.time()
+    current_time = clock.now
 
     tracker.log_event()
     tracker.log_event()
-    history = tracker._history
+    index = int(current_time) % 301
 
-    assert len(history) == 0  # Events not in history yet
     assert tracker._last_time_logged == int(current_time)
-    assert tracker._last_time_logged_count == 2
+    assert tracker._counts[index] == 2
+    assert tracker._total == 2
 
 
-def test_log_event_previous_event_is_different_time():
+def test_log_event_previous_event_is_different_time(clock):
     tracker = counttracker.CountTracker()
-    current_time = time.time()
+    current_time = clock.now
+
+    _log_at(tracker, clock, current_time - 1, 1)
+    tracker.log_event()
+
+    previous_index = int(current_time - 1) % 301
+    assert tracker._counts[previous_index] == 1  # old second is untouched
+    assert tracker._cumulative[previous_index] == 1  # and closed off with the running total
+    assert tracker._counts[int(current_time) % 301] == 1
+
+
+def test_log_event_fills_skipped_seconds(clock):
+    tracker = counttracker.CountTracker()
+    current_time = clock.now
+
+    _log_at(tracker, clock, current_time - 5, 3)
+    tracker.log_event()
+
+    for timestamp in range(int(current_time) - 4, int(current_time)):
+        index = timestamp % 301
+        assert tracker._timestamps[index] == timestamp
+        assert tracker._counts[index] == 0
+        assert tracker._cumulative[index] == 3
+
+
+def test_log_event_reuses_stale_slot(clock):
+    tracker = counttracker.CountTracker()
+    current_time = clock.now
+
+    # Same slot as the current second, but a full buffer earlier
+    _log_at(tracker, clock, current_time - 301, 7)
+
+    tracker.log_event()
+    index = int(current_time) % 301
 
-    # previous_second = counttracker.EventSecond(current_time - 1)
-    # previous_second.count += 1
-    # tracker._history.append(previous_second)
-    tracker._last_time_logged = int(current_time-1)
-    tracker._last_time_logged_count = 1
+    assert tracker._timestamps[index] == int(current_time)
+    assert tracker._counts[index] == 1  # Stale count was reset, not added to
+
+
+def test_log_event_clock_goes_backwards(clock):
+    tracker = counttracker.CountTracker()
+    current_time = clock.now
 
     tracker.log_event()
-    history = tracker._history
+    _log_at(tracker, clock, current_time - 10, 1)  # Counted at the second it happened
+
+    assert tracker._last_time_logged == int(current_time)
+    assert tracker.get_event_counts(1) == 1
+    assert tracker.get_event_counts(11) == 2
+
+
+def test_log_event_before_first_event(clock):
+    tracker = counttracker.CountTracker()
+    current_time = clock.now
+
+    _log_at(tracker, clock, current_time - 5, 2)
+    _log_at(tracker, clock, current_time - 20, 3)
 
-    assert len(history) == 1  # Last event is not in history yet
-    assert history[0].timestamp == int(current_time - 1)
-    assert history[0].count == 1  # old event second has count 1
+    assert tracker.get_event_counts(5) == 0
+    assert tracker.get_event_counts(6) == 2
+    assert tracker.get_event_counts(20) == 2
+    assert tracker.get_event_counts(21) == 5
 
 
-def test_log_event_more_events_than_history_will_hold():
+def test_log_event_too_late_is_dropped(clock):
     tracker = counttracker.CountTracker()
-    tracker._MEMORY_TIME_LIMIT = 1
+    current_time = clock.now
 
     tracker.log_event()
-    time.sleep(1)
-    tracker.log_event()  # Should clear out first event
+    _log_at(tracker, clock, current_time - 300, 1)
+
+    assert tracker.get_event_counts(300) == 1
+    assert tracker._total == 1
+
 
-    history = tracker._history
+def test_log_event_memory_is_fixed(clock):
+    tracker = counttracker.CountTracker()
+    current_time = clock.now
+
+    for offset in range(1000, 0, -1):
+        _log_at(tracker, clock, current_time - offset, 1)
+    tracker.log_event()
 
-    assert len(history) == 1
+    assert len(tracker._counts) == 301
+    assert len(tracker._timestamps) == 301
+    assert len(tracker._cumulative) == 301
 
 
 ### Test get_event_counts ###
@@ -150,20 +241,13 @@ def test_get_event_counts_invalid_type():
         tracker.get_event_counts(1.5)  # Duration must be integer
 
 
-def test_get_event_counts_some():
-    current_time = time.time()
+def test_get_event_counts_some(clock):
+    current_time = clock.now
     tracker = counttracker.CountTracker()
 
-    es0 = counttracker.EventSecond(current_time - 20)
-    es0.count = 1
-    es1 = counttracker.EventSecond(current_time - 10)
-    es1.count = 2
-    es2 = counttracker.EventSecond(current_time - 5)
-    es2.count = 5
-
-    tracker._history.append(es0)
-    tracker._history.append(es1)
-    tracker._history.append(es2)
+    _log_at(tracker, clock, current_time - 20, 1)
+    _log_at(tracker, clock, current_time - 10, 2)
+    _log_at(tracker, clock, current_time - 5, 5)
 
     assert tracker.get_event_counts(30) == 8  # All events
     assert tracker.get_event_counts(15) == 7
@@ -173,35 +257,630 @@ def test_get_event_counts_some():
         tracker.get_event_counts(600)  # Treat 600 seconds as 5 minutes
 
 
-### Integration testing ###
-def test_get_event_counts_one_event_logged():
-    current_time = time.time()
+def test_get_event_counts_after_idle_period(clock):
+    current_time = clock.now
+    tracker = counttracker.CountTracker()
+
+    _log_at(tracker, clock, current_time - 20, 4)
+
+    # Nothing logged since, so the head of the buffer is 20 seconds behind the clock
+    assert tracker.get_event_counts(21) == 4
+    assert tracker.get_event_counts(20) == 0
+    clock.now += 290
+    assert tracker.get_event_counts(300) == 0
+
+
+def test_get_event_counts_every_duration(clock):
+    current_time = clock.now
+    tracker = counttracker.CountTracker()
+
+    for offset in range(299, -1, -1):
+        _log_at(tracker, clock, current_time - offset, offset + 1)
+
+    for duration in range(301):
+        expected = sum(range(1, duration + 1))
+        assert tracker.get_event_counts(duration) == expected
+
+
+def test_get_event_counts_does_not_modify(clock):
+    current_time = clock.now
+    tracker = counttracker.CountTracker()
+
+    _log_at(tracker, clock, current_time - 1, 3)
+    tracker.log_event()
+
+    # Repeated queries within one second must not inflate counts
+    for _ in range(5):
+        assert tracker.get_event_counts(2) == 4
+    assert tracker._total == 4
+
+
+def test_get_event_counts_many(clock):
+    tracker = counttracker.CountTracker()
+    current_time = clock.now
+    for offset in range(0, 300, 7):
+        _log_at(tracker, clock, current_time - offset, offset % 4)
+
+    durations = [1, 10, 60, 300, 0, 60]
+    assert tracker.get_event_counts_many(durations) == [tracker.get_event_counts(duration) for duration in durations]
+    assert tracker.get_event_counts_many(durations, now=current_time - 50) == \
+        [tracker.get_event_counts(duration, now=current_time - 50) for duration in durations]
+    assert tracker.get_event_counts_many([]) == []
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts_many([1, 301])
+
+
+def test_get_event_counts_sub_second_resolution(clock):
+    clock.now = float(int(clock.now)) + 0.55
+    current_time = clock.now
+    tracker = counttracker.CountTracker(window=10, resolution=0.1)
+
+    _log_at(tracker, clock, current_time - 0.5, 1)
+    _log_at(tracker, clock, current_time - 0.1, 2)
+    tracker.log_event()
+
+    assert tracker.get_event_counts(0.1) == 1
+    assert tracker.get_event_counts(0.2) == 3
+    assert tracker.get_event_counts(0.5) == 3
+    assert tracker.get_event_counts(0.6) == 4
+    assert tracker.get_event_counts(10) == 4
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts(0.15)  # Not a whole number of buckets
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts(11)
+
+
+def test_get_event_counts_minute_resolution(clock):
+    clock.now = float(int(clock.now) // 60 * 60 + 30)
+    current_time = clock.now
+    tracker = counttracker.CountTracker(window=24 * 60 * 60, resolution=60)
+
+    _log_at(tracker, clock, current_time - 60 * 60, 5)
+    _log_at(tracker, clock, current_time - 40, 2)  # Previous minute
+    tracker.log_event()
+
+    assert tracker.get_event_counts(60) == 1
+    assert tracker.get_event_counts(120) == 3
+    assert tracker.get_event_counts(60 * 60) == 3
+    assert tracker.get_event_counts(60 * 60 + 60) == 8
+    assert tracker.get_event_counts(24 * 60 * 60) == 8
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts(90)
+
+
+def test_log_events_at_sub_second_resolution(clock):
+    current_time = float(int(clock.now)) + 0.55
+    clock.now = current_time
+    tracker = counttracker.CountTracker(window=10, resolution=0.1)
+
+    tracker.log_events_at([current_time, current_time - 0.1, current_time - 0.12, current_time - 5])
+
+    assert tracker.get_event_counts(0.1) == 1
+    assert tracker.get_event_counts(0.3) == 3
+    assert tracker.get_event_counts(10) == 4
+
+
+### Test batch logging ###
+def test_log_events_current_second(clock):
+    tracker = counttracker.CountTracker()
+
+    tracker.log_events(5)
+    tracker.log_events(0)
+    tracker.log_event()
+
+    assert tracker.get_event_counts(1) == 6
+
+
+def test_log_events_at(clock):
+    current_time = clock.now
+    tracker = counttracker.CountTracker()
+
+    tracker.log_events(4, at=current_time - 10)
+    tracker.log_events(2, at=current_time)
+    tracker.log_events(3, at=current_time - 20)  # Late, but still inside the window
+
+    assert tracker.get_event_counts(1) == 2
+    assert tracker.get_event_counts(11) == 6
+    assert tracker.get_event_counts(21) == 9
+
+
+def test_log_events_invalid():
+    tracker = counttracker.CountTracker()
+
+    with pytest.raises(AssertionError):
+        tracker.log_events(-1)
+    with pytest.raises(AssertionError):
+        tracker.log_events(1.5)
+
+
+def test_log_events_at_matches_log_event(clock):
+    current_time = clock.now
+    timestamps = [current_time - (offset * 7919 % 250) - 0.5 for offset in range(2000)]
+
+    batched = counttracker.CountTracker()
+    batched.log_events_at(timestamps)
+
+    one_by_one = counttracker.CountTracker()
+    for timestamp in timestamps:
+        _log_at(one_by_one, clock, timestamp, 1)
+
+    for duration in range(301):
+        assert batched.get_event_counts(duration) == one_by_one.get_event_counts(duration)
+
+
+def test_log_events_at_array(clock):
+    current_time = clock.now
     tracker = counttracker.CountTracker()
 
+    tracker.log_events_at(array('d', [current_time, current_time - 3, current_time]))
+
+    assert tracker.get_event_counts(1) == 2
+    assert tracker.get_event_counts(4) == 3
+
+
+def test_log_events_at_numpy(clock):
+    numpy = pytest.importorskip('numpy')
+
+    current_time = clock.now
+    tracker = counttracker.CountTracker()
+
+    tracker.log_events_at(numpy.array([current_time, current_time - 3, current_time]))
+
+    assert tracker.get_event_counts(1) == 2
+    assert tracker.get_event_counts(4) == 3
+
+
+### Test clock and explicit times ###
+def test_injected_clock():
+    now = [1000.5]
+    tracker = counttracker.CountTracker(clock=lambda: now[0])
+
+    tracker.log_event()
+    now[0] += 10
+    tracker.log_event()
+
+    assert tracker.get_event_counts(10) == 1
+    assert tracker.get_event_counts(11) == 2
+
+
+def test_monotonic_ns_clock():
+    tracker = counttracker.CountTracker(clock=time.monotonic_ns, clock_rate=1e9)
+    now = time.monotonic_ns()
+
     tracker.log_event()
+    tracker.log_event(at=now - 5 * 10 ** 9)
 
     assert tracker.get_event_counts(1) == 1
+    assert tracker.get_event_counts(10) == 2
+    assert tracker.get_event_counts(10, now=now + 100 * 10 ** 9) == 0
 
-def test_log_for_longer_than_max_time():
-    max_time = 2  # 2 seconds
-    total_time_logged = 3  # 3 seconds
 
+def test_log_event_at_and_count_at():
+    tracker = counttracker.CountTracker(clock=lambda: 0.0)
+
+    tracker.log_event(at=1000.2)
+    tracker.log_event(at=1005.7)
+    tracker.log_events(3, at=1003)
+
+    assert tracker.get_event_counts(1, now=1005.9) == 1
+    assert tracker.get_event_counts(2, now=1005) == 1
+    assert tracker.get_event_counts(3, now=1005) == 4
+    assert tracker.get_event_counts(6, now=1005) == 5
+    assert tracker.get_event_counts(300, now=1304) == 1
+    assert tracker.get_event_counts(300, now=2000) == 0
+
+
+def test_get_event_counts_behind_the_head():
+    # Counting back from a time before the latest event, as when replaying with late events
+    tracker = counttracker.CountTracker(clock=lambda: 0.0)
+    tracker.log_event(at=990)
+    tracker.log_events(2, at=1000)
+    tracker.log_events(4, at=1010)
+
+    assert tracker.get_event_counts(5, now=995) == 0
+    assert tracker.get_event_counts(10, now=995) == 1
+    assert tracker.get_event_counts(20, now=1005) == 3
+    assert tracker.get_event_counts(0, now=1005) == 0
+    assert tracker.get_event_counts(5, now=10) == 0
+    assert tracker.get_event_counts_many([5, 10, 11, 300], now=1000) == [2, 2, 3, 3]
+    assert tracker.get_event_counts(300, now=1300) == 4
+    assert tracker.get_event_counts(300, now=709) == 0
+
+
+def test_max_lateness():
+    tracker = counttracker.CountTracker(clock=lambda: 0.0, max_lateness=10)
+
+    tracker.log_event(at=1000)
+    tracker.log_event(at=990)  # Exactly as late as allowed
+    tracker.log_event(at=989)
+    tracker.log_events(5, at=900)
+
+    assert tracker.get_event_counts(300, now=1000) == 2
+    assert tracker.dropped_events == 6
+
+
+def test_max_lateness_zero():
+    tracker = counttracker.CountTracker(clock=lambda: 0.0, max_lateness=0)
+
+    tracker.log_event(at=1000)
+    tracker.log_event(at=999.5)
+    tracker.log_event(at=1000.5)  # Same second
+
+    assert tracker.get_event_counts(300, now=1000) == 2
+    assert tracker.dropped_events == 1
+
+
+def test_replay_a_day():
+    day = 24 * 60 * 60
+    start = 1500000000
+    timestamps = array('d', (start + (i * 7919) % day + 0.25 for i in range(100000)))
+
+    tracker = counttracker.CountTracker(window=day, clock=lambda: 0.0)
+    tracker.log_events_at(timestamps)
+    end = start + day - 1
+
+    assert tracker.get_event_counts(day, now=end) == 100000
+    for duration in (1, 60, 3600, 12 * 3600):
+        expected = sum(1 for timestamp in timestamps if int(timestamp) > end - duration)
+        assert tracker.get_event_counts(duration, now=end) == expected
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_dump_and_load(tmp_path, use_mmap):
+    path = str(tmp_path / 'tracker.snapshot')
+    tracker = counttracker.CountTracker(window=10, resolution=0.5, clock=lambda: 0.0, max_lateness=2)
+    for offset in range(20):
+        tracker.log_events(offset, at=1000 + offset / 2)
+    tracker.log_event(at=900)
+    tracker.dump(path)
+
+    loaded = counttracker.CountTracker.load(path, clock=lambda: 1009.5, use_mmap=use_mmap)
+
+    assert loaded._MEMORY_TIME_LIMIT == 10
+    assert loaded._resolution == 0.5
+    assert loaded.dropped_events == 1
+    for duration in range(11):
+        assert loaded.get_event_counts(duration) == tracker.get_event_counts(duration, now=1009.5)
+
+    # The loaded tracker carries on logging, with the same lateness
+    loaded.log_events(5)
+    loaded.log_event(at=1008)
+    loaded.log_event(at=1007)
+    assert loaded.get_event_counts(1) == tracker.get_event_counts(1, now=1009.5) + 5
+    assert loaded.get_event_counts(10) == tracker.get_event_counts(10, now=1009.5) + 6
+    assert loaded.dropped_events == 2
+
+
+def test_load_drops_buckets_outside_window(tmp_path):
+    path = str(tmp_path / 'tracker.snapshot')
+    tracker = counttracker.CountTracker(clock=lambda: 1000)
+    tracker.log_events(3, at=990)
+    tracker.log_events(4, at=1000)
+    tracker.dump(path)
+
+    loaded = counttracker.CountTracker.load(path, clock=lambda: 1295)
+
+    assert loaded._last_time_logged == 1295
+    assert loaded.get_event_counts(300) == 4
+    assert list(loaded._counts).count(0) == len(loaded._counts) - 1
+
+    assert counttracker.CountTracker.load(path, clock=lambda: 2000).get_event_counts(300) == 0
+
+
+def test_dump_and_load_empty(tmp_path):
+    path = str(tmp_path / 'tracker.snapshot')
+    counttracker.CountTracker().dump(path)
+
+    loaded = counttracker.CountTracker.load(path)
+
+    assert loaded.get_event_counts(300) == 0
+    loaded.log_event()
+    assert loaded.get_event_counts(1) == 1
+
+
+def test_dump_replaces_snapshot(tmp_path):
+    path = tmp_path / 'tracker.snapshot'
     tracker = counttracker.CountTracker()
-    start = time.time()
+    tracker.log_event()
+    tracker.dump(str(path))
+    tracker.log_event()
+    tracker.dump(str(path))
 
-    # Modify time limit for testing
-    tracker._MEMORY_TIME_LIMIT = max_time
+    assert counttracker.CountTracker.load(str(path)).get_event_counts(300) == 2
+    assert [entry.name for entry in tmp_path.iterdir()] == ['tracker.snapshot']
 
-    # Log 3 events for 3 seconds, 1 event per second
-    total_events_logged = 0
-    while time.time() - start < total_time_logged:
-        tracker.log_event()
-        total_events_logged += 1
-        time.sleep(1)
 
-    total_events_retained = tracker.get_event_counts(max_time)
+def test_load_invalid(tmp_path):
+    path = tmp_path / 'tracker.snapshot'
+    path.write_bytes(b'not a snapshot' * 10)
+    with pytest.raises(AssertionError):
+        counttracker.CountTracker.load(str(path))
+
+    counttracker.CountTracker().dump(str(path))
+    path.write_bytes(path.read_bytes()[:-8])
+    with pytest.raises(AssertionError):
+        counttracker.CountTracker.load(str(path))
+
+
+def _tracker_with_events(times, window=300, resolution=1):
+    tracker = counttracker.CountTracker(window=window, resolution=resolution, clock=lambda: 0.0)
+    for timestamp in times:
+        tracker.log_event(at=timestamp)
+    return tracker
+
+
+def _all_counts(tracker, now):
+    return [tracker.get_event_counts(duration, now=now) for duration in range(301)]
+
+
+def test_merge():
+    first = _tracker_with_events([1000, 1000, 1001, 1100])
+    second = _tracker_with_events([990, 1001, 1050, 1150, 1150])
+    expected = _tracker_with_events(sorted([1000, 1000, 1001, 1100, 990, 1001, 1050, 1150, 1150]))
+
+    first.merge(second)
+
+    assert _all_counts(first, 1150) == _all_counts(expected, 1150)
+    assert _all_counts(first, 1300) == _all_counts(expected, 1300)
+
+
+def test_merge_drops_buckets_outside_window():
+    first = _tracker_with_events([1000, 1400])
+    second = _tracker_with_events([1050, 1200])
+
+    first.merge(second)
+
+    assert first.get_event_counts(300, now=1400) == 2
+    assert first._bucket_counts() == {1200: 1, 1400: 1}
+
+
+def test_merge_incompatible():
+    first = counttracker.CountTracker()
+
+    with pytest.raises(AssertionError):
+        first.merge(counttracker.CountTracker(resolution=0.5))
+    with pytest.raises(AssertionError):
+        first.merge(counttracker.CountTracker(window=60))
+    with pytest.raises(AssertionError):
+        counttracker.CountTracker.merged([first, counttracker.CountTracker(clock_rate=1000)])
+    with pytest.raises(AssertionError):
+        counttracker.CountTracker.merged([])
+
+
+def test_merged_is_associative():
+    trackers = [_tracker_with_events(range(1000 + node, 1200, 7 + node)) for node in range(5)]
+
+    merged = counttracker.CountTracker.merged(trackers)
+    pairs = counttracker.CountTracker.merged([counttracker.CountTracker.merged(trackers[:2]),
+                                              counttracker.CountTracker.merged(trackers[2:])])
+    one_by_one = counttracker.CountTracker(clock=lambda: 0.0)
+    for tracker in reversed(trackers):
+        one_by_one.merge(tracker)
 
-    assert total_events_retained < total_events_logged  # Some events should be 'forgotten' from history
+    assert _all_counts(merged, 1200) == _all_counts(pairs, 1200) == _all_counts(one_by_one, 1200)
+    assert merged.get_event_counts(300, now=1200) == sum(tracker.get_event_counts(300, now=1200)
+                                                        for tracker in trackers)
+
+
+def test_export_and_apply_delta():
+    source = _tracker_with_events([1000, 1000, 1001])
+    replica = counttracker.CountTracker(clock=lambda: 0.0)
+
+    first = source.export_delta()
+    replica.apply_delta(first)
+    assert _all_counts(replica, 1001) == _all_counts(source, 1001)
+
+    # Only the changed buckets are exported next time
+    source.log_event(at=1001)
+    source.log_event(at=1050)
+    source.log_event(at=995)
+    second = source.export_delta()
+    assert len(second) == len(first) + 16
+    replica.apply_delta(second)
+    assert _all_counts(replica, 1050) == _all_counts(source, 1050)
+
+    # Applying deltas again, or out of order, changes nothing
+    replica.apply_delta(first)
+    replica.apply_delta(second)
+    assert _all_counts(replica, 1050) == _all_counts(source, 1050)
+
+    assert len(source.export_delta()) == len(first) - 2 * 16
+
+
+def test_export_delta_after_load_with_mmap(tmp_path):
+    path = str(tmp_path / 'tracker.snapshot')
+    _tracker_with_events([1000, 1000, 1001]).dump(path)
+    source = counttracker.CountTracker.load(path, clock=lambda: 1001, use_mmap=True)
+    replica = counttracker.CountTracker(clock=lambda: 0.0)
+
+    replica.apply_delta(source.export_delta())
+    source.log_event(at=1002)
+    replica.apply_delta(source.export_delta())
+
+    assert _all_counts(replica, 1002) == _all_counts(source, 1002)
+    assert replica.get_event_counts(300, now=1002) == 4
+
+
+def test_apply_delta_invalid():
+    delta = counttracker.CountTracker(window=60).export_delta()
+
+    with pytest.raises(AssertionError):
+        counttracker.CountTracker().apply_delta(delta)
+    with pytest.raises(AssertionError):
+        counttracker.CountTracker(window=60).apply_delta(b'CTXX' + delta[4:])
+
+
+def _node(node, connection):
+    """Stands in for a node: logs events and sends a delta to the aggregator after each batch"""
+    tracker = counttracker.CountTracker(clock=lambda: 0.0)
+    for batch in range(3):
+        for offset in range(100):
+            tracker.log_events(node + 1, at=1000 + batch * 100 + offset)
+        connection.send_bytes(tracker.export_delta())
+    connection.close()
+
+
+def test_aggregate_deltas_from_processes():
+    import multiprocessing
+    context = multiprocessing.get_context()
+    replicas = []
+    for node in range(4):
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_node, args=(node, sender))
+        process.start()
+        sender.close()
+        replica = counttracker.CountTracker(clock=lambda: 0.0)
+        for _ in range(3):
+            replica.apply_delta(receiver.recv_bytes())
+        process.join()
+        replicas.append(replica)
+
+    merged = counttracker.CountTracker.merged(replicas)
+
+    assert merged.get_event_counts(300, now=1299) == 300 * (1 + 2 + 3 + 4)
+    assert merged.get_event_counts(100, now=1299) == 100 * (1 + 2 + 3 + 4)
+
+
+def _expected_stats(per_second, quantiles):
+    ordered = sorted(per_second)
+    return (sum(per_second), sum(per_second) / len(per_second), max(per_second),
+            {q: ordered[max(math.ceil(q * len(ordered)) - 1, 0)] for q in quantiles})
+
+
+def test_stats():
+    tracker = counttracker.CountTracker(clock=lambda: 0.0)
+    for offset in range(10):
+        tracker.log_events(offset + 1, at=1000 + offset)
+
+    stats = tracker.stats(10, now=1010)
+
+    assert stats.count == 55
+    assert stats.rate == 5.5
+    assert stats.peak == 10
+    assert stats.quantiles == {0.5: 5, 0.95: 10, 0.99: 10}
+    # The bucket still filling up is left out
+    assert tracker.stats(5, quantiles=[0, 1], now=1009) == (35, 7, 9, {0: 5, 1: 9})
+
+
+def test_stats_kept_up_to_date():
+    import random
+    rng = random.Random(7)
+    tracker = counttracker.CountTracker(clock=lambda: 0.0)
+    per_second = {}
+    now = 1000
+    for step in range(2000):
+        # Mostly one second at a time, with some idle gaps and some long ones
+        now += rng.choice([1, 1, 1, 2, 5]) if step % 500 else 400
+        count = rng.randrange(50)
+        tracker.log_events(count, at=now)
+        per_second[now] = count
+        if step % 3 == 0:
+            for duration in (1, 7, 60, 300):
+                counts = [per_second.get(second, 0) for second in range(now - duration, now)]
+                assert tracker.stats(duration, now=now) == _expected_stats(counts, (0.5, 0.95, 0.99))
+
+    assert set(tracker._stats) == {1, 7, 60, 300}
+
+
+def test_stats_late_events_and_past():
+    tracker = counttracker.CountTracker(clock=lambda: 0.0)
+    for offset in range(10):
+        tracker.log_events(2, at=1000 + offset)
+    assert tracker.stats(10, now=1010).peak == 2
+
+    tracker.log_events(5, at=1005)
+
+    assert tracker.stats(10, now=1010) == (25, 2.5, 7, {0.5: 2, 0.95: 7, 0.99: 7})
+    # Statistics that end before the head are not kept
+    assert tracker.stats(3, now=1006) == (11, 11 / 3, 7, {0.5: 2, 0.95: 7, 0.99: 7})
+    assert 3 not in tracker._stats
+
+
+def test_stats_does_not_modify():
+    tracker = counttracker.CountTracker(clock=lambda: 0.0)
+    tracker.log_events(4, at=1000)
+    tracker.log_events(2, at=1001)
+
+    assert tracker.stats(5, now=1001).count == 4
+    # The buckets from the head on count as empty, and the head stays where it is
+    assert tracker.stats(5, now=1003) == (6, 1.2, 4, {0.5: 0, 0.95: 4, 0.99: 4})
+    assert tracker._last_time_logged == 1001
+    assert tracker.get_event_counts(1, now=1001) == 2
+    assert set(tracker._stats) == {5}
+
+
+def test_stats_while_logging():
+    # One thread logs one event into every bucket while others ask for the statistics of the last 10 buckets
+    tracker = counttracker.CountTracker(window=100000)
+    events = 20000
+    errors = []
+    done = threading.Event()
+
+    def query():
+        while not done.is_set():
+            head = tracker._last_time_logged
+            if head is not None and head >= 10:
+                stats = tracker.stats(10, now=head)
+                if stats != (10, 1, 1, {0.5: 1, 0.95: 1, 0.99: 1}):
+                    errors.append((head, stats))
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    readers = [threading.Thread(target=query) for _ in range(3)]
+    try:
+        for reader in readers:
+            reader.start()
+        for at in range(events):
+            tracker.log_event(at)
+    finally:
+        done.set()
+        for reader in readers:
+            reader.join()
+        sys.setswitchinterval(switch_interval)
+
+    assert errors == []
+    assert tracker._version % 2 == 0
+    assert tracker.stats(10, now=events - 1).count == 10
+
+
+def test_stats_resolution():
+    tracker = counttracker.CountTracker(window=60, resolution=0.5, clock=lambda: 0.0)
+    tracker.log_events(3, at=1000)
+    tracker.log_events(1, at=1000.5)
+
+    assert tracker.stats(1, now=1001) == (4, 4, 6, {0.5: 2, 0.95: 6, 0.99: 6})
+
+
+def test_stats_empty_and_invalid():
+    tracker = counttracker.CountTracker()
+
+    assert tracker.stats(300) == (0, 0, 0, {0.5: 0, 0.95: 0, 0.99: 0})
+    with pytest.raises(AssertionError):
+        tracker.stats(0)
+    with pytest.raises(AssertionError):
+        tracker.stats(301)
+    with pytest.raises(AssertionError):
+        tracker.stats(60, quantiles=[1.5])
+
+
+### Integration testing ###
+def test_get_event_counts_one_event_logged():
+    tracker = counttracker.CountTracker()
+
+    tracker.log_event()
+
+    assert tracker.get_event_counts(1) == 1
+
+def test_log_for_longer_than_max_time(clock):
+    current_time = clock.now
+    tracker = counttracker.CountTracker()
+
+    # One event per second for longer than the tracker remembers
+    for offset in range(400, 0, -1):
+        _log_at(tracker, clock, current_time - offset, 1)
+    tracker.log_event()
+
+    assert tracker.get_event_counts(300) == 300  # Some events should be 'forgotten' from history
 
 
 ### Test load ###
@@ -220,4 +899,152 @@ def test_two_million_events():
     total_time = end - start
 
     assert tracker.get_event_counts(4) == 2000000
-    assert total_time <= 2
\ No newline at end of file
+    assert total_time <= 2
+
+
+def test_queries_are_consistent_while_logging():
+    # One thread logs into a new bucket every event while others query: no query may see the head half moved
+    tracker = counttracker.CountTracker(window=100000)
+    events = 50000
+    logged = [0]
+    errors = []
+    done = threading.Event()
+
+    def query():
+        last_count = 0
+        while not done.is_set():
+            count = tracker.get_event_counts(100000, now=events)
+            if not last_count <= count <= logged[0]:
+                errors.append((last_count, count, logged[0]))
+            last_count = count
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    readers = [threading.Thread(target=query) for _ in range(3)]
+    try:
+        for reader in readers:
+            reader.start()
+        for at in range(events):
+            tracker.log_event(at)
+            logged[0] += 1
+    finally:
+        done.set()
+        for reader in readers:
+            reader.join()
+        sys.setswitchinterval(switch_interval)
+
+    assert errors == []
+    assert tracker.get_event_counts(100000, now=events) == events
+
+
+
+def test_overflowing_write_leaves_queries_working():
+    # A write that would overflow the running total fails before the version is made odd
+    tracker = counttracker.CountTracker(clock=lambda: 1001)
+    tracker.log_events(2 ** 62, at=1000)
+    tracker.log_events(2 ** 62, at=1001)
+
+    with pytest.raises(OverflowError):
+        tracker.log_event(at=1002)
+    with pytest.raises(OverflowError):
+        tracker.log_event(at=1000)
+    other = counttracker.CountTracker()
+    other.log_event(at=999)
+    with pytest.raises(OverflowError):
+        tracker.merge(other)
+
+    assert tracker._version % 2 == 0
+    assert tracker.get_event_counts(300) == 2 ** 63
+    assert tracker.get_event_counts_many([1, 300]) == [2 ** 62, 2 ** 63]
+    assert tracker.timeline(2)[1].tolist() == [2 ** 62, 2 ** 62]
+
+def test_timeline():
+    tracker = counttracker.CountTracker(clock=lambda: 1000)
+    tracker.log_event(at=990)
+    tracker.log_events(3, at=995)
+    tracker.log_event()
+
+    start, counts = tracker.timeline(15)
+
+    assert start == 986
+    assert counts.format == 'q' and counts.contiguous
+    assert counts.tolist() == [0, 0, 0, 0, 1, 0, 0, 0, 0, 3, 0, 0, 0, 0, 1]
+    assert tracker.timeline(300, now=1010)[1].tolist() == [0] * 275 + counts.tolist() + [0] * 10
+    assert counttracker.CountTracker().timeline(60)[1].tolist() == [0] * 60
+
+
+def test_timeline_resolution_and_clock_rate():
+    tracker = counttracker.CountTracker(window=10, resolution=0.5, clock=lambda: 1000 * 10**9, clock_rate=10**9)
+    tracker.log_events(2, at=int(999.7 * 10**9))
+    tracker.log_event()
+
+    start, counts = tracker.timeline(2)
+
+    assert start == 998.5 * 10**9
+    assert counts.tolist() == [0, 0, 2, 1]
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_timeline_matches_buckets(tmp_path, use_mmap):
+    # Wraps around the ring buffer several times, with late events and gaps longer than the window
+    rng = random.Random(3)
+    tracker = counttracker.CountTracker(window=30, clock=lambda: 0)
+    at = 1000
+    for _ in range(500):
+        at += rng.choice([0, 0, 1, 1, 2, 5, 40])
+        tracker.log_events(rng.randrange(1, 4), at=at - rng.choice([0, 0, 0, 3]))
+    path = str(tmp_path / 'tracker.snapshot')
+    tracker.dump(path)
+    loaded = counttracker.CountTracker.load(path, clock=lambda: at, use_mmap=use_mmap)
+
+    for now in range(at - 40, at + 5):
+        start, counts = loaded.timeline(30, now=now)
+        assert counts.tolist() == [loaded._bucket_count_at(bucket) if bucket <= loaded._last_time_logged else 0
+                                   for bucket in range(start, now + 1)]
+        assert sum(counts) == loaded.get_event_counts(30, now=now)
+
+
+def test_timelines():
+    clock = lambda: 1000
+    first = counttracker.CountTracker(clock=clock)
+    second = counttracker.CountTracker(clock=clock)
+    first.log_events(2, at=998)
+    second.log_event()
+
+    start, counts = counttracker.CountTracker.timelines([first, second, counttracker.CountTracker()], 4)
+
+    assert start == 997
+    assert counts.shape == (3, 4)
+    assert counts.tolist() == [[0, 2, 0, 0], [0, 0, 0, 1], [0, 0, 0, 0]]
+
+
+def test_timelines_of_no_duration():
+    trackers = [counttracker.CountTracker(clock=lambda: 1000), counttracker.CountTracker()]
+    trackers[0].log_event()
+
+    start, counts = counttracker.CountTracker.timelines(trackers, 0)
+
+    assert start == 1001
+    assert counts.tolist() == []
+    assert trackers[0].timeline(0)[1].tolist() == []
+
+
+def test_timelines_incompatible():
+    with pytest.raises(AssertionError):
+        counttracker.CountTracker.timelines([], 10)
+    with pytest.raises(AssertionError):
+        counttracker.CountTracker.timelines([counttracker.CountTracker(), counttracker.CountTracker(resolution=2)], 10)
+
+
+def test_timeline_numpy_without_copy():
+    numpy = pytest.importorskip('numpy')
+    tracker = counttracker.CountTracker(clock=lambda: 1000)
+    tracker.log_events(5)
+
+    _, counts = tracker.timeline(10)
+    values = numpy.asarray(counts)
+    assert values.dtype == numpy.int64 and values.tolist() == [0] * 9 + [5]
+    assert numpy.shares_memory(values, numpy.asarray(counts))
+
+    _, stacked = counttracker.CountTracker.timelines([tracker, tracker], 10)
+    assert numpy.asarray(stacked).shape == (2, 10)
@@ -0,0 +1,200 @@
+import asyncio
+import pytest
+
+from .context import FakeClock, counttracker
+
+
+def test_init_invalid():
+    with pytest.raises(AssertionError):
+        counttracker.CounterDaemon(window=0)
+    with pytest.raises(AssertionError):
+        counttracker.CounterDaemon(max_names=0)
+
+
+def test_incr_and_query():
+    clock = FakeClock(1000)
+    daemon = counttracker.CounterDaemon(clock=clock)
+
+    assert daemon.incr('a')
+    assert daemon.incr('a', 4)
+    clock.now = 1010
+    assert daemon.incr('b', 2)
+
+    assert daemon.query('a', 1) == 0
+    assert daemon.query('a', 11) == 5
+    assert daemon.query('b', 300) == 2
+    assert daemon.query('c', 300) == 0
+    with pytest.raises(AssertionError):
+        daemon.query('c', 301)
+
+
+def test_max_names():
+    clock = FakeClock(1000)
+    daemon = counttracker.CounterDaemon(max_names=2, clock=clock)
+
+    assert daemon.incr('a')
+    assert daemon.incr('b')
+    assert not daemon.incr('c')
+    assert daemon.query('c', 300) == 0
+
+    # Once a name has no events in the window, it makes room for a new one
+    clock.now = 1300
+    assert daemon.incr('b')
+    assert daemon.incr('c')
+    assert daemon.query('a', 300) == 0
+    assert daemon.query('c', 300) == 1
+
+
+def test_max_names_looks_through_names_once_per_bucket():
+    clock = FakeClock(1000)
+    daemon = counttracker.CounterDaemon(max_names=2, clock=clock)
+    daemon.incr('a')
+    daemon.incr('b')
+    looks = []
+    get_event_counts = daemon._trackers['a'].get_event_counts
+    daemon._trackers['a'].get_event_counts = lambda duration: looks.append(duration) or get_event_counts(duration)
+
+    for name in range(100):
+        assert not daemon.incr(str(name))
+    assert len(looks) == 1
+
+    clock.now = 1001
+    assert not daemon.incr('c')
+    assert len(looks) == 2
+
+
+def test_execute():
+    daemon = counttracker.CounterDaemon(clock=FakeClock(1000))
+
+    replies = daemon.execute('incr a\nincr a 3\n\nquery a 60\nquery b 60\nquery a 301\nincr a -1\n'
+                             'incr a x\nfoo\nquery a\n')
+
+    assert replies.split('\n') == ['OK', 'OK', '4', '0', 'ERR Duration must be less than or equal to 300 seconds',
+                                   'ERR Number of events must be a nonnegative integer',
+                                   "ERR invalid literal for int() with base 10: 'x'",
+                                   'ERR unknown command', 'ERR unknown command', '']
+
+
+
+def test_execute_huge_counts():
+    clock = FakeClock(1000)
+    daemon = counttracker.CounterDaemon(clock=clock)
+    largest = daemon._MAX_COUNT
+
+    assert daemon.execute('incr a 99999999999999999999\nincr a 1e300\n').split('\n') == [
+        'ERR Number of events must be at most {}'.format(largest), "ERR invalid literal for int() with base 10: '1e300'", '']
+
+    # Counts that fit, until the running total would overflow 64 bits
+    replies = []
+    for offset in range(4):
+        clock.now = 1000 + offset
+        replies.append(daemon.execute('incr a {}\n'.format(largest)))
+    assert replies == ['OK\n', 'OK\n', 'OK\n', 'ERR Running total of events would overflow 64 bits\n']
+    assert daemon.execute('query a 300\nquery a 2\n') == '{}\n{}\n'.format(3 * largest, largest)
+
+def test_statsd():
+    daemon = counttracker.CounterDaemon(clock=FakeClock(1000))
+
+    daemon.statsd('a:1|c\na:2|c|@0.5\nb:3|c\nc:5|ms\nd:1|g\nbroken\na:x|c\na:1|c|@0\n:1|c')
+
+    assert daemon.query('a', 300) == 5
+    assert daemon.query('b', 300) == 3
+    assert daemon.query('c', 300) == 0
+    assert daemon.query('d', 300) == 0
+
+
+def test_statsd_huge_counts():
+    clock = FakeClock(1000)
+    daemon = counttracker.CounterDaemon(clock=clock)
+
+    daemon.statsd('a:1e300|c\na:inf|c\na:nan|c\na:-inf|c\na:1|c|@1e-300\na:2|c')
+    assert daemon.query('a', 300) == 2
+
+    for offset in range(4):
+        clock.now = 1000 + offset
+        daemon.statsd('b:{}|c'.format(2 ** 61))
+        daemon.statsd('b:{}|c'.format(2 ** 61))
+    # Once the running total no longer fits in 64 bits, counts of later seconds are dropped
+    assert daemon.query('b', 300) == 2 ** 63
+
+
+def test_serve():
+    async def run():
+        daemon = counttracker.CounterDaemon(clock=FakeClock(1000))
+        await daemon.start(port=0, udp_port=0)
+        (host, port), (udp_host, udp_port) = daemon.addresses
+        try:
+            # Pipelined batch, split across writes in the middle of a line
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(b'incr a 2\nincr b\nque')
+            await writer.drain()
+            writer.write(b'ry a 60\nincr a\nquery a 60\n')
+            replies = [await reader.readline() for _ in range(5)]
+            assert replies == [b'OK\n', b'OK\n', b'2\n', b'OK\n', b'3\n']
+            writer.close()
+
+            # StatsD over UDP
+            loop = asyncio.get_running_loop()
+            transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol,
+                                                               remote_addr=(udp_host, udp_port))
+            transport.sendto(b'b:5|c\nc:1|c')
+            transport.close()
+            for _ in range(100):
+                if daemon.query('c', 60):
+                    break
+                await asyncio.sleep(0.01)
+
+            # HTTP, two requests on one connection
+            reader, writer = await asyncio.open_connection(host, port)
+            body = b'query b 60\nquery c 60\n'
+            writer.write(b'POST /batch HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body))
+            writer.write(b'GET /batch HTTP/1.1\r\nConnection: close\r\n\r\n')
+            response = await reader.read()
+            writer.close()
+            assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+            assert b'\r\n\r\n6\n1\nHTTP/1.1 405 Method Not Allowed\r\n' in response
+        finally:
+            await daemon.close()
+
+    asyncio.run(run())
+
+
+def test_serve_limits(monkeypatch):
+    monkeypatch.setattr(counttracker.daemon._BatchProtocol, '_MAX_LINE_SIZE', 100)
+    monkeypatch.setattr(counttracker.daemon._BatchProtocol, '_MAX_BODY_SIZE', 1000)
+
+    async def run():
+        daemon = counttracker.CounterDaemon(clock=FakeClock(1000))
+        await daemon.start(port=0, udp_port=None)
+        host, port = daemon.addresses[0]
+        try:
+            # A line that never ends
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(b'incr a\nincr ' + b'a' * 200)
+            assert await reader.read() == b'OK\nERR line too long\n'
+            writer.close()
+
+            # An HTTP body bigger than the limit is refused before it is received
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(b'POST /batch HTTP/1.1\r\nContent-Length: 1000000000\r\n\r\nincr a\n')
+            response = await reader.read()
+            writer.close()
+            assert response.startswith(b'HTTP/1.1 413 Payload Too Large\r\n')
+
+            # A request head that never ends
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(b'POST /batch HTTP/1.1\r\nX-Padding: ' + b'a' * 200)
+            response = await reader.read()
+            writer.close()
+            assert response.startswith(b'HTTP/1.1 431 Request Header Fields Too Large\r\n')
+
+            assert daemon.query('a', 60) == 1
+        finally:
+            await daemon.close()
+
+    asyncio.run(run())
+
+
+def test_main_invalid(capsys):
+    with pytest.raises(SystemExit):
+        counttracker.daemon.main(['--port', 'x'])
@@ -0,0 +1,86 @@
+import math
+import pytest
+
+from .context import FakeClock, counttracker
+
+
+def test_init_invalid():
+    with pytest.raises(AssertionError):
+        counttracker.DecayingCountTracker(horizons=())
+    with pytest.raises(AssertionError):
+        counttracker.DecayingCountTracker(horizons=(60, 0))
+    with pytest.raises(AssertionError):
+        counttracker.DecayingCountTracker(resolution=0)
+
+
+def test_no_events():
+    tracker = counttracker.DecayingCountTracker()
+
+    assert tracker.rates() == {60: 0, 300: 0, 900: 0}
+    assert tracker.rate(60) == 0
+
+
+def test_rate_decays():
+    clock = FakeClock()
+    tracker = counttracker.DecayingCountTracker(clock=clock)
+    tracker.log_event()
+
+    assert tracker.rate(60) == pytest.approx(1 / 60)
+    clock.now = 1060
+    assert tracker.rate(60) == pytest.approx(math.exp(-1) / 60)
+    assert tracker.rate(300) == pytest.approx(math.exp(-0.2) / 300)
+    assert tracker.rate(900, now=1900) == pytest.approx(math.exp(-1) / 900)
+
+
+def test_rate_invalid_horizon():
+    tracker = counttracker.DecayingCountTracker()
+
+    with pytest.raises(AssertionError):
+        tracker.rate(120)
+
+
+def test_steady_rate_converges():
+    clock = FakeClock()
+    tracker = counttracker.DecayingCountTracker(horizons=(1, 5, 15), resolution=0.01, clock=clock)
+    for event in range(100 * 60):
+        clock.now = 1000 + event / 100
+        tracker.log_event()
+
+    rates = tracker.rates()
+    assert rates[1] == pytest.approx(100, rel=0.01)
+    assert rates[5] == pytest.approx(100, rel=0.01)
+    # Still warming up: 1 - e^-4 of the way there
+    assert rates[15] == pytest.approx(100 * (1 - math.exp(-4)), rel=0.01)
+
+
+def test_log_events_and_late_events():
+    in_order = counttracker.DecayingCountTracker(clock=FakeClock())
+    for at in (1000, 1000, 1000, 1030, 1045):
+        in_order.log_event(at)
+    out_of_order = counttracker.DecayingCountTracker(clock=FakeClock())
+    out_of_order.log_events(1, at=1045)
+    out_of_order.log_events(2, at=1000)
+    out_of_order.log_event(at=1030)
+    out_of_order.log_events(0, at=900)
+    out_of_order.log_event(at=1000)
+
+    for horizon, rate in in_order.rates(now=1100).items():
+        assert out_of_order.rate(horizon, now=1100) == pytest.approx(rate)
+
+
+def test_queries_do_not_modify():
+    clock = FakeClock()
+    tracker = counttracker.DecayingCountTracker(clock=clock)
+    tracker.log_events(5)
+    clock.now = 1100
+
+    before = tracker.rates()
+    tracker.rates(now=2000)
+    assert tracker.rates() == before
+
+
+def test_clock_rate():
+    tracker = counttracker.DecayingCountTracker(horizons=(10,), clock=lambda: 1000 * 10**9, clock_rate=10**9)
+    tracker.log_event()
+
+    assert tracker.rate(10, now=1010 * 10**9) == pytest.approx(math.exp(-1) / 10)
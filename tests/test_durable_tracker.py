@@ -0,0 +1,216 @@
+import os
+import stat
+import time
+import pytest
+
+from .context import FakeClock, counttracker
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / 'tracker.log'), str(tmp_path / 'tracker.snapshot')
+
+
+def _counts(tracker, now):
+    return [tracker.get_event_counts(duration, now=now) for duration in range(0, 301, 10)]
+
+
+def _log_some(tracker, clock, start, seconds):
+    """Log a few events per second, some of them late, as single events and in batches"""
+    for offset in range(seconds):
+        clock.now = start + offset
+        for _ in range(offset % 3):
+            tracker.log_event()
+        tracker.log_events(offset % 5)
+        if offset % 7 == 0:
+            tracker.log_event(at=clock.now - 3)
+
+
+def test_open_new(paths):
+    log_path, _ = paths
+    tracker = counttracker.DurableCountTracker.open(log_path)
+
+    assert os.path.exists(log_path)
+    assert tracker.get_event_counts(300) == 0
+    tracker.close()
+
+
+def test_recover_from_log(paths):
+    log_path, _ = paths
+    clock = FakeClock(1000)
+    tracker = counttracker.DurableCountTracker.open(log_path, clock=clock, sync_interval=0)
+    _log_some(tracker, clock, 1000, 100)
+    tracker.close()
+
+    recovered = counttracker.DurableCountTracker.open(log_path, clock=clock)
+
+    assert _counts(recovered, 1099) == _counts(tracker, 1099)
+    assert recovered.get_event_counts(300, now=1099) > 0
+
+
+def test_log_is_coalesced_per_bucket(paths):
+    log_path, _ = paths
+    clock = FakeClock(1000)
+    tracker = counttracker.DurableCountTracker.open(log_path, clock=clock, sync_interval=3600)
+    for offset in range(10):
+        clock.now = 1000 + offset
+        for _ in range(1000):
+            tracker.log_event()
+    tracker.close()
+
+    # Header, then a single batch with one record per second
+    assert os.path.getsize(log_path) == 8 + 24 + 10 * 16
+    assert counttracker.DurableCountTracker.open(log_path, clock=clock).get_event_counts(10) == 10000
+
+
+def test_uncommitted_events_are_lost(paths):
+    log_path, _ = paths
+    clock = FakeClock(1000)
+    tracker = counttracker.DurableCountTracker.open(log_path, clock=clock, sync_interval=3600)
+    tracker.log_events(5)
+    tracker.commit()
+    clock.now = 1001
+    tracker.log_events(2)
+    tracker.log_event()
+    # Crash: the tracker is never closed
+
+    assert counttracker.DurableCountTracker.open(log_path, clock=clock).get_event_counts(300) == 5
+
+
+def test_idle_events_are_committed(paths):
+    log_path, _ = paths
+    clock = FakeClock(1000)
+    tracker = counttracker.DurableCountTracker.open(log_path, clock=clock, sync_interval=0)
+    for _ in range(100):
+        tracker.log_event()
+    # No more events, so no bucket change: the background thread commits them
+    clock.now = 1005
+    for _ in range(500):
+        if os.path.getsize(log_path) > 8:
+            break
+        time.sleep(0.01)
+
+    # Crash: the tracker is never closed
+    assert counttracker.DurableCountTracker.open(log_path, clock=clock).get_event_counts(300) == 100
+    tracker.close()
+
+
+def test_checkpoint_syncs_snapshot_before_emptying_log(paths, monkeypatch):
+    log_path, snapshot_path = paths
+    clock = FakeClock(1000)
+    tracker = counttracker.DurableCountTracker.open(log_path, snapshot_path, clock=clock, sync_interval=3600)
+    tracker.log_events(5)
+    tracker.commit()
+    log_size = os.path.getsize(log_path)
+    syncs = []
+    fsync = os.fsync
+
+    def recording_fsync(fd):
+        syncs.append((stat.S_ISDIR(os.fstat(fd).st_mode), os.path.getsize(log_path)))
+        fsync(fd)
+
+    monkeypatch.setattr(os, 'fsync', recording_fsync)
+    tracker.checkpoint()
+    tracker.close()
+
+    # The snapshot file, then its directory, are synced while the log still holds every event
+    assert syncs[-3:] == [(False, log_size), (True, log_size), (False, 8)]
+
+
+
+def test_recover_merged_counts(paths):
+    log_path, _ = paths
+    clock = FakeClock(1000)
+    tracker = counttracker.DurableCountTracker.open(log_path, clock=clock, sync_interval=3600)
+    tracker.log_events(3)
+    tracker.log_event()
+    other = counttracker.CountTracker(clock=clock)
+    other.log_events(2, at=986)
+    other.log_events(5, at=600)
+    tracker.merge(other)
+    replica = counttracker.CountTracker(clock=clock)
+    replica.log_events(4, at=995)
+    tracker.apply_delta(replica.export_delta())
+    tracker.log_event()
+    tracker.close()
+
+    recovered = counttracker.DurableCountTracker.open(log_path, clock=clock)
+    assert _counts(recovered, 1000) == _counts(tracker, 1000)
+    assert [recovered.get_event_counts(duration) for duration in (1, 10, 20)] == [5, 9, 11]
+
+def test_recover_ignores_torn_batch(paths):
+    log_path, _ = paths
+    clock = FakeClock(1000)
+    tracker = counttracker.DurableCountTracker.open(log_path, clock=clock)
+    tracker.log_events(5)
+    tracker.commit()
+    tracker.log_events(3)
+    tracker.close()
+    with open(log_path, 'r+b') as log:
+        log.truncate(os.path.getsize(log_path) - 4)
+
+    recovered = counttracker.DurableCountTracker.open(log_path, clock=clock)
+    assert recovered.get_event_counts(300) == 5
+
+    # The torn batch is cut off, so new batches are readable
+    recovered.log_events(2)
+    recovered.close()
+    assert counttracker.DurableCountTracker.open(log_path, clock=clock).get_event_counts(300) == 7
+
+
+def test_recover_from_snapshot_and_log(paths):
+    log_path, snapshot_path = paths
+    clock = FakeClock(1000)
+    tracker = counttracker.DurableCountTracker.open(log_path, snapshot_path, clock=clock, sync_interval=0)
+    _log_some(tracker, clock, 1000, 50)
+    tracker.checkpoint()
+    log_size = os.path.getsize(log_path)
+    _log_some(tracker, clock, 1050, 50)
+    tracker.close()
+
+    assert log_size == 8
+    recovered = counttracker.DurableCountTracker.open(log_path, snapshot_path, clock=clock)
+    assert _counts(recovered, 1099) == _counts(tracker, 1099)
+
+
+def test_snapshot_events_are_not_replayed_twice(paths):
+    log_path, snapshot_path = paths
+    clock = FakeClock(1000)
+    tracker = counttracker.DurableCountTracker.open(log_path, snapshot_path, clock=clock)
+    tracker.log_events(5)
+    tracker.commit()
+    tracker.log_event()
+    tracker.log_event()
+    # A snapshot taken without truncating the log holds events that are in the log too
+    counttracker.CountTracker.dump(tracker, snapshot_path)
+    tracker.log_event()
+    tracker.close()
+
+    recovered = counttracker.DurableCountTracker.open(log_path, snapshot_path, clock=clock)
+    assert recovered.get_event_counts(300) == 8
+
+
+def test_recover_drops_expired_events(paths):
+    log_path, _ = paths
+    clock = FakeClock(1000)
+    tracker = counttracker.DurableCountTracker.open(log_path, clock=clock, max_lateness=2)
+    tracker.log_events(5)
+    clock.now = 1100
+    tracker.log_events(3)
+    tracker.close()
+
+    clock.now = 1350
+    recovered = counttracker.DurableCountTracker.open(log_path, clock=clock, max_lateness=2)
+    assert recovered.get_event_counts(300) == 3
+    assert recovered.dropped_events == 0
+
+
+def test_open_invalid(paths):
+    log_path, _ = paths
+    with open(log_path, 'wb') as log:
+        log.write(b'not a log')
+
+    with pytest.raises(AssertionError):
+        counttracker.DurableCountTracker.open(log_path)
+    with pytest.raises(AssertionError):
+        counttracker.DurableCountTracker.open(log_path + '.new', sync_interval=-1)
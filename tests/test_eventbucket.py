@@ -0,0 +1,63 @@
+import time
+import pytest
+
+from .context import counttracker
+
+
+def test_init():
+    timestamp = time.time()
+    eb = counttracker.EventBucket(timestamp, 60)
+
+    assert eb is not None
+    assert eb.index == int(timestamp) // 60
+    assert eb.timestamp == int(timestamp) // 60 * 60
+    assert eb.count == 0
+
+
+def test_init_sub_second():
+    eb = counttracker.EventBucket(1000.35, 0.1)
+
+    assert eb.index == 10003
+    assert eb.timestamp == pytest.approx(1000.3)
+
+
+def test_init_fail():
+    with pytest.raises(AssertionError):
+        counttracker.EventBucket("Fail")
+    with pytest.raises(AssertionError):
+        counttracker.EventBucket(1)
+    with pytest.raises(AssertionError):
+        counttracker.EventBucket(1.0, 0)
+
+
+def test_log_event():
+    eb = counttracker.EventBucket(time.time(), 10)
+
+    eb.log_event()
+    eb.log_event()
+    assert eb.count == 2
+
+
+def test_compare():
+    timestamp = float(int(time.time()) // 60 * 60)
+    eb0 = counttracker.EventBucket(timestamp, 60)
+    eb1 = counttracker.EventBucket(timestamp + 59, 60)  # Same bucket
+    eb2 = counttracker.EventBucket(timestamp + 60, 60)
+
+    assert eb0 == eb1
+    assert eb0 != eb2
+    assert eb0 < eb2
+    assert eb0 <= eb1
+    assert eb2 > eb1
+    assert eb2 >= eb0
+    assert not (eb0 == 0)
+
+
+def test_event_second_is_one_second_bucket():
+    timestamp = time.time()
+    es = counttracker.EventSecond(timestamp)
+
+    assert isinstance(es, counttracker.EventBucket)
+    assert es.resolution == 1
+    assert es.timestamp == int(timestamp)
+    assert es == counttracker.EventBucket(timestamp, 1)
@@ -0,0 +1,135 @@
+import urllib.request
+import pytest
+
+from .context import FakeClock, counttracker
+
+
+def test_render():
+    clock = FakeClock()
+    login = counttracker.CountTracker(clock=clock)
+    logout = counttracker.CountTracker(clock=clock)
+    login.log_events(3)
+    clock.now = 1020
+    login.log_events(2)
+    logout.log_event()
+
+    exporter = counttracker.MetricsExporter(durations=(10, 60))
+    exporter.register('http_requests', login, labels={'endpoint': '/login'}, help_text='HTTP requests')
+    exporter.register('http_requests', logout, labels={'endpoint': '/logout'})
+
+    assert exporter.render() == (
+        '# TYPE http_requests gauge\n'
+        '# HELP http_requests HTTP requests\n'
+        'http_requests{endpoint="/login",duration="10"} 2\n'
+        'http_requests{endpoint="/login",duration="60"} 5\n'
+        'http_requests{endpoint="/logout",duration="10"} 1\n'
+        'http_requests{endpoint="/logout",duration="60"} 1\n'
+        '# EOF\n')
+
+
+def test_render_escapes_labels():
+    exporter = counttracker.MetricsExporter(durations=(1,))
+    exporter.register('events', counttracker.CountTracker(clock=FakeClock()), labels={'path': 'a"b\\c\nd'})
+
+    assert 'events{path="a\\"b\\\\c\\nd",duration="1"} 0\n' in exporter.render()
+
+
+def test_register_invalid():
+    exporter = counttracker.MetricsExporter()
+    tracker = counttracker.CountTracker()
+
+    with pytest.raises(AssertionError):
+        exporter.register('http-requests', tracker)
+    with pytest.raises(AssertionError):
+        exporter.register('events', tracker, labels={'duration': '1'})
+    with pytest.raises(AssertionError):
+        exporter.register('events', tracker, durations=(1000,))
+    exporter.register('events', tracker)
+    with pytest.raises(AssertionError):
+        exporter.register('events', tracker)
+
+
+def test_unregister():
+    exporter = counttracker.MetricsExporter(durations=(1,))
+    exporter.register('a', counttracker.CountTracker(), labels={'shard': 1})
+    exporter.register('a', counttracker.CountTracker(), labels={'shard': 2})
+    exporter.render()
+
+    exporter.unregister('a', labels={'shard': 1})
+    assert 'shard="1"' not in exporter.render()
+    exporter.unregister('a', labels={'shard': 2})
+    assert exporter.render() == '# EOF\n'
+
+
+def test_render_follows_the_trackers():
+    clock = FakeClock()
+    tracker = counttracker.CountTracker(clock=clock)
+    exporter = counttracker.MetricsExporter(durations=(10,))
+    exporter.register('events', tracker)
+
+    assert 'events{duration="10"} 0' in exporter.render()
+    tracker.log_events(4)
+    assert 'events{duration="10"} 4' in exporter.render()
+    clock.now = 1005
+    assert 'events{duration="10"} 4' in exporter.render()
+    clock.now = 1011
+    assert 'events{duration="10"} 0' in exporter.render()
+
+
+def test_idle_trackers_are_not_counted_again():
+    clock = FakeClock()
+    idle = counttracker.CountTracker(clock=clock)
+    busy = counttracker.CountTracker(clock=clock)
+    idle.log_event()
+    calls = []
+    get_event_counts_many = idle.get_event_counts_many
+    idle.get_event_counts_many = lambda *args: calls.append(args) or get_event_counts_many(*args)
+
+    exporter = counttracker.MetricsExporter(durations=(10,))
+    exporter.register('idle', idle)
+    exporter.register('busy', busy)
+    exporter.render()
+    busy.log_event()
+    exporter.render()
+    assert calls == [((10,), 1000)]
+
+    # Counts change as the window slides, until they are all zero
+    clock.now = 1020
+    assert 'idle{duration="10"} 0' in exporter.render()
+    clock.now = 1040
+    exporter.render()
+    assert len(calls) == 2
+
+
+def test_other_trackers():
+    clock = FakeClock()
+    concurrent = counttracker.ConcurrentCountTracker(clock=clock)
+    tiered = counttracker.TieredCountTracker(clock=clock)
+    concurrent.log_events(2)
+    tiered.log_events(3)
+
+    exporter = counttracker.MetricsExporter(durations=(60,))
+    exporter.register('concurrent', concurrent)
+    exporter.register('tiered', tiered)
+
+    assert 'concurrent{duration="60"} 2\n' in exporter.render()
+    assert 'tiered{duration="60"} 3\n' in exporter.render()
+
+
+def test_serve():
+    tracker = counttracker.CountTracker()
+    tracker.log_events(7)
+    exporter = counttracker.MetricsExporter(durations=(60,))
+    exporter.register('events', tracker)
+
+    exporter.start(port=0)
+    try:
+        host, port = exporter.address
+        with urllib.request.urlopen('http://{}:{}/metrics'.format(host, port)) as response:
+            assert response.headers['Content-Type'].startswith('application/openmetrics-text')
+            assert response.read().decode() == '# TYPE events gauge\nevents{duration="60"} 7\n# EOF\n'
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen('http://{}:{}/other'.format(host, port))
+    finally:
+        exporter.stop()
+    assert exporter.address is None
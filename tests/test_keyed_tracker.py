@@ -0,0 +1,185 @@
+import time
+import pytest
+
+from .context import counttracker, patch_time
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    return patch_time(monkeypatch, [counttracker.keyed_tracker], time.time())
+
+
+def test_init():
+    tracker = counttracker.KeyedCountTracker()
+
+    assert tracker is not None
+    assert len(tracker) == 0
+    assert tracker.get_event_counts('a', 300) == 0
+    assert tracker.top_k(300, 5) == []
+
+
+def test_init_invalid():
+    with pytest.raises(AssertionError):
+        counttracker.KeyedCountTracker(max_keys=0)
+
+
+def test_get_event_counts_invalid():
+    tracker = counttracker.KeyedCountTracker()
+
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts('a', -1)
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts('a', 1.5)
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts('a', 301)
+    with pytest.raises(AssertionError):
+        tracker.top_k(10, 0)
+
+
+def test_log_event(clock):
+    tracker = counttracker.KeyedCountTracker()
+
+    tracker.log_event('a')
+    tracker.log_event('a')
+    tracker.log_event('b')
+
+    assert tracker.get_event_counts('a', 1) == 2
+    assert tracker.get_event_counts('b', 1) == 1
+    assert tracker.get_event_counts('c', 1) == 0
+    assert len(tracker) == 2
+
+
+def test_get_event_counts_some(clock):
+    current_time = clock.now
+    tracker = counttracker.KeyedCountTracker()
+
+    tracker.log_events('a', 1, at=current_time - 20)
+    tracker.log_events('a', 2, at=current_time - 10)
+    tracker.log_events('b', 4, at=current_time - 10)
+    tracker.log_events('a', 5, at=current_time - 5)
+
+    assert tracker.get_event_counts('a', 30) == 8
+    assert tracker.get_event_counts('a', 15) == 7
+    assert tracker.get_event_counts('a', 7) == 5
+    assert tracker.get_event_counts('a', 5) == 0  # Don't include the timestamp 5 seconds away
+    assert tracker.get_event_counts('b', 300) == 4
+
+
+def test_get_event_counts_every_duration(clock):
+    current_time = clock.now
+    tracker = counttracker.KeyedCountTracker()
+
+    for offset in range(349, -1, -1):
+        tracker.log_events('a', offset + 1, at=current_time - offset)
+        tracker.log_events('b', 1, at=current_time - offset)
+
+    for duration in range(301):
+        assert tracker.get_event_counts('a', duration) == sum(range(1, duration + 1))
+        assert tracker.get_event_counts('b', duration) == duration
+
+
+def test_late_events(clock):
+    current_time = clock.now
+    tracker = counttracker.KeyedCountTracker()
+
+    tracker.log_event('a')
+    tracker.log_events('a', 2, at=current_time - 100)
+    tracker.log_events('a', 4, at=current_time - 300)  # Too old, dropped
+
+    assert tracker.get_event_counts('a', 1) == 1
+    assert tracker.get_event_counts('a', 300) == 3
+
+
+def test_idle_keys_are_forgotten(clock):
+    tracker = counttracker.KeyedCountTracker()
+
+    for key in range(1000):
+        tracker.log_event(key)
+    clock.now += 100
+    tracker.log_event('recent')
+
+    assert len(tracker) == 1001
+    assert tracker.get_event_counts(5, 300) == 1
+
+    clock.now += 250
+    assert tracker.get_event_counts(5, 300) == 0
+    assert len(tracker) == 1  # Only 'recent' still has events in the window
+
+
+def test_max_keys_evicts_least_recently_logged(clock):
+    tracker = counttracker.KeyedCountTracker(max_keys=2)
+
+    tracker.log_event('a')
+    tracker.log_event('b')
+    tracker.log_event('a')
+    tracker.log_event('c')  # 'b' is the least recently logged
+
+    assert len(tracker) == 2
+    assert tracker.get_event_counts('a', 10) == 2
+    assert tracker.get_event_counts('b', 10) == 0
+    assert tracker.get_event_counts('c', 10) == 1
+
+
+def test_injected_clock():
+    now = [1000.0]
+    tracker = counttracker.KeyedCountTracker(clock=lambda: now[0])
+
+    tracker.log_event('a')
+    tracker.log_event('a', at=990)
+    now[0] += 5
+
+    assert tracker.get_event_counts('a', 5) == 0
+    assert tracker.get_event_counts('a', 6) == 1
+    assert tracker.get_event_counts('a', 16, now=1000) == 2
+    assert tracker.top_k(300, 1, now=1000) == [('a', 2)]
+
+
+def test_top_k(clock):
+    current_time = clock.now
+    tracker = counttracker.KeyedCountTracker()
+
+    tracker.log_events('old', 100, at=current_time - 200)
+    tracker.log_events('a', 3)
+    tracker.log_events('b', 5)
+    tracker.log_events('c', 1)
+
+    assert tracker.top_k(300, 2) == [('old', 100), ('b', 5)]
+    assert tracker.top_k(10, 2) == [('b', 5), ('a', 3)]
+    assert tracker.top_k(10, 10) == [('b', 5), ('a', 3), ('c', 1)]
+
+
+def _log_keys(tracker, clock):
+    current_time = clock.now
+    for offset in range(0, 300, 3):
+        for key in 'abcde'[:offset % 6]:
+            tracker.log_events(key, offset % 7 + 1, at=current_time - offset)
+
+
+def test_get_event_counts_many(clock, monkeypatch):
+    monkeypatch.setattr(counttracker.keyed_tracker, 'numpy', None)
+    tracker = counttracker.KeyedCountTracker()
+    _log_keys(tracker, clock)
+
+    keys = ['a', 'c', 'e', 'missing', 'a']
+    durations = [1, 10, 60, 300, 0]
+    assert tracker.get_event_counts_many(keys, durations) == \
+        [[tracker.get_event_counts(key, duration) for duration in durations] for key in keys]
+    assert tracker.get_event_counts_many(keys, durations, now=clock.now - 50) == \
+        [[tracker.get_event_counts(key, duration, now=clock.now - 50) for duration in durations] for key in keys]
+    assert tracker.get_event_counts_many([], durations) == []
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts_many(keys, [301])
+
+
+def test_get_event_counts_many_numpy(clock):
+    numpy = pytest.importorskip('numpy')
+    tracker = counttracker.KeyedCountTracker()
+    _log_keys(tracker, clock)
+
+    keys = ['a', 'b', 'missing']
+    durations = [1, 60, 300]
+    matrix = tracker.get_event_counts_many(keys, durations)
+
+    assert isinstance(matrix, numpy.ndarray)
+    assert matrix.shape == (3, 3)
+    assert matrix.tolist() == [[tracker.get_event_counts(key, duration) for duration in durations] for key in keys]
@@ -0,0 +1,112 @@
+import threading
+import pytest
+
+from .context import counttracker
+
+
+def test_init_invalid():
+    with pytest.raises(AssertionError):
+        counttracker.RateLimiter(-1, 60)
+    with pytest.raises(AssertionError):
+        counttracker.RateLimiter(10, 0)
+    with pytest.raises(AssertionError):
+        counttracker.RateLimiter(10, 60, buckets=0)
+
+
+def test_try_acquire_limit():
+    limiter = counttracker.RateLimiter(3, 10, clock=lambda: 1000)
+
+    assert limiter.try_acquire()
+    assert limiter.try_acquire(n=2)
+    assert not limiter.try_acquire()
+    assert limiter.try_acquire(n=0)
+    assert limiter.get_count() == 3
+
+
+def test_try_acquire_too_many_at_once():
+    limiter = counttracker.RateLimiter(3, 10, clock=lambda: 1000)
+
+    assert not limiter.try_acquire(n=4)
+    assert limiter.get_count() == 0
+    assert len(limiter) == 0
+    assert limiter.try_acquire(n=3)
+
+
+def test_try_acquire_invalid():
+    limiter = counttracker.RateLimiter(3, 10)
+
+    with pytest.raises(AssertionError):
+        limiter.try_acquire(n=-1)
+    with pytest.raises(AssertionError):
+        limiter.try_acquire(n=1.5)
+
+
+def test_try_acquire_keys():
+    limiter = counttracker.RateLimiter(2, 10, clock=lambda: 1000)
+
+    assert limiter.try_acquire('a', 2)
+    assert not limiter.try_acquire('a')
+    assert limiter.try_acquire('b')
+    assert limiter.try_acquire()
+    assert len(limiter) == 3
+
+
+def test_try_acquire_window_slides_without_interpolation():
+    limiter = counttracker.RateLimiter(10, 10, interpolate=False)
+
+    assert limiter.try_acquire(n=10, now=1000.5)
+    assert not limiter.try_acquire(now=1009.9)
+    # Whole buckets leave the window: the bucket of 1000 is out from 1010
+    assert limiter.try_acquire(n=10, now=1010)
+
+
+def test_try_acquire_window_slides_with_interpolation():
+    limiter = counttracker.RateLimiter(10, 10)
+
+    assert limiter.try_acquire(n=10, now=1000.5)
+    assert not limiter.try_acquire(now=1010)
+    # 3/4 of the bucket of 1000 is still in the window
+    assert limiter.get_count(now=1010.25) == 7.5
+    assert limiter.try_acquire(n=2, now=1010.25)
+    assert not limiter.try_acquire(n=1, now=1010.25)
+    assert limiter.get_count(now=1011) == 2
+    assert limiter.try_acquire(n=8, now=1011)
+
+
+def test_interpolation_is_closer_to_sliding_window():
+    # A burst at the end of a bucket; an exact sliding window admits nothing more until 1001.9
+    admitted = {}
+    for interpolate in (False, True):
+        limiter = counttracker.RateLimiter(100, 1, buckets=2, interpolate=interpolate)
+        assert limiter.try_acquire(n=100, now=1000.9)
+        admitted[interpolate] = sum(limiter.try_acquire(now=1001.6) for _ in range(100))
+
+    assert admitted == {False: 100, True: 20}
+
+
+def test_sweep_forgets_idle_keys():
+    clock = [1000]
+    limiter = counttracker.RateLimiter(1, 10, clock=lambda: clock[0])
+    for key in range(1024):
+        limiter.try_acquire(key)
+
+    clock[0] = 1011
+    limiter.try_acquire('new')
+
+    assert len(limiter) == 1
+
+
+def test_try_acquire_is_atomic():
+    limiter = counttracker.RateLimiter(1000, 60)
+    admitted = []
+
+    def acquire():
+        admitted.append(sum(limiter.try_acquire() for _ in range(500)))
+
+    threads = [threading.Thread(target=acquire) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(admitted) == 1000
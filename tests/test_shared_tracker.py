@@ -0,0 +1,215 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import pytest
+
+from .context import counttracker
+
+
+fork = pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(),
+                          reason="Needs the fork start method")
+
+
+@pytest.fixture
+def tracker():
+    tracker = counttracker.SharedCountTracker(max_processes=8)
+    yield tracker
+    tracker.close()
+    tracker.unlink()
+
+
+def _log(tracker, count):
+    for _ in range(count):
+        tracker.log_event()
+    tracker.log_events(5)
+
+
+def _run_processes(target, args, count):
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=target, args=args) for _ in range(count)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+
+def test_init(tracker):
+    assert tracker.name
+    assert tracker.get_event_counts(300) == 0
+
+
+def test_init_invalid():
+    with pytest.raises(AssertionError):
+        counttracker.SharedCountTracker(max_processes=0)
+
+
+def test_get_event_counts_invalid(tracker):
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts(-1)
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts(1.5)
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts(301)
+
+
+def test_single_process(tracker):
+    current_time = time.time()
+
+    tracker.log_event()
+    tracker.log_events(3, at=current_time - 100)
+
+    assert tracker.get_event_counts(10) == 1
+    assert tracker.get_event_counts(300) == 4
+
+
+def test_injected_clock():
+    now = [1000.0]
+    tracker = counttracker.SharedCountTracker(max_processes=2, clock=lambda: now[0])
+    try:
+        tracker.log_event()
+        tracker.log_event(at=995)
+        now[0] += 10
+
+        assert tracker.get_event_counts(10) == 0
+        assert tracker.get_event_counts(16) == 2
+        assert tracker.get_event_counts(1, now=1000) == 1
+    finally:
+        tracker.close()
+        tracker.unlink()
+
+
+def test_get_event_counts_many(tracker):
+    current_time = time.time()
+
+    tracker.log_event()
+    tracker.log_events(3, at=current_time - 100)
+
+    assert tracker.get_event_counts_many([10, 300]) == [1, 4]
+    with pytest.raises(AssertionError):
+        tracker.get_event_counts_many([301])
+
+
+def test_attach(tracker):
+    tracker.log_events(2)
+
+    other = counttracker.SharedCountTracker.attach(tracker.name)
+    other.log_events(3)  # Same process, so same row
+
+    assert other.get_event_counts(10) == 5
+    assert tracker.get_event_counts(10) == 5
+    other.close()
+
+
+def test_attach_not_a_tracker():
+    from multiprocessing import shared_memory
+
+    block = shared_memory.SharedMemory(create=True, size=64)
+    try:
+        with pytest.raises(AssertionError):
+            counttracker.SharedCountTracker.attach(block.name)
+    finally:
+        block.close()
+        block.unlink()
+
+
+def test_attach_from_separate_processes(tracker):
+    # Processes not started by multiprocessing have their own resource tracker, which must leave the block alone
+    script = 'import counttracker; counttracker.SharedCountTracker.attach({!r}).log_events(2)'.format(tracker.name)
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    for _ in range(2):
+        subprocess.run([sys.executable, '-c', script], cwd=root, check=True)
+
+    assert tracker.get_event_counts(10) == 4
+
+
+def test_window_and_resolution():
+    tracker = counttracker.SharedCountTracker(max_processes=2, window=3600, resolution=0.5)
+    try:
+        tracker.log_events(4)
+        other = counttracker.SharedCountTracker.attach(tracker.name)
+
+        assert other._MEMORY_TIME_LIMIT == 3600
+        assert other._resolution == 0.5
+        assert other.get_event_counts(3600) == 4
+        with pytest.raises(AssertionError):
+            other.get_event_counts(0.25)
+        other.close()
+    finally:
+        tracker.close()
+        tracker.unlink()
+
+
+@fork
+def test_many_processes_exact_totals(tracker):
+    _run_processes(_log, (tracker, 10000), 6)
+
+    assert tracker.get_event_counts(300) == 6 * 10005
+
+
+@fork
+def test_rows_of_exited_processes_are_reused(tracker):
+    for _ in range(3):
+        _run_processes(_log, (tracker, 10), 8)
+
+    # Every row was reused, and the events of exited processes still count
+    assert tracker.get_event_counts(300) == 3 * 8 * 15
+
+
+def _die_while_writing(tracker):
+    tracker.log_events(3)
+    tracker.log_event(at=time.time() - 10)
+    # As if the process died in the middle of moving the head: the version is left odd, and the head is
+    #   closed off with its running total but not moved yet
+    row = tracker._row
+    row._version += 1
+    row._cumulative[row._last_index_logged] = row._total
+    os._exit(0)
+
+
+@fork
+def test_queries_recover_rows_of_processes_that_died_while_writing(tracker):
+    _run_processes(_die_while_writing, (tracker,), 1)
+
+    assert tracker.get_event_counts_many([1, 300]) == [3, 4]
+    assert all(row._version % 2 == 0 for row in tracker._rows)
+
+
+@fork
+def test_claiming_recovers_rows_of_processes_that_died_while_writing():
+    tracker = counttracker.SharedCountTracker(max_processes=1)
+    try:
+        _run_processes(_die_while_writing, (tracker,), 1)
+
+        tracker.log_event()
+
+        assert tracker._row._version % 2 == 0
+        assert tracker.get_event_counts(300) == 5
+    finally:
+        tracker.close()
+        tracker.unlink()
+
+
+@fork
+def test_too_many_processes(tracker):
+    context = multiprocessing.get_context('fork')
+    release = context.Event()
+
+    def log_and_wait(tracker):
+        tracker.log_event()
+        release.wait()
+
+    processes = [context.Process(target=log_and_wait, args=(tracker,)) for _ in range(8)]
+    for process in processes:
+        process.start()
+    while tracker.get_event_counts(300) < 8:
+        time.sleep(0.01)
+
+    with pytest.raises(RuntimeError):
+        tracker.log_event()
+
+    release.set()
+    for process in processes:
+        process.join()
@@ -0,0 +1,151 @@
+import time
+import pytest
+
+from .context import counttracker, patch_time
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Start on a group boundary so group rounding is predictable
+    return patch_time(monkeypatch, [counttracker.sketch_tracker], float(int(time.time()) // 10 * 10 + 9))
+
+
+def test_init():
+    tracker = counttracker.SketchCountTracker(epsilon=0.01, delta=0.01)
+
+    assert tracker._width == 272
+    assert tracker._depth == 5
+    assert len(tracker._sketches) == 31
+    assert tracker.estimate('a', 300) == 0
+
+
+def test_init_invalid():
+    with pytest.raises(AssertionError):
+        counttracker.SketchCountTracker(epsilon=0)
+    with pytest.raises(AssertionError):
+        counttracker.SketchCountTracker(delta=1)
+    with pytest.raises(AssertionError):
+        counttracker.SketchCountTracker(group_size=7)
+    with pytest.raises(AssertionError):
+        counttracker.SketchCountTracker(heavy_fraction=0)
+    with pytest.raises(AssertionError):
+        counttracker.SketchCountTracker(max_candidates=0)
+
+
+def test_estimate_invalid():
+    tracker = counttracker.SketchCountTracker()
+
+    with pytest.raises(AssertionError):
+        tracker.estimate('a', -1)
+    with pytest.raises(AssertionError):
+        tracker.estimate('a', 1.5)
+    with pytest.raises(AssertionError):
+        tracker.estimate('a', 301)
+
+
+def test_estimate_exact_without_collisions(clock):
+    tracker = counttracker.SketchCountTracker()
+
+    tracker.log_event('a')
+    tracker.log_event('a')
+    tracker.log_events('b', 3)
+
+    assert tracker.estimate('a', 10) == 2
+    assert tracker.estimate('b', 300) == 3
+    assert tracker.estimate('a', 0) == 0
+
+
+def test_estimate_counts_whole_groups(clock):
+    current_time = clock.now
+    tracker = counttracker.SketchCountTracker()
+
+    tracker.log_events('a', 1, at=current_time - 9)   # Same group as now
+    tracker.log_events('a', 2, at=current_time - 15)  # Previous group
+    tracker.log_events('a', 4, at=current_time - 100)
+
+    assert tracker.estimate('a', 1) == 1
+    assert tracker.estimate('a', 11) == 3  # Whole previous group is included
+    assert tracker.estimate('a', 100) == 3
+    assert tracker.estimate('a', 101) == 7
+
+
+def test_old_groups_expire(clock):
+    tracker = counttracker.SketchCountTracker()
+
+    tracker.log_events('a', 5)
+    clock.now += 200
+    tracker.log_event('a')
+
+    assert tracker.estimate('a', 300) == 6
+
+    clock.now += 200
+    assert tracker.estimate('a', 300) == 1
+    assert sum(tracker._window) == tracker._depth  # Only the last event is left in the window sketch
+
+
+def test_estimate_within_error_bound(clock):
+    tracker = counttracker.SketchCountTracker(epsilon=0.05, delta=0.01)
+    true_counts = {}
+
+    for key in range(2000):
+        count = 1 + key % 7
+        tracker.log_events(key, count)
+        true_counts[key] = count
+
+    bound = tracker.error_bound(300)
+    assert bound == 0.05 * sum(true_counts.values())
+    for key, count in true_counts.items():
+        estimate = tracker.estimate(key, 300)
+        assert count <= estimate <= count + bound
+
+
+def test_injected_clock():
+    now = [1009.0]
+    tracker = counttracker.SketchCountTracker(clock=lambda: now[0])
+
+    tracker.log_event('a')
+    tracker.log_event('a', at=995)
+    now[0] += 10
+
+    assert tracker.estimate('a', 10) == 0
+    assert tracker.estimate('a', 11) == 1
+    assert tracker.estimate('a', 20, now=1009) == 2
+    assert tracker.heavy_hitters(300, 2, now=1009) == [('a', 2)]
+
+
+def test_heavy_hitters(clock):
+    tracker = counttracker.SketchCountTracker(heavy_fraction=0.01, max_candidates=10)
+
+    for key in range(1000):
+        tracker.log_event(key)
+    tracker.log_events('hot', 500)
+    tracker.log_events('warm', 200)
+    for key in range(1000, 2000):
+        tracker.log_event(key)
+
+    hitters = tracker.heavy_hitters(300, 100)
+
+    assert [key for key, _ in hitters] == ['hot', 'warm']
+    assert hitters[0][1] >= 500
+    assert hitters[1][1] >= 200
+
+
+def test_heavy_hitter_candidates_are_pruned(clock):
+    tracker = counttracker.SketchCountTracker(heavy_fraction=0.1, max_candidates=2)
+
+    for key in range(10):
+        tracker.log_event(key)  # Each is a large share of a small window when logged
+    tracker.log_events('hot', 100)
+
+    assert len(tracker._candidates) <= 4
+    assert 'hot' in tracker._candidates
+    assert tracker.heavy_hitters(300, 50) == [('hot', 100)]
+
+
+def test_heavy_hitters_expire(clock):
+    tracker = counttracker.SketchCountTracker()
+
+    tracker.log_events('hot', 500)
+    clock.now += 400
+
+    assert tracker.heavy_hitters(300, 1) == []
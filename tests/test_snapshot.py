@@ -0,0 +1,52 @@
+import time
+
+from .context import counttracker
+
+
+def test_periodic_snapshot(tmp_path):
+    path = str(tmp_path / 'tracker.snapshot')
+    tracker = counttracker.CountTracker()
+    tracker.log_events(5)
+
+    with counttracker.PeriodicSnapshot(tracker, path, interval=0.01):
+        for _ in range(100):
+            if (tmp_path / 'tracker.snapshot').exists():
+                break
+            time.sleep(0.01)
+        assert counttracker.CountTracker.load(path).get_event_counts(300) == 5
+        tracker.log_events(2)
+
+    # A last snapshot is taken on stop
+    assert counttracker.CountTracker.load(path).get_event_counts(300) == 7
+
+
+def test_periodic_snapshot_stop_without_start(tmp_path):
+    path = tmp_path / 'tracker.snapshot'
+    snapshot = counttracker.PeriodicSnapshot(counttracker.CountTracker(), str(path))
+
+    snapshot.stop()
+
+    assert not path.exists()
+
+
+def test_periodic_snapshot_keeps_going_after_a_failure(tmp_path, caplog):
+    path = str(tmp_path / 'tracker.snapshot')
+    tracker = counttracker.CountTracker()
+    tracker.log_events(5)
+    dump = tracker.dump
+    failures = [OSError("No space left on device")]
+
+    def failing_dump(path):
+        if failures:
+            raise failures.pop()
+        dump(path)
+
+    tracker.dump = failing_dump
+    with counttracker.PeriodicSnapshot(tracker, path, interval=0.01):
+        for _ in range(100):
+            if (tmp_path / 'tracker.snapshot').exists():
+                break
+            time.sleep(0.01)
+        assert counttracker.CountTracker.load(path).get_event_counts(300) == 5
+
+    assert "Snapshot to {} failed".format(path) in caplog.text
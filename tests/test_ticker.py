@@ -0,0 +1,139 @@
+import gc
+import time
+import pytest
+
+from .context import FakeClock, counttracker
+
+
+def test_tick_publishes_buckets():
+    clock = FakeClock(1000.25)
+    ticker = counttracker.Ticker(clock)
+    seconds = ticker.subscribe(1)
+    tenths = ticker.subscribe(10)
+
+    assert (seconds.bucket, tenths.bucket) == (1000, 10002)
+    assert ticker.subscribe(1) is seconds
+
+    clock.now = 1001.5
+    assert seconds.bucket == 1000
+    assert ticker.tick() == pytest.approx(0.1)
+    assert (seconds.bucket, tenths.bucket) == (1001, 10015)
+
+
+def test_tick_waits_at_most_max_wait():
+    ticker = counttracker.Ticker(FakeClock(1000), max_wait=1)
+    ticker.subscribe(1 / 60)
+
+    assert ticker.tick() == 1
+
+
+def test_unsubscribe():
+    clock = FakeClock(1000.25)
+    ticker = counttracker.Ticker(clock)
+    ticker.subscribe(1)
+    tenths = ticker.subscribe(10)
+    ticker.subscribe(10)
+
+    ticker.unsubscribe(10)
+    assert ticker.tick() == pytest.approx(0.05)
+    ticker.unsubscribe(10)
+    clock.now = 1000.5
+    assert ticker.tick() == pytest.approx(0.5)
+    assert tenths.bucket == 10002
+
+
+def test_tracker_unsubscribes_when_gone():
+    ticker = counttracker.Ticker(FakeClock(1000))
+    seconds = counttracker.CountTracker(coarse_clock=ticker)
+    tenths = counttracker.CountTracker(window=10, resolution=0.1, coarse_clock=ticker)
+    assert len(ticker._ticks) == 2
+
+    del tenths
+    gc.collect()
+    assert list(ticker._ticks) == [seconds._scale]
+
+
+def test_coarse_clock_logs_into_published_bucket():
+    clock = FakeClock(1000)
+    ticker = counttracker.Ticker(clock)
+    tracker = counttracker.CountTracker(coarse_clock=ticker)
+
+    tracker.log_event()
+    clock.now = 1001
+    # Not published yet: still counted in the bucket before
+    tracker.log_event()
+    ticker.tick()
+    tracker.log_event()
+    tracker.log_event(at=1005)
+
+    assert tracker._bucket_counts() == {1000: 2, 1001: 1, 1005: 1}
+    assert tracker.get_event_counts(300, now=1005) == 4
+
+
+def test_coarse_clock_concurrent_tracker():
+    clock = FakeClock(1000)
+    ticker = counttracker.Ticker(clock)
+    tracker = counttracker.ConcurrentCountTracker(coarse_clock=ticker)
+
+    tracker.log_event()
+    tracker.log_events(2)
+
+    assert tracker.get_event_counts(1) == 3
+
+
+def test_coarse_clock_needs_default_clock():
+    with pytest.raises(AssertionError):
+        counttracker.CountTracker(clock=FakeClock(), coarse_clock=True)
+    with pytest.raises(AssertionError):
+        counttracker.CountTracker(clock=FakeClock(), coarse_clock=counttracker.Ticker(FakeClock()))
+
+
+def test_coarse_clock_shared_ticker():
+    first = counttracker.CountTracker(coarse_clock=True)
+    second = counttracker.CountTracker(coarse_clock=True)
+
+    for _ in range(10):
+        first.log_event()
+        second.log_event()
+
+    assert first._tick is second._tick
+    assert first.get_event_counts(300) == second.get_event_counts(300) == 10
+
+
+def test_ticker_thread():
+    clock = FakeClock(1000)
+    ticker = counttracker.Ticker(clock, max_wait=0.01)
+    tick = ticker.subscribe(1)
+    ticker.start()
+    try:
+        clock.now = 1001
+        for _ in range(100):
+            if tick.bucket == 1001:
+                break
+            time.sleep(0.01)
+        assert tick.bucket == 1001
+    finally:
+        ticker.stop()
+
+    clock.now = 1002
+    time.sleep(0.02)
+    assert tick.bucket == 1001
+
+
+def test_ticker_thread_wakes_for_new_subscription():
+    clock = FakeClock(1000)
+    ticker = counttracker.Ticker(clock, max_wait=60)
+    ticker.subscribe(1 / 60)
+    ticker.start()
+    try:
+        time.sleep(0.01)
+        # The thread sleeps until the next minute, unless the subscription wakes it
+        tick = ticker.subscribe(10)
+        clock.now = 1000.5
+        for _ in range(100):
+            if tick.bucket == 10005:
+                break
+            time.sleep(0.01)
+        assert tick.bucket == 10005
+    finally:
+        ticker.stop()
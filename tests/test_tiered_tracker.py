@@ -0,0 +1,138 @@
+import random
+import time
+import pytest
+
+from .context import counttracker, patch_time
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Start on an hour boundary so bucket rounding is predictable
+    return patch_time(monkeypatch, [counttracker.tiered_tracker, counttracker.counttracker],
+                      float(int(time.time()) // 3600 * 3600))
+
+
+def test_init():
+    tracker = counttracker.TieredCountTracker()
+
+    assert len(tracker._tiers) == 3
+    assert tracker._spans == [1, 60, 3600]
+    assert tracker._ratios == [60, 60]
+    assert tracker.get_event_counts(7 * 24 * 60 * 60) == 0
+
+
+def test_init_invalid():
+    with pytest.raises(AssertionError):
+        counttracker.TieredCountTracker(tiers=())
+    with pytest.raises(AssertionError):
+        counttracker.TieredCountTracker(tiers=((300, 1), (3600, 90), (7200, 120)))
+
+
+def test_memory_is_small():
+    tracker = counttracker.TieredCountTracker()
+
+    buckets = sum(len(tier._counts) for tier in tracker._tiers)
+    assert buckets * 3 * 8 < 16 * 1024  # Three 8 byte integers per bucket
+
+
+def test_first_tier_is_exact(clock):
+    tracker = counttracker.TieredCountTracker()
+
+    tracker.log_event()
+    tracker.log_events(2, at=clock.now - 10)
+    tracker.log_events(4, at=clock.now - 299)
+
+    assert tracker.get_event_counts(1) == 1
+    assert tracker.get_event_counts(11) == 3
+    assert tracker.get_event_counts(300) == 7
+
+
+def test_buckets_roll_up(clock):
+    tracker = counttracker.TieredCountTracker()
+
+    tracker.log_events(5)
+    clock.now += 600
+    tracker.log_event()
+
+    # The first bucket has left the first tier and is now in the minute tier
+    assert tracker._tiers[1]._total == 5
+    assert tracker.get_event_counts(300) == 1
+    assert tracker.get_event_counts(601) == 6
+
+    # Buckets only leave a tier when newer buckets arrive in it
+    for _ in range(2):
+        clock.now += 2 * 60 * 60
+        tracker.log_event()
+
+    # And now the first two seconds are in the hour tier
+    assert tracker._tiers[2]._total == 6
+    assert tracker.get_event_counts(300) == 1
+    assert tracker.get_event_counts(2 * 60 * 60 + 1) == 2
+    assert tracker.get_event_counts(7 * 24 * 60 * 60) == 8
+
+
+def test_late_events_go_to_coarser_tier(clock):
+    tracker = counttracker.TieredCountTracker()
+
+    tracker.log_event()
+    tracker.log_events(3, at=clock.now - 1000)
+
+    assert tracker._tiers[1]._total == 3
+    assert tracker.get_event_counts(300) == 1
+    assert tracker.get_event_counts(1200) == 4
+
+
+def test_old_events_are_forgotten(clock):
+    tracker = counttracker.TieredCountTracker(tiers=((10, 1), (60, 10)))
+
+    tracker.log_events(5)
+    clock.now += 200
+    tracker.log_event()
+
+    assert tracker.get_event_counts(70) == 1
+
+
+def test_injected_clock():
+    now = [3600.0 * 1000]
+    tracker = counttracker.TieredCountTracker(clock=lambda: now[0])
+
+    tracker.log_event()
+    tracker.log_event(at=now[0] - 1000)
+    now[0] += 10
+
+    assert tracker.get_event_counts(10) == 0
+    assert tracker.get_event_counts(11) == 1
+    assert tracker.get_event_counts(1200) == 2
+    assert tracker.get_event_counts(1, now=now[0] - 10) == 1
+
+
+def test_matches_exact_counts(clock):
+    rng = random.Random(4)
+    tiers = ((60, 1), (600, 10), (3600, 60))
+    tracker = counttracker.TieredCountTracker(tiers=tiers)
+    start = clock.now
+    events = []
+
+    for _ in range(3000):
+        clock.now += rng.choice((0, 0.5, 1, 3, 7))
+        if rng.random() < 0.1:
+            # Late event, which may belong to any tier
+            at = clock.now - rng.randrange(2000)
+            tracker.log_events(1, at=at)
+            events.append(int(at))
+        else:
+            tracker.log_event()
+            events.append(int(clock.now))
+
+    def exact(first, last):
+        return sum(first < event <= last for event in events)
+
+    now = int(clock.now)
+    for duration in list(range(0, 61)) + [rng.randrange(61, 4260) for _ in range(100)]:
+        count = tracker.get_event_counts(duration)
+        if duration <= 60:
+            assert count == exact(now - duration, now)
+        else:
+            # Up to one coarse bucket older than the duration may be included
+            assert exact(now - duration, now) <= count <= exact(now - duration - 60, now)
+    assert clock.now - start > 4260  # The events covered every tier